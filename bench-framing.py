@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+#
+# Framing benchmark: split a synthetic EUID burst into lines the way the
+# link receives it, with LineFramer and with the LineReceiver setup Conn
+# used before it, and compare their throughput.
+#
+# usage: bench-framing.py [megabytes] [chunk size]
+
+import sys
+import time
+
+from twisted.protocols import basic
+from twisted.test.proto_helpers import StringTransport
+
+from ts6.framing import LineFramer
+
+class Framer(LineFramer):
+    lines = 0
+    def lineReceived(self, line):
+        self.lines += 1
+
+class OldFramer(basic.LineReceiver):
+    """ what Conn did before LineFramer """
+    delimiter = '\n'
+    MAX_LENGTH = 16384
+    lines = 0
+    def dataReceived(self, data):
+        basic.LineReceiver.dataReceived(self, data.replace('\r', ''))
+    def lineReceived(self, line):
+        self.lines += 1
+
+def burst(size):
+    lines = []
+    n = 0
+    total = 0
+    while total < size:
+        l = (':%02dA EUID nick%d 1 %d +i ~user%d host%d.isp.example.net '
+             '0 %02dA%06X * * :Real Name %d\r\n' % (n % 50, n, 1300000000 + n,
+                                                    n % 1000, n, n % 50, n, n))
+        lines.append(l)
+        total += len(l)
+        n += 1
+    return ''.join(lines), n
+
+def run(cls, data, chunk):
+    p = cls()
+    p.makeConnection(StringTransport())
+    start = time.time()
+    for i in xrange(0, len(data), chunk):
+        p.dataReceived(data[i:i + chunk])
+    return time.time() - start, p.lines
+
+def main(mb=40, chunk=65536):
+    data, n = burst(mb * 1048576)
+    results = {}
+    for name, cls in (('LineFramer', Framer), ('LineReceiver', OldFramer)):
+        best = None
+        for i in range(3):
+            t, lines = run(cls, data, chunk)
+            assert lines == n, (name, lines, n)
+            if best is None or t < best:
+                best = t
+        results[name] = best
+        print '%-12s %7.1f MB/s' % (name, len(data) / best / 1048576)
+    print 'speedup: %.1fx' % (results['LineReceiver'] / results['LineFramer'])
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+#
+# Memory benchmark: fill a ServerState the way a large network's burst
+# would and check the cost per remote user against ServerState.USER_BUDGET.
+#
+# usage: bench-memory.py [users] [channels per user]
+
+import gc
+import os
+import random
+import resource
+import sys
+
+from ts6.channel import Channel
+from ts6.server import Server
+from ts6.serverstate import ServerState
+
+def rss():
+    """ resident set size in bytes """
+    try:
+        f = open('/proc/self/statm')
+        pages = int(f.read().split()[1])
+        f.close()
+        return pages * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def main(users=150000, perchan=3):
+    random.seed(6)
+    # pools of the values real users share
+    hosts = ['host%d.isp%d.example.net' % (i, i % 97) for i in range(users / 30)]
+    idents = ['~user%d' % i for i in range(users / 50)] + ['znc', 'sid1']
+    gecos = ['realname', 'Unknown', 'ZNC - http://znc.in'] + \
+            ['Person %d' % i for i in range(users / 10)]
+    # most nicks and accounts have capitals in them, and those cost an
+    # IRCDict.originals entry besides the folded key
+    nicks = ['nick%d', 'Nick%d', 'NICK%d', 'niCk%d']
+    nchans = max(users / 5, 1)
+
+    state = ServerState()
+    state.sid = '90B'
+    servers = []
+    for i in range(20):
+        s = Server('%02dA' % i, 'leaf%d.example.net' % i, 'leaf')
+        servers.append(state.addServer(s))
+
+    # users and channel lists are built as strings first, the way they
+    # would arrive off the wire, so only state is counted below
+    euids = []
+    for i in range(users):
+        s = servers[i % len(servers)]
+        euids.append((s, random.choice(nicks) % i, random.choice(idents),
+                      random.choice(hosts), '*', random.choice(gecos),
+                      '+i', 1300000000 + i, i % 3 and '*' or 'Acct%d' % i,
+                      '%s%06X' % (s.sid, i),
+                      '%d.%d.%d.%d' % (random.randint(1, 223),
+                                       random.randint(0, 255),
+                                       random.randint(0, 255),
+                                       random.randint(1, 254))))
+    joins = {}
+    for e in euids:
+        for n in random.sample(xrange(nchans), perchan):
+            joins.setdefault('#chan%d' % n, []).append((e[9], 0))
+    gc.collect()
+    before = rss()
+
+    for e in euids:
+        state.addRemote(*e)
+    for name, members in joins.iteritems():
+        h = Channel(state.cmodes, name, '+nt', 1300000000)
+        state.chans[name] = h
+        state.BulkJoin(members, h)
+    gc.collect()
+    after = rss()
+
+    per = float(after - before) / users
+    print '%d users, %d channels, %d channels each' % (users, len(state.chans),
+                                                       perchan)
+    print 'state: %.1f MB, %.0f bytes per user (budget %d)' % (
+        (after - before) / 1048576.0, per, ServerState.USER_BUDGET)
+    return per <= ServerState.USER_BUDGET
+
+if __name__ == '__main__':
+    args = map(int, sys.argv[1:])
+    if not main(*args):
+        print 'over budget'
+        sys.exit(1)
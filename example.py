@@ -1,5 +1,6 @@
 from ts6.client import IRCClient, TS6Client, Client
 from ts6.ircd import IrcdFactory, IrcdConn
+from ts6.sendq import STATE
 from ts6.server import Server
 from ts6.channel import Channel
 
@@ -129,8 +130,8 @@ class NewIdoru(TS6Client):
 
 class TestIrcdConn(IrcdConn):
     password = 'acceptpw'
-    def sendLine(self, line):
-        IrcdConn.sendLine(self,line)
+    def sendLine(self, line, priority=STATE):
+        IrcdConn.sendLine(self, line, priority)
         print '-> %s' % line
 
     def lineReceived(self, line):
@@ -154,6 +155,7 @@ class TestIrcdFactory(IrcdFactory):
     protocol = TestIrcdConn
 
     def __init__(self):
+        IrcdFactory.__init__(self)
         self.state.sid = '90B'
         self.state.servername = 'ts6.grixis.local'
         self.me = Server(self.state.sid, self.state.servername, self.state.serverdesc)
@@ -166,7 +168,7 @@ class TestIrcdFactory(IrcdFactory):
 
     def clientConnectionLost(self, connector, reason):
         print 'connection lost - %s' % (reason,)
-        self.state.cleanNonLocal()
+        self.state.markStale()
         reactor.callLater(10, connector.connect)
 
 
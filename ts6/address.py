@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+
+import socket
+
+def packAddress(ip):
+    """ an IPv4 or IPv6 address in binary, or None if ip is not one """
+    for family in (socket.AF_INET, socket.AF_INET6):
+        try:
+            return socket.inet_pton(family, ip)
+        except (socket.error, ValueError):
+            pass
+    return None
+
+def unpackAddress(addr):
+    if len(addr) == 4:
+        return socket.inet_ntop(socket.AF_INET, addr)
+    return socket.inet_ntop(socket.AF_INET6, addr)
+
+def network(addr, bits):
+    """ the first bits bits of a binary address, as a string """
+    n, r = divmod(bits, 8)
+    if not r:
+        return addr[:n]
+    return addr[:n] + chr(ord(addr[n]) & (0xff00 >> r) & 0xff)
+
+def parseCIDR(hostmask):
+    """
+    (address length, prefix length, network) for a host mask like
+    10.0.0.0/8, or None if it is not an address and prefix length; cloaks
+    like unaffiliated/foo are glob masks. Raises ValueError for an address
+    with a bad prefix length.
+    """
+    if '/' not in hostmask:
+        return None
+    ip, bits = hostmask.split('/', 1)
+    addr = packAddress(ip)
+    if addr is None:
+        return None
+    if not bits.isdigit() or int(bits) > len(addr) * 8:
+        raise ValueError('bad CIDR mask %r' % (hostmask,))
+    bits = int(bits)
+    return len(addr), bits, network(addr, bits)
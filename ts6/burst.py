@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+from twisted.internet import defer
+from twisted.internet.interfaces import IPushProducer
+from zope.interface import implementer
+
+@implementer(IPushProducer)
+class BurstProducer(object):
+    """
+    Streams a burst into a L{Conn} a few steps per reactor turn.
+
+    C{steps} is an iterator whose every C{next()} sends some burst output
+    (one client introduction, one channel) through the connection. The
+    producer registers itself with the connection, which passes on the
+    transport's pause and resume requests, so no more of the burst is
+    generated than the link can take.
+
+    @ivar done: A L{Deferred} fired when the burst has been fully sent, or
+    errbacked if the connection goes away first.
+    """
+    # burst steps run per reactor turn before yielding
+    STEPS = 64
+
+    def __init__(self, conn, steps):
+        self.conn = conn
+        self.steps = iter(steps)
+        self.paused = False
+        self.stopped = False
+        self.call = None
+        self.done = defer.Deferred()
+
+    def start(self):
+        self.conn.registerProducer(self, True)
+        if not self.paused:
+            self.schedule()
+        return self.done
+
+    def schedule(self):
+        if self.call is None and not self.stopped:
+            self.call = self.conn.clock.callLater(0, self.produce)
+
+    def produce(self):
+        self.call = None
+        steps = self.steps
+        n = self.STEPS
+        try:
+            while n and not self.paused:
+                steps.next()
+                n -= 1
+        except StopIteration:
+            self.finish()
+            return
+        # hand what we have to the transport; this may pause us
+        self.conn.flush()
+        if not self.paused:
+            self.schedule()
+
+    def finish(self):
+        self.stopped = True
+        self.conn.unregisterProducer()
+        self.done.callback(None)
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+        self.schedule()
+
+    def stopProducing(self):
+        if self.stopped:
+            return
+        self.stopped = True
+        if self.call is not None:
+            self.call.cancel()
+            self.call = None
+        self.done.errback(defer.CancelledError('burst interrupted'))
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+import string
+import weakref
+
+_upper = string.ascii_uppercase
+_lower = string.ascii_lowercase
+
+# CASEMAPPING value -> translation table folding a name to its key
+tables = {
+    'ascii': string.maketrans(_upper, _lower),
+    'rfc1459': string.maketrans(_upper + '[]\\~', _lower + '{}|^'),
+    'strict-rfc1459': string.maketrans(_upper + '[]\\', _lower + '{}|'),
+}
+
+class CaseMapping(object):
+    """
+    Folds nicks and channel names to lookup keys under one CASEMAPPING.
+
+    Folded keys are cached, so a name seen over and over (a busy channel,
+    a chatty nick) is only translated once. The cache is simply emptied
+    when it reaches CACHE_MAX entries.
+
+    Every L{IRCDict} folding by a CaseMapping is refolded when
+    L{setName} changes it, so they can all share one.
+
+    @type name: C{str}
+    @ivar name: The CASEMAPPING this folds by, a key of L{tables}.
+    """
+    CACHE_MAX = 65536
+
+    def __init__(self, name='rfc1459'):
+        self.name = name
+        self.table = tables[name]
+        self.cache = {}
+        self.dicts = weakref.WeakValueDictionary()   # id -> IRCDict
+
+    def setName(self, name):
+        """ fold by CASEMAPPING name from now on, refolding every IRCDict """
+        if name == self.name:
+            return
+        self.name = name
+        self.table = tables[name]
+        self.cache = {}
+        for d in self.dicts.values():
+            d.remap(self)
+
+    def fold(self, s):
+        try:
+            return self.cache[s]
+        except KeyError:
+            cache = self.cache
+            if len(cache) >= self.CACHE_MAX:
+                cache.clear()
+            k = cache[s] = s.translate(self.table)
+            return k
+
+    def equal(self, a, b):
+        return self.fold(a) == self.fold(b)
+
+
+class IRCDict(dict):
+    """
+    A dict keyed by nick or channel name, folded by a L{CaseMapping}, so
+    any spelling of a name finds the same entry. keys() gives folded keys.
+
+    Keys that folding changed are remembered as given in C{originals}, so
+    that L{remap} folds them afresh rather than folding an already folded
+    key, which is lossy between mappings.
+    """
+    def __init__(self, casemap, items=()):
+        dict.__init__(self)
+        self.casemap = casemap
+        self.originals = {}     # folded key -> key as given, where they differ
+        casemap.dicts[id(self)] = self
+        self.update(items)
+
+    def __getitem__(self, k):
+        return dict.__getitem__(self, self.casemap.fold(k))
+
+    def __setitem__(self, k, v):
+        f = self.casemap.fold(k)
+        if f != k:
+            self.originals[f] = k
+        elif self.originals:
+            self.originals.pop(f, None)
+        dict.__setitem__(self, f, v)
+
+    def __delitem__(self, k):
+        f = self.casemap.fold(k)
+        dict.__delitem__(self, f)
+        self.originals.pop(f, None)
+
+    def __contains__(self, k):
+        return dict.__contains__(self, self.casemap.fold(k))
+
+    has_key = __contains__
+
+    def get(self, k, default=None):
+        return dict.get(self, self.casemap.fold(k), default)
+
+    def pop(self, k, *default):
+        f = self.casemap.fold(k)
+        self.originals.pop(f, None)
+        return dict.pop(self, f, *default)
+
+    def setdefault(self, k, default=None):
+        if k not in self:
+            self[k] = default
+        return self[k]
+
+    def update(self, items=()):
+        if hasattr(items, 'iteritems'):
+            items = items.iteritems()
+        for k, v in items:
+            self[k] = v
+
+    def clear(self):
+        dict.clear(self)
+        self.originals.clear()
+
+    def remap(self, casemap):
+        """ refold every key, as it was given, for a new CASEMAPPING """
+        originals = self.originals
+        items = [(originals.get(k, k), v) for k, v in dict.iteritems(self)]
+        dict.clear(self)
+        self.originals = {}
+        if casemap is not self.casemap:
+            self.casemap.dicts.pop(id(self), None)
+            casemap.dicts[id(self)] = self
+            self.casemap = casemap
+        for k, v in items:
+            self[k] = v
@@ -1,103 +1,317 @@
 #!/usr/bin/env python
 
-class Channel:
-    def __init__(self, name, modes, ts):
+from collections import OrderedDict
+from ts6.masks import MaskList
+
+class Channel(object):
+    __slots__ = ('cmodes', 'name', 'modebits', 'modeparams', 'topic',
+                 'topicsetter', 'topicTS', 'members', 'ops', 'local', 'lists',
+                 'ts')
+
+    def __init__(self, cmodes, name, modes, ts, modeargs=()):
+        # the ModeTable of the ServerState the channel belongs to
+        self.cmodes = cmodes
         self.name = name
-        self.modes = modes
+        self.setModes(modes, modeargs)
         self.topic = ''
         self.topicsetter = None
         self.topicTS = ts
-        self.clients = []
+        # uid -> status bits (see ModeTable.status), in join order
+        self.members = OrderedDict()
+        # uids of the members with OP, so finding them needs no scan
+        self.ops = set()
+        # uid -> Client for the members that are our own pseudoclients, kept
+        # separately so fanout never has to look at remote members
+        self.local = {}
+        # list mode -> MaskList, like 'b' -> the bans; None until a list
+        # mode is set, as most channels never have one
+        self.lists = None
         self.ts = ts
 
-    def joined(self, client):
-        self.clients.append(client)
-        for c in self.clients:
-            if c == client:
-                c._joined(self)
+    def setModes(self, modes, modeargs=()):
+        """ replace the simple and parameter modes, given like '+ntk' """
+        # simple modes as a bitset over cmodes
+        self.modebits = 0
+        # parameter mode -> its argument, like 'k' -> the key
+        self.modeparams = {}
+        cmodes = self.cmodes
+        args = iter(modeargs)
+        for m in modes:
+            if m in cmodes.param:
+                self.modeparams[m] = next(args, None)
+            elif m != '+' and cmodes.isSimple(m):
+                self.modebits |= cmodes.bit(m)
+
+    def modes(self):
+        """ simple and parameter modes as a string, like '+ntk' """
+        s = self.cmodes.render(self.modebits)
+        if self.modeparams:
+            s += ''.join(sorted(self.modeparams))
+        return s
+    modes = property(modes)
+
+    def modeargs(self):
+        """ the arguments to the parameter modes in L{modes}, in order """
+        params = self.modeparams
+        return [params[m] for m in sorted(params)]
+    modeargs = property(modeargs)
+
+    def hasMode(self, m):
+        cmodes = self.cmodes
+        if m in cmodes.param:
+            return m in self.modeparams
+        if m in cmodes.lists:
+            return self.lists is not None and m in self.lists
+        return self.modebits & cmodes.bit(m) != 0
+
+    def applyModes(self, added, removed, setter=None):
+        """
+        Record a parsed mode change. setter is kept with any list modes
+        it sets.
+        """
+        cmodes = self.cmodes
+        for m, a in added:
+            if m in cmodes.param:
+                self.modeparams[m] = a
+            elif m in cmodes.lists:
+                self.addMask(m, a, setter)
+            elif m in cmodes.prefix:
+                if a in self.members:
+                    self.setStatus(a, self.members[a] | cmodes.status(m))
+            elif cmodes.isSimple(m):
+                self.modebits |= cmodes.bit(m)
+        for m, a in removed:
+            if m in cmodes.param:
+                self.modeparams.pop(m, None)
+            elif m in cmodes.lists:
+                self.removeMask(m, a)
+            elif m in cmodes.prefix:
+                if a in self.members:
+                    self.setStatus(a, self.members[a] & ~cmodes.status(m))
+            elif cmodes.isSimple(m):
+                self.modebits &= ~cmodes.bit(m)
+
+    def addMask(self, m, mask, setter=None, ts=None):
+        """ add mask to list mode m; returns False if it was already set """
+        if self.lists is None:
+            self.lists = {}
+        l = self.lists.get(m)
+        if l is None:
+            l = self.lists[m] = MaskList(self.cmodes.casemap)
+        return l.add(mask, setter, ts)
+
+    def removeMask(self, m, mask):
+        if self.lists is None or m not in self.lists:
+            return None
+        l = self.lists[m]
+        r = l.remove(mask)
+        if not l:
+            del self.lists[m]
+            if not self.lists:
+                self.lists = None
+        return r
+
+    def hasMask(self, m, mask):
+        return self.lists is not None and m in self.lists and \
+               mask in self.lists[m]
+
+    def getMask(self, m, mask):
+        """ the Mask for mask on list mode m, or None """
+        if self.lists is None or m not in self.lists:
+            return None
+        return self.lists[m].get(mask)
+
+    def masks(self, m):
+        """ the Masks on list mode m, in the order they were set """
+        if self.lists is None or m not in self.lists:
+            return []
+        return list(self.lists[m])
+
+    def listMatch(self, m, client):
+        """ the first Mask on list mode m matching client, or None """
+        if self.lists is None or m not in self.lists:
+            return None
+        return self.lists[m].match(client)
+
+    def isBanned(self, client):
+        """ whether client matches a ban and no ban exception """
+        return self.listMatch('b', client) is not None and \
+               self.listMatch('e', client) is None
+
+    def isQuieted(self, client):
+        return self.listMatch('q', client) is not None and \
+               self.listMatch('e', client) is None
+
+    def isInvited(self, client):
+        """ whether client matches an invite exception """
+        return self.listMatch('I', client) is not None
+
+    def setStatus(self, uid, status):
+        self.members[uid] = status
+        if status & self.cmodes.op:
+            self.ops.add(uid)
+        else:
+            self.ops.discard(uid)
+
+    def isOp(self, uid):
+        return uid in self.ops
+
+    def hasStatus(self, uid, m):
+        """ whether member uid has prefix mode m, like 'v' """
+        return self.members.get(uid, 0) & self.cmodes.status(m) != 0
+
+    def localClients(self):
+        """ our own pseudoclients in this channel """
+        return self.local.values()
+
+    def joined(self, client, status=0):
+        watchers = self.localClients()
+        self.setStatus(client.uid, status)
+        if client.local:
+            self.local[client.uid] = client
+        for c in watchers:
+            c._userJoined(client, self)
+        client._joined(self)
+
+    def joinedBulk(self, joins, lookup):
+        """
+        Add many members at once, as from an SJOIN. joins is a list of
+        (uid, status bits); members already present only gain the
+        statuses. lookup maps a uid to its Client, or None if it has none
+        yet, and is only used to spot our own pseudoclients.
+
+        @rtype: C{list} of C{str}
+        @return: The uids that were actually added.
+        """
+        members = self.members
+        op = self.cmodes.op
+        added = []
+        for uid, status in joins:
+            if uid not in members:
+                c = lookup(uid)
+                if c is not None and c.local:
+                    self.local[uid] = c
+                added.append(uid)
             else:
-                c._userJoined(client, self)
+                status |= members[uid]
+            members[uid] = status
+            if status & op:
+                self.ops.add(uid)
+        return added
 
     def _left(self, client, message):
-        for c in self.clients:
-            if c == client:
-                c._left(self)
-            else:
-                c._userLeft(client, self, message)
-        self.clients.remove(client)
+        self.dropMember(client.uid)
+        client._left(self)
+        for c in self.localClients():
+            c._userLeft(client, self, message)
 
-    def tschange(self, newts, modes):
-        print '%s ts change %d %s' % (self, newts, modes)
+    def dropMember(self, uid):
+        """ forget a departing member without notifying anyone """
+        del self.members[uid]
+        self.local.pop(uid, None)
+        self.ops.discard(uid)
+
+    def tschange(self, newts, modes, modeargs=(), source=None):
+        """
+        Take a lower TS, as from a winning SJOIN or our own RECOVER. Under
+        TS6 our side loses its modes, list modes and every member status,
+        and the incoming modes become the channel's (the winner's lists
+        follow in BMASKs). Local members are told with a single mode change
+        covering all of it.
+        """
+        oldbits, oldparams = self.modebits, self.modeparams
         self.ts = newts
+        self.setModes(modes, modeargs)
+        added = []
+        removed = []
+        bits = self.modebits
+        changed = oldbits ^ bits
+        chars = self.cmodes.chars
+        i = 0
+        while changed >> i:
+            if changed >> i & 1:
+                if bits >> i & 1:
+                    added.append((chars[i], None))
+                else:
+                    removed.append((chars[i], None))
+            i += 1
+        params = self.modeparams
+        for m, a in oldparams.iteritems():
+            if params.get(m) != a:
+                removed.append((m, a))
+        for m, a in params.iteritems():
+            if oldparams.get(m) != a:
+                added.append((m, a))
+        members = self.members
+        for uid, status in members.iteritems():
+            if status:
+                members[uid] = 0
+                for m in self.cmodes.statusModes(status):
+                    removed.append((m, uid))
+        self.ops.clear()
+        if self.lists is not None:
+            for m, l in self.lists.iteritems():
+                for mask in l:
+                    removed.append((m, mask.mask))
+            self.lists = None
+        if added or removed:
+            for c in self.localClients():
+                if c.conn:
+                    c._modeChanged(source, self, added, removed)
 
     def __str__(self):
         return self.name
 
     def _privmsg(self, source, dest, message):
         """ distribute messages to local clients """
-        for  c in self.clients:
+        for c in self.localClients():
             if c.conn:
                 if c != source:
                     c._privmsg(source, dest, message)
 
     def _noticed(self, source, dest, message):
         """ distribute notices to local clients """
-        for c in self.clients:
+        for c in self.localClients():
             if c != source:
                 c._noticed(source, dest, message)
 
     def kick(self, kicker, kickee, message):
         """ distribute kick notifications """
-        self.clients.remove(kickee)
-        for c in self.clients:
+        self.dropMember(kickee.uid)
+        for c in self.localClients():
             c._userKicked(kickee, self, kicker, message)
         kickee._kickedFrom(self, kicker, message)
 
     def remove(self, kicker, kickee, message):
         """ distribute remove notifications """
-        self.clients.remove(kickee)
-        for c in self.clients:
+        self.dropMember(kickee.uid)
+        for c in self.localClients():
             c._userLeft(kickee, self, 'requested by %s (%s)' % (kicker.nick, message))
         kickee._left(self)
 
     def setTopic(self, client, topic):
         self.topicsetter = str(client)
         self.topic = topic
-        for c in self.clients:
+        for c in self.localClients():
             c._topicUpdated(client, self, topic)
         if client.conn:
             client.conn.topic(client, self, topic)
 
-    def topicburst(self, topicTS, topicsetter, topic):
-        if (topicTS < self.topicTS):
+    def topicburst(self, topicTS, topicsetter, topic, resync=False):
+        """
+        Apply a TB. When resyncing after a relink the burst is taken as
+        the truth, so any topic that differs from ours replaces it.
+        """
+        if (topicTS < self.topicTS or
+                (resync and topic != self.topic)):
             self.topicsetter = topicsetter
             self.topic = topic
             self.topicTS = topicTS
-            for c in self.clients:
+            for c in self.localClients():
                 c._topicUpdated(topicsetter, self, topic)
 
-    def getModeParams(self, supported):
-        """
-        Get channel modes that require parameters for correct parsing.
-
-        @rtype: C{[str, str]}
-        @return C{[add, remove]}
-        """
-        # PREFIX modes are treated as "type B" CHANMODES, they always take
-        # parameter.
-        params = ['', '']
-        prefixes = supported.getFeature('PREFIX', {})
-        params[0] = params[1] = ''.join(prefixes.iterkeys())
-
-        chanmodes = supported.getFeature('CHANMODES')
-        if chanmodes is not None:
-            params[0] += chanmodes.get('addressModes', '')
-            params[0] += chanmodes.get('param', '')
-            params[1] = params[0]
-            params[0] += chanmodes.get('setParam', '')
-        return params
-
     def _modeChanged(self, src, dest, added, removed):
-        for c in self.clients:
+        self.applyModes(added, removed, src and str(src))
+        for c in self.localClients():
             if c.conn:
                 c._modeChanged(src, dest, added, removed)
@@ -6,24 +6,49 @@ from twisted.words.protocols.irc import ctcpExtract, ctcpStringify
 from ts6.channel import Channel
 
 
-class Client:
+class Client(object):
+    # True for our own pseudoclients
+    local = False
+
+    # Remote users are the bulk of the network and have no other state;
+    # subclasses for our own pseudoclients still get a __dict__.
+    __slots__ = ('conn', 'server', 'nick', 'user', 'host', 'hiddenhost',
+                 'gecos', 'ip', 'umodes', 'modebits', 'login', 'ts', 'uid',
+                 'awaymsg', 'identified')
+
     def __init__(self, server, nick, *args, **kwargs):
         self.conn = None
+        # the user mode ModeTable of the ServerState the client belongs to
+        self.umodes = kwargs['umodes']
         self.server = server
         self.nick = nick
         if 'defaults' not in kwargs:
             kwargs['defaults'] = {}
-        for arg in ('user','host','hiddenhost','gecos','modes','login','ts','uid'):
+        for arg in ('user','host','hiddenhost','gecos','ip','modes','login','ts','uid'):
             setattr(self, arg, kwargs.get(arg, kwargs['defaults'].get(arg, None)))
         if self.hiddenhost == '*':
             self.hiddenhost = self.host
         if (self.login == '*'):
             self.login = None
-        self.chans = []
+        self.awaymsg = None
+        self.identified = False
 
     def __str__(self):
         return '%s!%s@%s' % (self.nick, self.user, self.host)
 
+    # modes : the user modes as a string like '+iw'; they are kept as a
+    # bitset over umodes in modebits
+    def _getModes(self):
+        return self.umodes.render(self.modebits)
+
+    def _setModes(self, modes):
+        self.modebits = self.umodes.mask(modes or '')
+
+    modes = property(_getModes, _setModes)
+
+    def hasMode(self, m):
+        return self.modebits & self.umodes.bit(m) != 0
+
     ### useful stuff
     def getNick(self, mask):
         return mask.split('!')[0]
@@ -143,15 +168,12 @@ class Client:
 
 
     def _left(self, channel):
-        self.chans.remove(channel)
         self.left(channel)
 
     def _joined(self, channel):
-        self.chans.append(channel)
         self.joined(channel)
 
     def _kickedFrom(self, channel, kicker, message):
-        self.chans.remove(channel)
         self.kickedFrom(channel, kicker, message)
 
     ### Methods involving me directly
@@ -212,6 +234,13 @@ class Client:
         """Called when I see another user joining a channel.
         """
 
+    def usersJoined(self, users, channel):
+        """Called when I see several users join a channel at once, as during
+        a burst. By default this calls userJoined for each of them.
+        """
+        for user in users:
+            self.userJoined(user, channel)
+
     def userLeft(self, user, channel, reason=None):
         """Called when I see another user leaving a channel.
         """
@@ -220,6 +249,13 @@ class Client:
         """Called when I see another user disconnect from the network.
         """
 
+    def usersQuit(self, users, quitMessage):
+        """Called when I see several users leave the network at once, as in
+        a netsplit. By default this calls userQuit for each of them.
+        """
+        for user in users:
+            self.userQuit(user, quitMessage)
+
     def userKicked(self, kickee, channel, kicker, message):
         """Called when I observe someone else being kicked from a channel.
         """
@@ -508,19 +544,17 @@ class Client:
         """ silently eat these """
 
     def __getstate__(self):
-        dct = self.__dict__.copy()
+        dct = getattr(self, '__dict__', {}).copy()
+        for k in Client.__slots__:
+            if hasattr(self, k):
+                dct[k] = getattr(self, k)
         dct['dcc_sessions'] = None
         dct['_pings'] = None
         return dct
 
-    def getModeParams(self, supported):
-        """
-        Get user modes that require parameters for correct parsing.
-
-        @rtype: C{[str, str]}
-        @return C{[add, remove]}
-        """
-        return ['', '']
+    def __setstate__(self, dct):
+        for k, v in dct.iteritems():
+            setattr(self, k, v)
 
     def modeChanged(self, source, dest, added, removed):
         """Called when users or channel's modes are changed.
@@ -546,19 +580,12 @@ class Client:
                 if at[1]:
                     print "unhandled user mode argument %s for %s on %s" % (at[1], at[0], self)
                 else:
-                    if at[0] not in self.modes:
-                        ml = list(self.modes)
-                        ml.append(at[0])
-                        ml.sort()
-                        self.modes = ''.join(ml)
+                    self.modebits |= self.umodes.bit(at[0])
             for at in removed:
                 if at[1]:
                     print "unhandled user mode argument for %s on %s" % (at[0], self)
                 else:
-                    if at[0] in self.modes:
-                        ml = list(self.modes)
-                        ml.remove(at[0])
-                        self.modes = ''.join(ml)
+                    self.modebits &= ~self.umodes.bit(at[0])
         self.modeChanged(source, dest, added, removed)
 
     def ChgHost(self, newhost):
@@ -573,8 +600,13 @@ class Client:
     def _userJoined(self, client, channel):
         pass
 
+    def _usersJoined(self, clients, channel):
+        pass
+
 
 class TS6Client(Client):
+    local = True
+
     def __init__(self, factory, server, nick, *args, **kwargs):
         defl = { 'user' : 'twisted',
                  'host' : server.name,
@@ -585,10 +617,16 @@ class TS6Client(Client):
                  'ts' : int(time.time()),
                  }
         kwargs['defaults'] = defl
+        kwargs.setdefault('umodes', factory.state.umodes)
         Client.__init__(self, server, nick, *args, **kwargs)
         self.factory = factory
         self.uid = server.sid + self.factory.state.mkuid()
 
+    def chans(self):
+        """ the channels I am in """
+        return list(self.factory.state.chansbyuid.get(self.uid, ()))
+    chans = property(chans)
+
     def connectionMade(self):
         """
         Called once the we're connected
@@ -663,9 +701,18 @@ class TS6Client(Client):
     def _userJoined(self, client, channel):
         self.userJoined(client, channel)
 
+    def _usersJoined(self, clients, channel):
+        self.usersJoined(clients, channel)
+
     def _userKicked(self, kickee, channel, kicker, message):
         self.userKicked(kickee, channel, kicker, message)
 
+    def _userQuit(self, client, message):
+        self.userQuit(client, message)
+
+    def _usersQuit(self, clients, message):
+        self.usersQuit(clients, message)
+
     def _userRenamed(self, oldnick, client):
         self.userRenamed(oldnick, client)
 
@@ -743,7 +790,7 @@ class IRCClient(TS6Client):
         truncate the text we are sending.  If None is passed, the entire
         message is always send in one command.
         """
-        if (dest[0] in self.supported.getFeature('CHANTYPES', {})):
+        if (dest[0] in self.supported.tables().chantypes):
             TS6Client.msg(self, self.factory.state.Channel(dest), message, length)
         else:
             TS6Client.msg(self, self.factory.state.ClientByNick(dest), message, length)
@@ -763,7 +810,7 @@ class IRCClient(TS6Client):
         @type message: C{str}
         @param message: The contents of the notice to send.
         """
-        if (dest[0] in self.supported.getFeature('CHANTYPES', {})):
+        if (dest[0] in self.supported.tables().chantypes):
             TS6Client.notice(self, self.factory.state.Channel(dest), message, length)
         else:
             TS6Client.notice(self, self.factory.state.ClientByNick(dest), message, length)
@@ -783,19 +830,23 @@ class IRCClient(TS6Client):
     def _userJoined(self, client, channel):
         self.userJoined(str(client), str(channel))
 
+    def _usersJoined(self, clients, channel):
+        self.usersJoined(map(str, clients), str(channel))
+
     def _kickedFrom(self, channel, kicker, message):
         self.kickedFrom(str(channel), str(kicker), message)
 
     def _userKicked(self, kickee, channel, kicker, message):
         self.userKicked(str(kickee), str(channel), str(kicker), message)
 
+    def _userQuit(self, client, message):
+        self.userQuit(str(client), message)
+
+    def _usersQuit(self, clients, message):
+        self.usersQuit(map(str, clients), message)
+
     def _userRenamed(self, oldnick, client):
-        visible = False
-        for ch in self.factory.state.chansbyuid[self.uid]:
-            if client in ch.clients:
-                visible = True
-        if visible:
-            self.userRenamed(oldnick, client.nick)
+        self.userRenamed(oldnick, client.nick)
 
     def _topicUpdated(self, client, channel, topic):
         self.topicUpdated(str(client), str(channel), topic)
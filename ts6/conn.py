@@ -1,58 +1,76 @@
 #!/usr/bin/env python
 
 import time
-from twisted.internet import reactor, protocol
-from twisted.protocols import basic
-from twisted.words.protocols.irc import parseModes, IRCBadModes
+from twisted.internet import defer, reactor, protocol
+from twisted.internet.interfaces import IPushProducer
+from twisted.words.protocols.irc import IRCBadModes
 
+from ts6.burst import BurstProducer
 from ts6.channel import Channel
 from ts6.client import Client
+from ts6.framing import LineFramer
+from ts6.message import parse
+from ts6.sendq import SendQueue, LINK, STATE, BULK, SHED_OLDEST
 from ts6.server import Server
 
-from itertools import islice
+from zope.interface import implementer
 
-def split_every(n, iterable):
-    i = iter(iterable)
-    piece = list(islice(i, n))
-    while piece:
-        yield piece
-        piece = list(islice(i, n))
-
-class Conn(basic.LineReceiver):
-    delimiter = '\n'
+@implementer(IPushProducer)
+class Conn(LineFramer):
     MAX_LENGTH = 16384
+    # longest line we generate, not counting CRLF
+    LINE_LENGTH = 510
+    # outbound lines are held until the end of the reactor iteration, or
+    # until this many bytes are pending, and then written in one go
+    FLUSH_THRESHOLD = 65536
+    # per-class byte limits for the sendq (link, state, bulk). BULK lines
+    # over the limit are shed as SENDQ_SHED says (see ts6.sendq; None
+    # treats BULK like STATE). Going over the STATE limit drops the link if
+    # SENDQ_DROP_LINK is set, and otherwise discards the line.
+    SENDQ_LIMITS = (None, 4 << 20, 1 << 20)
+    SENDQ_SHED = SHED_OLDEST
+    SENDQ_DROP_LINK = True
+    # handle inbound lines in bounded batches per reactor turn; see LineFramer
+    cooperative = True
+    clock = reactor
 
     farsid = None
     farcaps = None
+    wantNewClient = True
+    bursting = False
+    handlers = None
+    # the _handlerGeneration handlers was bound at, and the handlers
+    # installed by addHandler, which survive a rebind
+    boundGeneration = None
+    ownHandlers = None
+    unhandled = None
+    burstProducer = None
+    # STATE and BULK lines sent while our burst is streaming, other than the
+    # burst's own; see streamBurst
+    held = None
+    burstSent = None
     # incoming message handlers
 
     def login(self, user, acct):
-        user.login = acct
+        self.state.setLogin(user.uid, acct)
         self.sendLine(':%s ENCAP * SU %s :%s' % (self.state.sid, user.uid, acct))
 
     def logout(self, user):
-        user.login = None
+        self.state.setLogin(user.uid, None)
         self.sendLine(':%s ENCAP * SU %s' % (self.state.sid, user.uid))
 
     def scmode(self, target, modes):
         self.sendLine(':%s TMODE %ld %s %s' % (self.state.sid, target.ts, target.name, modes))
 
-    # 0    1    2    3    4  5     6    7             8 9   10   11      12
+    #      0    1    2  3     4    5             6 7   8    9       trailing
     # :sid EUID nick hops ts umode user host(visible) 0 uid host account :gecos
-    def got_euid(self, lp, suffix):
-        s = self.state.sbysid[lp[0][1:]]
-        c = Client(s, lp[2],
-                   user = lp[6],
-                   host = lp[7],
-                   hiddenhost = lp[10],
-                   gecos = suffix,
-                   modes = lp[5],
-                   ts = int(lp[4]),
-                   login = lp[11],
-                   uid = lp[9],
-                   )
-        self.state.addClient(c)
-        self.newClient(c)
+    def got_euid(self, msg):
+        p = msg.params
+        s = self.state.sbysid[msg.source]
+        new = self.state.addRemote(s, p[0], p[4], p[5], p[8], msg.trailing,
+                                   p[3], int(p[2]), p[9], p[7], p[6])
+        if new and self.wantNewClient:
+            self.newClient(self.state.Client(p[7]))
 
     def introduce(self, client):
         """ send EUID and other status for burst """
@@ -63,90 +81,115 @@ class Conn(basic.LineReceiver):
         self.sendLine(':%s ENCAP * IDENTIFIED %s %s' %
                       (self.state.sid, client.uid, client.nick))
 
-    def burstchan(self, channel):
-        """ send known channel state for burst """
+    def burstchan(self, channel, uids=None):
+        """ send known channel state for burst, or for just uids """
+        # Only our own members are sent; the burst is streamed, so remote
+        # members may already have been learned from the far side.
+        sid = self.state.sid
+        chars = self.state.cmodes.statusChars
+        if uids is None:
+            uids = channel.members
+        members = [(uid, chars(channel.members[uid]))
+                   for uid in uids if uid[:3] == sid]
+        if not members:
+            return
         print 'bursting channel %s' % (channel,)
-        clientchunks = split_every(15, channel.clients)
-        for chunk in clientchunks:
-            self.sendLine(':%s SJOIN %lu %s + :%s' %
-                          (self.state.sid, channel.ts, channel.name, ' '.join(map(lambda x: x.uid, chunk))))
+        # The first SJOIN carries the channel modes, the rest just '+'; each
+        # is filled with as many prefixed UIDs as fit in LINE_LENGTH.
+        modes = channel.modes
+        if modes[:1] != '+':
+            modes = '+' + modes
+        if channel.modeargs:
+            modes = '%s %s' % (modes, ' '.join(channel.modeargs))
+        prefix = ':%s SJOIN %lu %s %s :' % (self.state.sid, channel.ts, channel.name, modes)
+        rest = ':%s SJOIN %lu %s + :' % (self.state.sid, channel.ts, channel.name)
+        room = self.LINE_LENGTH - len(prefix) + 1
+        chunk = []
+        for uid, status in members:
+            m = status + uid
+            if chunk and len(m) + 1 > room:
+                self.sendLine(prefix + ' '.join(chunk))
+                prefix = rest
+                room = self.LINE_LENGTH - len(prefix) + 1
+                chunk = []
+            chunk.append(m)
+            room -= len(m) + 1
+        if chunk:
+            self.sendLine(prefix + ' '.join(chunk))
         if (channel.topic):
             self.sendLine(':%s TB %s %lu %s :%s' %
                           (self.state.sid, channel.name, channel.topicTS, channel.topicsetter, channel.topic))
 
     # :sid UID nick hops ts modes user host ip uid :gecos
-    def got_uid(self, lp, suffix):
-        s = self.state.sbysid[lp[0][1:]]
-        c = Client(s, lp[2],
-                   user = lp[6],
-                   host = lp[7],
-                   gecos = suffix,
-                   modes = lp[5],
-                   ts = int(lp[4]),
-                   uid = lp[9],
-                   )
-        self.state.addClient(c)
-        self.newClient(c)
+    def got_uid(self, msg):
+        p = msg.params
+        s = self.state.sbysid[msg.source]
+        new = self.state.addRemote(s, p[0], p[4], p[5], None, msg.trailing,
+                                   p[3], int(p[2]), None, p[7], p[6])
+        if new and self.wantNewClient:
+            self.newClient(self.state.Client(p[7]))
 
     # :uid QUIT :
-    def got_quit(self, lp, suffix):
-        uid = lp[0][1:]
-        c = self.state.Client(uid)
-        c.userQuit(c, suffix)
-        self.state.delClient(c)
+    def got_quit(self, msg):
+        self.state.Quit(msg.source, msg.trailing)
 
     # :uid NICK newnick :ts
-    def got_nick(self, lp, suffix):
-        uid = lp[0][1:]
-        newnick = lp[2]
-        ts = int(suffix)
-        self.state.NickChange(uid, newnick, ts)
+    def got_nick(self, msg):
+        newnick = msg.params[0]
+        if msg.trailing is not None:
+            ts = int(msg.trailing)
+        else:
+            ts = int(msg.params[1])
+        self.state.NickChange(msg.source, newnick, ts)
 
-    def got_away(self, lp, suffix):
-        uid = lp[0][1:]
-        self.state.Away(uid, suffix)
+    def got_away(self, msg):
+        self.state.Away(msg.source, msg.trailing)
 
     # :00A ENCAP * IDENTIFIED euid nick :OFF
     # :00A ENCAP * IDENTIFIED euid :nick
     # :00A IDENTIFIED euid :nick
-    def got_identified(self, lp, suffix):
-        uid = lp[2]
-        c = self.state.Client(uid)
-        c.identified = not ((len(lp) == 3) and (suffix == 'OFF'))
+    def got_identified(self, msg):
+        c = self.state.Client(msg.params[0])
+        c.identified = not ((len(msg.params) == 2) and (msg.trailing == 'OFF'))
 
     # PASS theirpw TS 6 :sid
-    def got_pass(self, lp, suffix):
-        self.farsid = suffix
+    def got_pass(self, msg):
+        self.farsid = msg.trailing
 
-    def got_capab(self, lp, suffix):
+    def got_capab(self, msg):
         """ should really handle these as well """
-        self.farcaps = suffix.split(' ')
+        self.farcaps = msg.trailing.split(' ')
 
-    def got_gcap(self, lp, suffix):
-        rcaps = suffix.split(' ')
-        s = self.state.sbysid[lp[0][1:]]
+    def got_gcap(self, msg):
+        rcaps = msg.trailing.split(' ')
+        s = self.state.sbysid[msg.source]
         s.caps = rcaps
         print "Server capabilities registered: %s (%s)" % (s, s.caps)
 
     # SERVER name hops :gecos
-    def got_server(self, lp, suffix):
-        s = Server(self.farsid, lp[1], suffix)
+    def got_server(self, msg):
+        s = Server(self.farsid, msg.params[0], msg.trailing)
         s.caps = self.farcaps
+        s = self.state.addServer(s)
         print "Server created: %s (%s)" % (s, s.caps)
-        self.state.sbysid[self.farsid] = s
-        self.state.sbyname[lp[1]] = s
         self.bursting = True
         for c in self.factory.clients:
             c.conn = self
         self.burstStart()
         self.state.conn = self
-        self.sendLine("SVINFO 6 3 0 :%lu" % int(time.time()))
+        self.sendLine("SVINFO 6 3 0 :%lu" % int(time.time()), LINK)
         self.state.burst()
 
     # :upsid SID name hops sid :gecos
-    def got_sid(self, lp, suffix):
-        s = Server(lp[4], lp[2], suffix)
-        self.state.addServer(s)
+    def got_sid(self, msg):
+        s = Server(msg.params[2], msg.params[0], msg.trailing)
+        self.state.addServer(s, self.state.sbysid[msg.source])
+
+    # :src SQUIT sid :reason
+    def got_squit(self, msg):
+        sid = msg.params[0]
+        if sid in self.state.sbysid:
+            self.state.Squit(sid, msg.trailing)
 
     def sjoin(self, client, channel):
         if client.server.sid == self.state.sid:
@@ -155,51 +198,74 @@ class Conn(basic.LineReceiver):
 
     def hack_sjoin(self, client, channel):
         if client.server.sid == self.state.sid:
-            channel.tschange(channel.ts - 1, '+')
+            channel.tschange(channel.ts - 1, '+', (), client.server)
+            # the lower TS cleared every status, ours included; the SJOIN
+            # below gives it back
+            channel._modeChanged(client.server, channel,
+                                 [('o', client.uid)], [])
             self.sjoin(client, channel)
 
     # :sid SJOIN ts name modes [args...] :uid uid...
-    def got_sjoin(self, lp, suffix):
-        src = self.findsrc(lp[0][1:])
-        (ts, name) = (int(lp[2]), lp[3])
+    def got_sjoin(self, msg):
+        p = msg.params
+        src = self.findsrc(msg.source)
+        (ts, name) = (int(p[0]), p[1])
 
-        modes = lp[4]  ### modes surely aren't in the proper format here
-        if len(lp) > 5:
-            args = lp[5:]
-        else:
-            args = []
-        uids = suffix.split(' ')
+        modes = p[2]  ### modes surely aren't in the proper format here
+        args = p[3:]
+        uids = msg.trailing.split(' ')
 
-        h = self.state.chans.get(name.lower(), None)
+        h = self.state.chans.get(name, None)
+        keepstatus = True
 
         if h:
             if (ts < h.ts):
                 # Oops. One of our clients joined a preexisting but split channel
                 # and now the split's being healed. Time to do the TS change dance!
-                h.tschange(ts, modes)
+                h.tschange(ts, modes, args, src)
 
             elif (ts == h.ts):
                 # Merge both sets of modes, since this is 'the same' channel.
-                paramModes = h.getModeParams(self.factory.supports)
+                tables = self.factory.supports.tables()
                 try:
-                    added, removed = parseModes(modes, args, paramModes)
-                except IRCBadModes, msg:
-                    print 'An error occured (%s) while parsing the following TMODE message: MODE %s' % (msg, ' '.join(lp))
+                    added, removed = tables.parseModes(modes, args)
+                except IRCBadModes, e:
+                    print 'An error occured (%s) while parsing the following SJOIN message: %s' % (e, msg)
                 else:
-                    h._modeChanged(src, h, added, removed)
+                    state = self.state
+                    if state.resyncing() and h not in state.seenmembers:
+                        # the burst is the truth: modes its first SJOIN for
+                        # the channel lacks were unset while we were away
+                        sent = set([m for (m, a) in added])
+                        removed = [(m, None)
+                                   for m in h.cmodes.render(h.modebits)[1:]
+                                   if m not in sent]
+                        removed.extend([(m, a) for m, a in h.modeparams.items()
+                                        if m not in sent])
+                    # a relink resends modes we already have; only report
+                    # the ones that are new to us
+                    added = [(m, a) for (m, a) in added
+                             if not h.hasMode(m) or
+                                (a is not None and h.modeparams.get(m) != a)]
+                    if added or removed:
+                        h._modeChanged(src, h, added, removed)
 
             elif (ts > h.ts):
-                # Disregard incoming modes altogether; just use their client list.
+                # Disregard incoming modes and statuses; just use their client list.
                 # The far side will take care of kicking remote splitriders if need
                 # be.
-                pass
+                keepstatus = False
 
         else:
-            h = Channel(name, modes, ts)
-            self.state.chans[name.lower()] = h
+            h = Channel(self.state.cmodes, name, modes, ts, args)
+            self.state.chans[name] = h
 
-        for x in uids:
-            self.state.Join(self.state.Client(x[-9:]), name)
+        status = self.state.cmodes.statusFromChars
+        if keepstatus:
+            joins = [(x[-9:], status(x[:-9])) for x in uids if x]
+        else:
+            joins = [(x[-9:], 0) for x in uids if x]
+        self.state.BulkJoin(joins, h, src, keepstatus)
 
     def join(self, client, channel):
         if client.server.sid == self.state.sid:
@@ -207,9 +273,9 @@ class Conn(basic.LineReceiver):
                           (client.uid, time.time(), channel.name))
 
     # :uid JOIN ts name +
-    def got_join(self, lp, suffix):
-        channel = lp[3]
-        client = self.state.Client(lp[0][1:])
+    def got_join(self, msg):
+        channel = msg.params[1]
+        client = self.state.Client(msg.source)
         self.state.Join(client, channel)
 
     def part(self, client, channel, reason=None):
@@ -221,52 +287,64 @@ class Conn(basic.LineReceiver):
             self.sendLine(':%s PART %s%s' % (client.uid, channel, ir))
 
     # :uid PART #test :foo
-    def got_part(self, lp, suffix):
-        if suffix:
-            msg = suffix
+    def got_part(self, msg):
+        if msg.trailing:
+            reason = msg.trailing
         else:
-            msg = ''
-        client = self.state.Client(lp[0][1:])
-        channel = self.state.Channel(lp[2])
-        self.state.Part(client, channel, msg)
+            reason = ''
+        client = self.state.Client(msg.source)
+        channel = self.state.Channel(msg.params[0])
+        self.state.Part(client, channel, reason)
 
     def topic(self, client, channel, topic):
         self.sendLine(':%s TOPIC %s :%s' % (client.uid, channel, topic))
 
-    def got_topic(self, lp, topic):
-        client = self.state.Client(lp[0][1:])
-        channel = self.state.Channel(lp[2])
-        channel.setTopic(client, topic)
-
-    def got_tb(self, lp, topic):
-        s = self.state.sbysid[lp[0][1:]]
-        channel = self.state.Channel(lp[2])
-        topicTS = int(lp[3])
-        if (len(lp) == 5):
-            topicsetter = lp[4]
+    def got_topic(self, msg):
+        client = self.state.Client(msg.source)
+        channel = self.state.Channel(msg.params[0])
+        channel.setTopic(client, msg.trailing)
+
+    def got_tb(self, msg):
+        s = self.state.sbysid[msg.source]
+        channel = self.state.Channel(msg.params[0])
+        topicTS = int(msg.params[1])
+        if (len(msg.params) == 3):
+            topicsetter = msg.params[2]
         else:
             topicsetter = str(s)
-        channel.topicburst(topicTS, topicsetter, topic)
+        self.state.confirmTopic(channel)
+        channel.topicburst(topicTS, topicsetter, msg.trailing,
+                           self.state.resyncing())
 
     # PING :arg
     # :sid PING arg :dest
-    def got_ping(self, lp, suffix):
-        if lp[0].lower() == 'ping':
-            self.sendLine('PONG %s' % lp[1])
+    def got_ping(self, msg):
+        if msg.source is None:
+            arg = msg.trailing
+            if arg is None:
+                arg = msg.params[0]
+            self.sendLine('PONG :%s' % arg, LINK)
+            self.flush()
+            if self.bursting:
+                # their burst is over; ours may still be streaming
+                self.state.reconcile()
+                self.bursting = False
+                self.burstSent.addCallback(self._burstEnded)
             return
-        farserv = self.state.sbysid[lp[0][1:]]
-        self.sendLine(':%s PONG %s :%s' % (self.factory.me.sid, self.factory.me.name, farserv.sid))
+        farserv = self.state.sbysid[msg.source]
+        self.sendLine(':%s PONG %s :%s' % (self.factory.me.sid, self.factory.me.name, farserv.sid), LINK)
+        self.flush()
 
     # SVINFO who cares
-    def got_svinfo(self, lp, suffix):
+    def got_svinfo(self, msg):
         pass
 
     # NOTICE
-    def got_notice(self, lp, message):
+    def got_notice(self, msg):
         if self.farsid:
-            source = self.uidorchan(lp[0][1:])
-            dest = self.uidorchan(lp[2])
-            dest.noticed(source, dest, message)
+            source = self.uidorchan(msg.source)
+            dest = self.uidorchan(msg.params[0])
+            dest._noticed(source, dest, msg.trailing)
 
     def notice(self, source, dest_t, message):
         # dest_t should never be a Client instance
@@ -281,51 +359,60 @@ class Conn(basic.LineReceiver):
             if dest.conn:
                 dest.noticed(source, dest, message)
             else:
-                self.sendLine(':%s NOTICE %s :%s' % (source.uid, dest.uid, message))
+                self.sendLine(':%s NOTICE %s :%s' % (source.uid, dest.uid, message), BULK)
         else:
             # destination is channel
-            self.sendLine(':%s NOTICE %s :%s' % (source.uid, dest.name, message))
+            self.sendLine(':%s NOTICE %s :%s' % (source.uid, dest.name, message), BULK)
             # distribute to local clients
-            for c in dest.clients:
+            for c in dest.localClients():
                 if c.conn:
                     c.noticed(source, dest, message)
 
-    def got_privmsg(self, lp, message):
-        source = self.uidorchan(lp[0][1:])
-        dest = self.uidorchan(lp[2])
-        dest._privmsg(source, dest, message)
+    def got_privmsg(self, msg):
+        source = self.uidorchan(msg.source)
+        dest = self.uidorchan(msg.params[0])
+        dest._privmsg(source, dest, msg.trailing)
 
     def privmsg(self, source, dest, message):
         if isinstance(dest, Client):
             if dest.conn:
                 dest._privmsg(source, dest, message)
             else:
-                self.sendLine(':%s PRIVMSG %s :%s' % (source.uid, dest.uid, message))
+                self.sendLine(':%s PRIVMSG %s :%s' % (source.uid, dest.uid, message), BULK)
         else:            # destination is channel
-            self.sendLine(':%s PRIVMSG %s :%s' % (source.uid, dest.name, message))
+            self.sendLine(':%s PRIVMSG %s :%s' % (source.uid, dest.name, message), BULK)
             # distribute to local clients
-            for c in dest.clients:
+            for c in dest.localClients():
                 if (c.conn and (c != source)):
                     c._privmsg(source, dest, message)
 
     # ENCAP, argh.
     # :src ENCAP * <cmd [args...]>
-    def got_encap(self, line):
-        lp = line.split(' ', 4)
-        newline = '%s %s %s' % (lp[0], lp[3], lp[4])
-        self.dispatch(lp[3], newline)
+    # is unwrapped in place by lineReceived and dispatched as <cmd>.
 
     # SU
-    # :sid SU uid account
-    def got_su(self, lp, suffix):
-        if len(lp) == 2:
-            cuid = suffix
-            self.state.Client(cuid).login = None
-            self.logoutClient(self.state.Client(cuid))
+    # :sid SU uid :account
+    # :sid SU uid
+    # :sid SU :uid
+    def got_su(self, msg):
+        if msg.params and msg.trailing:
+            c = self.state.Client(msg.params[0])
+            self.state.setLogin(c.uid, msg.trailing)
+            self.loginClient(c)
         else:
-            cuid = lp[2]
-            self.state.Client(cuid).login = suffix
-            self.loginClient(self.state.Client(cuid))
+            if msg.params:
+                c = self.state.Client(msg.params[0])
+            else:
+                c = self.state.Client(msg.trailing)
+            self.state.setLogin(c.uid, None)
+            self.logoutClient(c)
+
+    # LOGIN, from a server without EUID before the user is introduced
+    # :uid ENCAP * LOGIN :account
+    def got_login(self, msg):
+        c = self.state.Client(msg.source)
+        self.state.setLogin(c.uid, msg.trailing or msg.params[-1])
+        self.loginClient(c)
 
     # :sid MODE uid :+modes
     # :uid MODE uid :+modes
@@ -333,82 +420,141 @@ class Conn(basic.LineReceiver):
     # technically legal (charybdis just seems to always use TMODE instead)
     # :sid MODE channel :+modes
     # :uid MODE channel :+modes
-    def got_mode(self, lp, suffix):
-        src = self.findsrc(lp[0][1:])
-        params = suffix.split(' ')
-        modes, args = params[0], params[1:]
-        if lp[2][0] == '#':
-            dest = self.state.chans[lp[2]]
+    def got_mode(self, msg):
+        src = self.findsrc(msg.source)
+        target = msg.params[0]
+        if msg.trailing is not None:
+            params = msg.trailing.split(' ')
         else:
-            dest = self.state.Client(lp[2])
-        paramModes = dest.getModeParams(self.factory.supports)
+            params = msg.params[1:]
+        modes, args = params[0], params[1:]
+        tables = self.factory.supports.tables()
         try:
-            added, removed = parseModes(modes, args, paramModes)
+            if target[0] in tables.chantypes:
+                dest = self.state.chans[target]
+                added, removed = tables.parseModes(modes, args)
+            else:
+                dest = self.state.Client(target)
+                added, removed = tables.parseUserModes(modes)
         except IRCBadModes:
-            print 'An error occured while parsing the following MODE message: MODE %s :%s' % (lp[3], modes)
+            print 'An error occured while parsing the following MODE message: %s' % (msg,)
         else:
             dest._modeChanged(src, dest, added, removed)
 
     # :sid TMODE ts channel +modes
     # :uid TMODE ts channel +modes
     # yes, TMODE really does not use a ':' before the modes arg.
-    def got_tmode(self, lp, suffix):
-        modes, al = lp[4], lp[5:]
-        args = [a for a in al if a]
-        src = self.findsrc(lp[0][1:])
-        ts = int(lp[2])
-        dest = self.state.Channel(lp[3])
+    def got_tmode(self, msg):
+        mp = msg.params[2:]
+        if msg.trailing is not None:
+            mp.append(msg.trailing)
+        modes = mp[0]
+        args = [a for a in mp[1:] if a]
+        src = self.findsrc(msg.source)
+        ts = int(msg.params[0])
+        dest = self.state.Channel(msg.params[1])
         # We have to discard higher-TS TMODEs because they come from a newer
         # version of the channel.
         if ts > dest.ts:
             print 'TMODE: ignoring higher TS mode %s to %s from %s (%d > %d)' % (
                   modes, dest, src, ts, dest.ts)
             return
-        paramModes = dest.getModeParams(self.factory.supports)
+        tables = self.factory.supports.tables()
         try:
-            added, removed = parseModes(modes, args, paramModes)
-        except IRCBadModes, msg:
-            print 'An error occured (%s) while parsing the following TMODE message: MODE %s' % (msg, ' '.join(lp))
+            added, removed = tables.parseModes(modes, args)
+        except IRCBadModes, e:
+            print 'An error occured (%s) while parsing the following TMODE message: %s' % (e, msg)
         else:
             dest._modeChanged(src, dest, added, removed)
 
+    # :sid BMASK ts channel type :masks
+    def got_bmask(self, msg):
+        src = self.findsrc(msg.source)
+        ts = int(msg.params[0])
+        h = self.state.chans.get(msg.params[1], None)
+        m = msg.params[2]
+        # a higher TS is a newer version of the channel, whose lists lost
+        if h is None or ts > h.ts or m not in self.state.cmodes.lists:
+            return
+        masks = msg.trailing.split()
+        self.state.confirmMasks(h, m, masks)
+        # only the masks new to us are a change; the rest are a relink
+        # resending what we already have
+        added = [(m, mask) for mask in masks if not h.hasMask(m, mask)]
+        if added:
+            h._modeChanged(src, h, added, [])
+
     # :actinguid KICK channel kickeduid :message
-    def got_kick(self, lp, message):
-        kicker = self.uidorchan(lp[0][1:])
-        channel = self.uidorchan(lp[2])
-        kicked = self.uidorchan(lp[3])
-        channel.kick(kicker, kicked, message)
-
-    def got_remove(self, lp, message):
-        kicker = self.uidorchan(lp[0][1:])
-        channel = self.uidorchan(lp[2])
-        kicked = self.uidorchan(lp[3])
-        channel.remove(kicker, kicked, message)
+    def got_kick(self, msg):
+        kicker = self.findsrc(msg.source)
+        channel = self.uidorchan(msg.params[0])
+        kicked = self.uidorchan(msg.params[1])
+        self.state.Kick(kicker, channel, kicked, msg.trailing)
+
+    def got_remove(self, msg):
+        kicker = self.uidorchan(msg.source)
+        channel = self.uidorchan(msg.params[0])
+        kicked = self.uidorchan(msg.params[1])
+        self.state.Remove(kicker, channel, kicked, msg.trailing)
 
     # <- :uid KLINE * length user host :reason (time)
-    def got_kline(self, lp, message):
-        (uid, cmd, encaptarget, duration, usermask, hostmask) = lp
-        uid = uid[1:]
-        self.state.addKline(self.state.Client(uid), duration, usermask, hostmask, message)
+    # <- :uid ENCAP * KLINE length user host :reason (time)
+    def got_kline(self, msg):
+        (duration, usermask, hostmask) = msg.params[-3:]
+        try:
+            self.state.addKline(self.findsrc(msg.source), duration,
+                                usermask, hostmask, msg.trailing)
+        except ValueError, e:
+            # a CIDR mask with a bad prefix length; the ircd would have
+            # refused it, so don't guess what it meant
+            print 'ignoring K-line on %s@%s: %s' % (usermask, hostmask, e)
+
+    # <- :uid UNKLINE * user host
+    # <- :uid ENCAP * UNKLINE user host
+    def got_unkline(self, msg):
+        (usermask, hostmask) = msg.params[-2:]
+        self.state.delKline(usermask, hostmask)
 
     # <- :killeruid KILL killeeuid :servername!killerhost!killeruser!killernick (<No reason given>)
-    def got_kill(self, lp, message):
-        (killeruid, cmd, killeeuid) = lp
-        killeruid = killeruid[1:]
-        self.state.Kill(self.state.Client(killeruid), self.state.Client(killeeuid), message)
-
-    def got_chghost(self, lp, suffix):
-        self.state.Client(lp[2]).ChgHost(lp[3])
+    def got_kill(self, msg):
+        killeeuid = msg.params[0]
+        if not self.state.hasClient(killeeuid):
+            return # already gone; KILL and QUIT can cross
+        self.state.Kill(self.findsrc(msg.source), killeeuid, msg.trailing)
+
+    # :src CHGHOST uid :newhost
+    def got_chghost(self, msg):
+        if msg.trailing is not None:
+            newhost = msg.trailing
+        else:
+            newhost = msg.params[1]
+        self.state.Client(msg.params[0]).ChgHost(newhost)
 
     # Interface methods.
     def connectionMade(self):
+        self.sendq = SendQueue(self.SENDQ_LIMITS, self.SENDQ_SHED)
+        self.sendPaused = False
+        self._flushCall = None
+        self.transport.registerProducer(self, True)
+        self.bindHandlers()
         self.register()
 
+    def connectionLost(self, reason):
+        self.stopBacklog()
+        if self.burstProducer is not None:
+            self.burstProducer.stopProducing()
+            self.burstProducer = None
+        if self._flushCall is not None:
+            self._flushCall.cancel()
+            self._flushCall = None
+        self.held = None
+        self.sendq.clear()
+
     def register(self):
         # hardcoded caps :D
-        self.sendLine("PASS %s TS 6 :%s" % (self.password, self.state.sid))
-        self.sendLine("CAPAB :QS EX IE KLN UNKLN ENCAP TB SERVICES EUID EOPMOD MLOCK REMOVE")
-        self.sendLine("SERVER %s 1 :%s" % (self.state.servername, self.state.serverdesc))
+        self.sendLine("PASS %s TS 6 :%s" % (self.password, self.state.sid), LINK)
+        self.sendLine("CAPAB :QS EX IE KLN UNKLN ENCAP TB SERVICES EUID EOPMOD MLOCK REMOVE", LINK)
+        self.sendLine("SERVER %s 1 :%s" % (self.state.servername, self.state.serverdesc), LINK)
 
     # Utility methods
 
@@ -423,54 +569,230 @@ class Conn(basic.LineReceiver):
         elif src.find('.') != -1:
             return self.state.sbyname[src]
         else:
-            return self.state.cbynick[src]
+            return self.state.ClientByNick(src)
 
     def uidorchan(self, dst):
-        if dst[0] == '#':
-            return self.state.chans[dst.lower()]
+        if dst[0] in self.factory.supports.tables().chantypes:
+            return self.state.chans[dst]
         else:
             return self.state.Client(dst)
 
     def nickorchan(self, dst):
-        if dst[0] == '#':
-            return self.state.chans[dst.lower()]
+        if dst[0] in self.factory.supports.tables().chantypes:
+            return self.state.chans[dst]
         else:
-            return self.state.Client(dst.lower())
+            return self.state.ClientByNick(dst)
 
     # Some events
 
-    def sendLine(self, line):
-        basic.LineReceiver.sendLine(self, line + '\r')
-
-    def dataReceived(self, data):
-        basic.LineReceiver.dataReceived(self, data.replace('\r', ''))
-
-    def dispatch(self, cmd, line):
-        method = getattr(self, 'got_%s' % cmd.lower(), None)
+    # sendLine : string, priority class -> unit
+    # Lines are queued by class (ts6.sendq.LINK, STATE or BULK). LINK lines
+    # are written ahead of the rest; STATE and BULK lines keep the order
+    # they were sent in.
+    def sendLine(self, line, priority=STATE):
+        if self.held is not None and priority != LINK:
+            self.held.append((line, priority))
+            return
+        q = self.sendq
+        if not q.push(line, priority):
+            return self.sendqExceeded(priority)
+        if q.total >= self.FLUSH_THRESHOLD and not self.sendPaused:
+            self.flush()
+        elif self._flushCall is None:
+            self._flushCall = self.clock.callLater(0, self.flush)
+
+    def sendqExceeded(self, priority):
+        """
+        a sendq class that is not shed is over its limit: drop the link,
+        or with SENDQ_DROP_LINK off, count the line as discarded
+        """
+        if not self.SENDQ_DROP_LINK:
+            self.sendq.dropped[priority] += 1
+            return
+        if self.transport is None or self.transport.disconnecting:
+            return
+        print 'sendq exceeded, dropping link: %r' % (self.sendq.depth(),)
+        self.transport.loseConnection()
+
+    def flush(self):
+        """
+        Write pending lines now.
+
+        While the transport has asked us to pause, only LINK lines are
+        written; everything else waits for resumeProducing.
+        """
+        if self._flushCall is not None:
+            if self._flushCall.active():
+                self._flushCall.cancel()
+            self._flushCall = None
+        q = self.sendq
+        while q.total:
+            if self.sendPaused:
+                lines = q.take(q.total, LINK)
+            else:
+                lines = q.take(self.FLUSH_THRESHOLD)
+            if not lines:
+                break
+            lines.append('')
+            self.transport.write('\r\n'.join(lines))
+
+    def sendqDepth(self):
+        """ {class name: (lines, bytes)} currently waiting in the sendq """
+        return self.sendq.depth()
+
+    def sendqDropped(self):
+        """ {class name: lines} shed or discarded on this link so far """
+        return self.sendq.droppedCounts()
+
+    # streamBurst : iterator -> Deferred
+    # Runs the burst steps through a BurstProducer, so the burst is
+    # generated only as fast as the link drains. Until it is done, anything
+    # else our clients send is held back, so that nothing about a client or
+    # channel reaches the far side before its EUID or SJOIN. The Deferred
+    # fires with True once the burst and the held lines are queued, or with
+    # False if the link went away first.
+    def streamBurst(self, steps):
+        self.held = []
+        d = BurstProducer(self, self._burstSteps(steps)).start()
+        d.addCallbacks(self._burstDone, self._burstInterrupted)
+        self.burstSent = d
+        return d
+
+    def _burstSteps(self, steps):
+        """ run each step with holding off, so its own lines go out """
+        held = self.held
+        steps = iter(steps)
+        while True:
+            self.held = None
+            try:
+                step = steps.next()
+            except StopIteration:
+                return
+            finally:
+                self.held = held
+            yield step
+
+    def _burstDone(self, result):
+        held, self.held = self.held, None
+        for line, priority in held:
+            self.sendLine(line, priority)
+        return True
+
+    def _burstInterrupted(self, failure):
+        failure.trap(defer.CancelledError)
+        print 'burst interrupted: %s' % (failure.value,)
+        self.held = None
+        return False
+
+    def _burstEnded(self, sent):
+        """ both bursts are over """
+        if sent:
+            self.burstEnd()
+        return sent
+
+    # IPushProducer, registered with our transport so that bulk output is
+    # held in the sendq, not the transport buffer, while the link is busy.
+    # Pause and resume are passed on to the burst producer, if any.
+    def pauseProducing(self):
+        self.sendPaused = True
+        if self.burstProducer is not None:
+            self.burstProducer.pauseProducing()
+
+    def resumeProducing(self):
+        self.sendPaused = False
+        self.flush()
+        if self.burstProducer is not None and not self.sendPaused:
+            self.burstProducer.resumeProducing()
+
+    def stopProducing(self):
+        self.sendPaused = True
+        if self.burstProducer is not None:
+            self.burstProducer.stopProducing()
+
+    # The consumer half, for the burst producer.
+    def registerProducer(self, producer, streaming):
+        self.burstProducer = producer
+        if self.sendPaused:
+            producer.pauseProducing()
+
+    def unregisterProducer(self):
+        self.burstProducer = None
+
+    def dispatch(self, msg):
+        handlers = self.handlers
+        if handlers is None or self.boundGeneration != Conn._handlerGeneration:
+            handlers = self.bindHandlers()
+        cmd = msg.command
+        method = handlers.get(cmd)
+        if method is None:
+            cmd = cmd.upper()
+            method = handlers.get(cmd)
         if method is not None:
-            t = line.split(' :', 1)
-            if len(t) < 2:
-                t.append(None)
-            method(t[0].split(' '), t[1])
+            method(msg)
         else:
-            print 'Unhandled msg: %s' % line
+            self.unhandled[cmd] = self.unhandled.get(cmd, 0) + 1
 
     def lineReceived(self, line):
-        lp = line.split()
-        if lp[0].lower() == 'ping':
-            self.sendLine('PONG %s' % lp[1])
-            if self.bursting:
-                self.burstEnd()
-                self.bursting = False
+        try:
+            msg = parse(line)
+        except ValueError, e:
+            print 'dropping malformed line: %s' % (e,)
             return
-        if lp[0][0] != ':':
-            lk = lp[0]
-        else:
-            lk = lp[1]
-        if lk.lower() == 'encap':
-            self.got_encap(line)
-        else:
-            self.dispatch(lk, line)
+        if msg.command == 'ENCAP':
+            msg.unwrapEncap()
+        self.dispatch(msg)
+
+    # Handler registry
+
+    # handlerTable : class -> {COMMAND: attribute name}
+    # The table is built once per Conn subclass from its got_* methods and
+    # cached in the class itself; subclasses get their own table the first
+    # time one of their instances connects. registerHandler bumps
+    # _handlerGeneration, so every cached table, including those of
+    # subclasses of the class it changed, is rebuilt on next use, and live
+    # connections rebind theirs on the next line they dispatch.
+    _handlerGeneration = 0
+
+    def handlerTable(cls):
+        cached = cls.__dict__.get('_handlerTable')
+        if cached is not None and cached[0] == Conn._handlerGeneration:
+            return cached[1]
+        table = {}
+        for name in dir(cls):
+            if name.startswith('got_'):
+                table[name[4:].upper()] = name
+        cls._handlerTable = (Conn._handlerGeneration, table)
+        return table
+    handlerTable = classmethod(handlerTable)
+
+    def registerHandler(cls, cmd, method):
+        """ install method as the handler for cmd on this class """
+        setattr(cls, 'got_%s' % cmd.lower(), method)
+        Conn._handlerGeneration += 1
+    registerHandler = classmethod(registerHandler)
+
+    def bindHandlers(self):
+        """ bind the class handler table to this connection """
+        self.boundGeneration = Conn._handlerGeneration
+        self.handlers = dict([(cmd, getattr(self, name))
+                              for cmd, name in self.handlerTable().iteritems()])
+        if self.ownHandlers:
+            self.handlers.update(self.ownHandlers)
+        if self.unhandled is None:
+            self.unhandled = {}
+        # Remote users are only built into Client objects on demand, so
+        # don't build them just to call a newClient that does nothing.
+        self.wantNewClient = (getattr(self.newClient, 'im_func', None)
+                              is not Conn.newClient.im_func)
+        return self.handlers
+
+    def addHandler(self, cmd, method):
+        """ install a bound handler for cmd on this connection only """
+        if self.ownHandlers is None:
+            self.ownHandlers = {}
+        self.ownHandlers[cmd.upper()] = method
+        if self.handlers is not None:
+            self.handlers[cmd.upper()] = method
 
     # Extra interface stuff.
     def newClient(self, client):
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+
+from collections import deque
+from twisted.internet import protocol, reactor
+from twisted.python import log
+
+class LineFramer(protocol.Protocol):
+    """
+    Line framing for a TS6 link.
+
+    Incoming data is split on LF, with an optional CR before it stripped
+    from each line, so CRLF and bare LF peers both work without copying the
+    chunk first. Only an incomplete trailing line is kept between calls,
+    and only the line it belongs to is joined to it when more data comes.
+
+    In cooperative mode, complete lines go to a backlog instead, and at most
+    LINES_PER_TURN lines or TIME_PER_TURN seconds' worth of it are handled
+    per reactor turn; the rest waits for the next turn. While the backlog
+    is above BACKLOG_HIGH lines the transport is paused, and it is resumed
+    once the backlog falls to BACKLOG_LOW. An exception from lineReceived
+    is logged and the link dropped, as Twisted does for dataReceived.
+
+    @type MAX_LENGTH: C{int}
+    @ivar MAX_LENGTH: The longest line, without delimiter, that will be
+    accepted before L{lineLengthExceeded} is called.
+    """
+    delimiter = '\r\n'
+    MAX_LENGTH = 16384
+
+    cooperative = False
+    LINES_PER_TURN = 1000
+    TIME_PER_TURN = 0.02
+    BACKLOG_HIGH = 20000
+    BACKLOG_LOW = 5000
+    clock = reactor
+
+    _buffer = ''
+    _backlog = None
+    _backlogCall = None
+    _readPaused = False
+
+    def dataReceived(self, data):
+        if self.cooperative:
+            if self._backlog is None:
+                self._backlog = deque()
+            deliver = self._backlog.append
+        else:
+            deliver = self.lineReceived
+        find = data.find
+        maxlen = self.MAX_LENGTH
+        start = 0
+        end = find('\n')
+        buffer = self._buffer
+        if buffer:
+            # only the line the pending remainder belongs to is joined to
+            # it; the rest of the chunk is framed where it lies
+            if end == -1:
+                data = buffer + data
+                if len(data) > maxlen + 1:
+                    self._buffer = ''
+                    return self.lineLengthExceeded(data)
+                self._buffer = data
+                return
+            self._buffer = ''
+            line = buffer + data[:end]
+            if len(line) > maxlen + 1:
+                return self.lineLengthExceeded(line)
+            if line[-1:] == '\r':
+                line = line[:-1]
+            start = end + 1
+            if line:
+                deliver(line)
+                if self.transport is None or self.transport.disconnecting:
+                    return
+            end = find('\n', start)
+        while end != -1:
+            if end - start > maxlen + 1:
+                self._buffer = ''
+                return self.lineLengthExceeded(data[start:end])
+            if end > start and data[end - 1] == '\r':
+                line = data[start:end - 1]
+            else:
+                line = data[start:end]
+            start = end + 1
+            if line:
+                deliver(line)
+                if self.transport is None or self.transport.disconnecting:
+                    self._buffer = ''
+                    return
+            end = find('\n', start)
+        if start:
+            data = data[start:]
+        if len(data) > maxlen + 1:
+            self._buffer = ''
+            return self.lineLengthExceeded(data)
+        self._buffer = data
+        if self.cooperative and self._backlogCall is None:
+            self._processBacklog()
+
+    def _processBacklog(self):
+        self._backlogCall = None
+        q = self._backlog
+        lineReceived = self.lineReceived
+        seconds = self.clock.seconds
+        deadline = seconds() + self.TIME_PER_TURN
+        n = self.LINES_PER_TURN
+        while q:
+            try:
+                lineReceived(q.popleft())
+            except:
+                # as for an exception out of dataReceived: log it and drop
+                # the link, rather than leave the backlog stalled
+                log.err(None, 'error handling line, dropping link')
+                q.clear()
+                self.transport.loseConnection()
+                return
+            if self.transport is None or self.transport.disconnecting:
+                q.clear()
+                return
+            n -= 1
+            if not n or (not n & 31 and seconds() > deadline):
+                break
+        if q:
+            self._backlogCall = self.clock.callLater(0, self._processBacklog)
+            if len(q) > self.BACKLOG_HIGH and not self._readPaused:
+                self._readPaused = True
+                self.transport.pauseProducing()
+        if self._readPaused and len(q) <= self.BACKLOG_LOW:
+            self._readPaused = False
+            self.transport.resumeProducing()
+
+    def inboundBacklog(self):
+        """ number of received lines not yet handled """
+        if self._backlog is None:
+            return 0
+        return len(self._backlog)
+
+    def stopBacklog(self):
+        """ drop unhandled lines and stop processing them """
+        if self._backlogCall is not None:
+            self._backlogCall.cancel()
+            self._backlogCall = None
+        if self._backlog is not None:
+            self._backlog.clear()
+
+    def lineReceived(self, line):
+        """
+        Override this to handle each complete line, delimiter removed.
+        """
+        raise NotImplementedError
+
+    def sendLine(self, line):
+        self.transport.write(line + self.delimiter)
+
+    def lineLengthExceeded(self, line):
+        """
+        Called with the offending data when a line longer than MAX_LENGTH is
+        seen; the default is to drop the link.
+        """
+        return self.transport.loseConnection()
+
+    def clearLineBuffer(self):
+        """ discard and return any partially received line """
+        b = self._buffer
+        self._buffer = ''
+        return b
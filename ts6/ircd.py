@@ -1,7 +1,8 @@
 from twisted.internet import protocol
-from twisted.words.protocols.irc import ServerSupportedFeatures
 
 from ts6.conn import Conn
+from ts6.isupport import Supports
+from ts6.sendq import STATE
 from ts6.server import Server
 from ts6.serverstate import ServerState
 
@@ -14,26 +15,27 @@ class IrcdConn(Conn):
         self.state.conn = self
         Conn.connectionMade(self)
 
-    def sendLine(self, line):
-        Conn.sendLine(self, line)
+    def sendLine(self, line, priority=STATE):
+        Conn.sendLine(self, line, priority)
 
     def lineReceived(self, line):
         Conn.lineReceived(self, line)
 
-    def newClient(self, client):
-        pass
-
-    def loginClient(self, client):
-        pass
-
 class IrcdFactory(protocol.ClientFactory):
+    """
+    One services server. Its state, ISUPPORT and the mode and casemapping
+    tables built from them are its own, so factories don't share them.
+    """
     protocol = IrcdConn
-    state = ServerState()
     pseudoclientstate = {}
-    supports = ServerSupportedFeatures()
 
-    def __init__(self):
+    def __init__(self, state=None):
+        if state is None:
+            state = ServerState()
+        self.state = state
         self.me = Server(self.state.sid, self.state.servername, self.state.serverdesc)
+        self.supports = Supports()
+        self.supports.changed = self.supportsChanged
         self.supports.parse("""
             CHANTYPES=# EXCEPTS INVEX CHANMODES=eIbq,k,flj,CFLMPQScgimnprstz
             CHANLIMIT=#:120 PREFIX=(ov)@+ MAXLIST=bqeI:100 MODES=4
@@ -43,3 +45,10 @@ class IrcdFactory(protocol.ClientFactory):
             TARGMAX=NAMES:1,LIST:1,KICK:1,WHOIS:1,PRIVMSG:4,NOTICE:4,ACCEPT:,MONITOR:
             EXTBAN=$,arx WHOX CLIENTVER=3.0
             """)
+
+    def supportsChanged(self):
+        """ apply supports to the state; run whenever supports is parsed """
+        t = self.supports.tables()
+        self.state.setCasemapping(t.casemapping)
+        self.state.cmodes.configure(t.simple, t.param, t.lists, t.prefix,
+                                    t.prefixchars)
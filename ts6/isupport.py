@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+from twisted.words.protocols.irc import ServerSupportedFeatures, IRCBadModes
+
+class Tables(object):
+    """
+    What the protocol code needs from ISUPPORT, worked out once.
+
+    @type chantypes: C{str}
+    @ivar chantypes: Characters that start a channel name.
+
+    @type addParams: C{str}
+    @ivar addParams: Channel modes that take an argument when set.
+
+    @type removeParams: C{str}
+    @ivar removeParams: Channel modes that take an argument when unset.
+
+    @type simple: C{str}
+    @ivar simple: Channel modes that never take an argument.
+
+    @type param: C{str}
+    @ivar param: Single-valued parameter modes (key, limit and the like).
+
+    @type lists: C{str}
+    @ivar lists: List modes.
+
+    @type prefix: C{str}
+    @ivar prefix: Status modes, highest first, with their symbols in
+    C{prefixchars}.
+
+    @type casemapping: C{str}
+    @ivar casemapping: The CASEMAPPING name.
+    """
+    def __init__(self, supports):
+        chanmodes = supports.getFeature('CHANMODES', {})
+        prefix = supports.getFeature('PREFIX', {})
+        order = sorted(prefix, key=lambda m: prefix[m][1])
+        self.chantypes = ''.join(supports.getFeature('CHANTYPES', ('#',)))
+        self.lists = chanmodes.get('addressModes', '')
+        self.param = chanmodes.get('param', '') + chanmodes.get('setParam', '')
+        self.simple = chanmodes.get('noParam', '')
+        self.prefix = ''.join(order)
+        self.prefixchars = ''.join([prefix[m][0] for m in order])
+        self.addParams = self.prefix + self.lists + self.param
+        self.removeParams = (self.prefix + self.lists +
+                             chanmodes.get('param', ''))
+        self.casemapping = supports.getFeature('CASEMAPPING',
+                                               ('rfc1459',))[0]
+
+    def parseModes(self, modes, args):
+        """
+        Split a channel mode change into ([(mode, arg)...] added, removed).
+        A bare '+' (as in an SJOIN for a channel without modes) is no change;
+        surplus arguments are ignored.
+        """
+        added = []
+        removed = []
+        changes = added
+        takes = self.addParams
+        i = 0
+        for m in modes:
+            if m == '+':
+                changes = added
+                takes = self.addParams
+            elif m == '-':
+                changes = removed
+                takes = self.removeParams
+            elif m in takes:
+                if i == len(args):
+                    raise IRCBadModes('Not enough parameters: %r' % (m,))
+                changes.append((m, args[i]))
+                i += 1
+            else:
+                changes.append((m, None))
+        return added, removed
+
+    def parseUserModes(self, modes):
+        """ the same for user modes, which take no arguments """
+        added = []
+        removed = []
+        changes = added
+        for m in modes:
+            if m == '+':
+                changes = added
+            elif m == '-':
+                changes = removed
+            else:
+                changes.append((m, None))
+        return added, removed
+
+
+class Supports(ServerSupportedFeatures):
+    """
+    ServerSupportedFeatures that keeps its L{Tables} compiled, building
+    them again only after the features change.
+
+    @ivar changed: Called with no arguments after every L{parse}, or
+    C{None}.
+    """
+    _tables = None
+    changed = None
+
+    def parse(self, params):
+        """ as ServerSupportedFeatures.parse, also taking one string """
+        if isinstance(params, str):
+            params = params.split()
+        ServerSupportedFeatures.parse(self, params)
+        self._tables = None
+        if self.changed is not None:
+            self.changed()
+
+    def tables(self):
+        if self._tables is None:
+            self._tables = Tables(self)
+        return self._tables
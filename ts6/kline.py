@@ -0,0 +1,391 @@
+#!/usr/bin/env python
+
+from ts6.address import packAddress, unpackAddress, network, parseCIDR
+from ts6.masks import compilePattern, literal
+
+def literalPrefix(labels):
+    """ the labels up to the first one with a wildcard in it """
+    out = []
+    for l in labels:
+        if not literal(l):
+            break
+        out.append(l)
+    return out
+
+
+class LabelTrie(object):
+    """
+    Items filed under a path of host labels. Used in both directions:
+    with labels reversed ('com', 'example', ...) for names, and in order
+    ('192', '168', ...) for addresses.
+    """
+    def __init__(self):
+        self.root = {}  # label -> child node; None -> set of items here
+
+    def add(self, labels, item):
+        node = self.root
+        for l in labels:
+            node = node.setdefault(l, {})
+        node.setdefault(None, set()).add(item)
+
+    def remove(self, labels, item):
+        path = [self.root]
+        for l in labels:
+            node = path[-1].get(l)
+            if node is None:
+                return
+            path.append(node)
+        items = path[-1].get(None)
+        if items is None:
+            return
+        items.discard(item)
+        if not items:
+            del path[-1][None]
+        # prune the nodes left empty
+        for i in range(len(labels), 0, -1):
+            if path[i]:
+                break
+            del path[i - 1][labels[i - 1]]
+
+    def along(self, labels):
+        """ the items filed at every node on the path to labels """
+        node = self.root
+        for l in labels + [None]:
+            items = node.get(None)
+            if items:
+                for item in items:
+                    yield item
+            if l is None:
+                return
+            node = node.get(l)
+            if node is None:
+                return
+
+    def below(self, labels):
+        """ the items filed at labels and at every node beneath it """
+        node = self.root
+        for l in labels:
+            node = node.get(l)
+            if node is None:
+                return
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            for k, v in node.iteritems():
+                if k is None:
+                    for item in v:
+                        yield item
+                else:
+                    stack.append(v)
+
+
+class Kline(object):
+    """
+    One K-line: user@host, why, who set it and when it lapses. A glob host
+    is tested against a user's host and IP address; a CIDR host, like
+    10.0.0.0/8, against the address only.
+
+    @type expires: C{int} or C{None}
+    @ivar expires: When the K-line lapses, as a UNIX time; C{None} if it is
+    permanent.
+
+    @ivar cidr: C{(address length, prefix length, network)} for a CIDR
+    host, see L{parseCIDR}; otherwise C{None}.
+
+    @ivar timer: The L{ts6.timer.Timer} that lifts it when it lapses.
+    """
+    __slots__ = ('user', 'host', 'reason', 'setter', 'expires', 'usertest',
+                 'hosttest', 'cidr', 'timer')
+
+    def __init__(self, user, host, reason, setter=None, expires=None):
+        self.user = user
+        self.host = host
+        self.reason = reason
+        self.setter = setter
+        self.expires = expires
+        self.timer = None
+        self.usertest = compilePattern(user.lower())
+        self.cidr = parseCIDR(host)
+        if self.cidr is None:
+            self.hosttest = compilePattern(host.lower())
+        else:
+            self.hosttest = None
+
+    def matches(self, user, host, addr=None):
+        """
+        user and host are those of the user, folded to lower case, and addr
+        its binary IP address if known
+        """
+        if not self.usertest(user):
+            return False
+        cidr = self.cidr
+        if cidr is not None:
+            return addr is not None and len(addr) == cidr[0] and \
+                   network(addr, cidr[1]) == cidr[2]
+        return self.hosttest(host) or \
+               (addr is not None and self.hosttest(unpackAddress(addr)))
+
+    def expired(self, now):
+        return self.expires is not None and self.expires <= now
+
+    def __str__(self):
+        return '%s@%s' % (self.user, self.host)
+
+
+class KlineStore(object):
+    """
+    The K-lines in force, indexed so matching one user does not test them
+    all. A K-line is filed under the longer of the literal labels at the
+    end of its host (in a trie of reversed labels) or at its start (in a
+    trie of labels in order, which suits address masks like 192.168.*);
+    one with neither, like *@*.*, is filed by its user if that is literal,
+    and left in a short list to always test otherwise. CIDR K-lines are
+    filed by prefix length and network, so a user's address is looked up
+    once per prefix length in use.
+    """
+    def __init__(self):
+        self.klines = {}            # (user, host), lower case -> Kline
+        self.names = LabelTrie()
+        self.addrs = LabelTrie()
+        # (address length, prefix length) -> network -> Klines
+        self.cidrs = {}
+        self.byuser = {}            # literal user -> set of Klines
+        self.rest = set()
+
+    def __len__(self):
+        return len(self.klines)
+
+    def __iter__(self):
+        return self.klines.itervalues()
+
+    def place(self, kline):
+        """
+        where kline is filed: (trie or None, labels or user), or
+        (cidrs, L{Kline.cidr}) for a CIDR K-line
+        """
+        if kline.cidr is not None:
+            return self.cidrs, kline.cidr
+        labels = kline.host.lower().split('.')
+        rlabels = labels[:]
+        rlabels.reverse()
+        name = literalPrefix(rlabels)
+        addr = literalPrefix(labels)
+        if name and len(name) >= len(addr):
+            return self.names, name
+        if addr:
+            return self.addrs, addr
+        user = kline.user.lower()
+        if literal(user):
+            return None, user
+        return None, None
+
+    def get(self, user, host):
+        return self.klines.get((user.lower(), host.lower()))
+
+    def add(self, kline):
+        """ file kline, replacing any K-line on the same user@host """
+        self.remove(kline.user, kline.host)
+        self.klines[(kline.user.lower(), kline.host.lower())] = kline
+        trie, key = self.place(kline)
+        if trie is self.cidrs:
+            n, bits, net = key
+            nets = self.cidrs.setdefault((n, bits), {})
+            nets.setdefault(net, set()).add(kline)
+        elif trie is not None:
+            trie.add(key, kline)
+        elif key is not None:
+            self.byuser.setdefault(key, set()).add(kline)
+        else:
+            self.rest.add(kline)
+
+    def remove(self, user, host):
+        """ returns the removed Kline, or None if there was none """
+        kline = self.klines.pop((user.lower(), host.lower()), None)
+        if kline is None:
+            return None
+        trie, key = self.place(kline)
+        if trie is self.cidrs:
+            n, bits, net = key
+            nets = self.cidrs[(n, bits)]
+            ks = nets[net]
+            ks.discard(kline)
+            if not ks:
+                del nets[net]
+                if not nets:
+                    del self.cidrs[(n, bits)]
+        elif trie is not None:
+            trie.remove(key, kline)
+        elif key is not None:
+            ks = self.byuser[key]
+            ks.discard(kline)
+            if not ks:
+                del self.byuser[key]
+        else:
+            self.rest.discard(kline)
+        return kline
+
+    def match(self, user, host, addr=None, now=None):
+        """
+        the K-lines (that have not lapsed by now, if given) matching
+        user@host, or the binary address addr if given
+        """
+        user = user.lower()
+        host = host.lower()
+        labels = host.split('.')
+        rlabels = labels[:]
+        rlabels.reverse()
+        sources = [self.names.along(rlabels), self.addrs.along(labels),
+                   self.byuser.get(user, ()), self.rest]
+        if addr is not None:
+            if len(addr) == 4:
+                quad = unpackAddress(addr).split('.')
+                sources.append(self.addrs.along(quad))
+                sources.append(self.names.along(quad[::-1]))
+            for (n, bits), nets in self.cidrs.iteritems():
+                if n == len(addr):
+                    sources.append(nets.get(network(addr, bits), ()))
+        found = []
+        for candidates in sources:
+            for k in candidates:
+                if k not in found and k.matches(user, host, addr) and \
+                        not (now is not None and k.expired(now)):
+                    found.append(k)
+        return found
+
+
+class HostIndex(object):
+    """
+    The users on each host, so the users a new K-line hits can be found
+    from its host mask. Every host is filed by its reversed labels; hosts
+    starting with a number (addresses, mostly) are also filed by their
+    labels in order, for masks like 192.168.*.
+    """
+    def __init__(self):
+        self.hosts = {}     # host, lower case -> set of uids
+        self.names = LabelTrie()
+        self.addrs = LabelTrie()
+
+    def add(self, host, uid):
+        host = host.lower()
+        uids = self.hosts.get(host)
+        if uids is None:
+            uids = self.hosts[host] = set()
+            labels = host.split('.')
+            if labels[0].isdigit():
+                self.addrs.add(labels, host)
+            labels.reverse()
+            self.names.add(labels, host)
+        uids.add(uid)
+
+    def remove(self, host, uid):
+        host = host.lower()
+        uids = self.hosts.get(host)
+        if uids is None:
+            return
+        uids.discard(uid)
+        if not uids:
+            del self.hosts[host]
+            labels = host.split('.')
+            if labels[0].isdigit():
+                self.addrs.remove(labels, host)
+            labels.reverse()
+            self.names.remove(labels, host)
+
+    def find(self, hostmask):
+        """ the uids on hosts hostmask matches """
+        hostmask = hostmask.lower()
+        test = compilePattern(hostmask)
+        labels = hostmask.split('.')
+        rlabels = labels[:]
+        rlabels.reverse()
+        name = literalPrefix(rlabels)
+        addr = literalPrefix(labels)
+        if name and len(name) >= len(addr):
+            hosts = self.names.below(name)
+        elif addr and addr[0].isdigit():
+            hosts = self.addrs.below(addr)
+        else:
+            hosts = self.hosts.iterkeys()
+        uids = []
+        for h in hosts:
+            if test(h):
+                uids.extend(self.hosts[h])
+        return uids
+
+
+class AddressIndex(object):
+    """
+    The users at each IP address, so the users a CIDR K-line hits can be
+    found. Addresses are kept in binary, bucketed by their first byte;
+    most have a single user, kept as its uid rather than a set.
+    """
+    def __init__(self):
+        self.buckets = {}   # (length, first byte) -> {address: uids}
+
+    def add(self, addr, uid):
+        b = self.buckets.setdefault((len(addr), addr[0]), {})
+        uids = b.get(addr)
+        if uids is None:
+            b[addr] = uid
+        elif isinstance(uids, set):
+            uids.add(uid)
+        else:
+            b[addr] = set((uids, uid))
+
+    def remove(self, addr, uid):
+        key = (len(addr), addr[0])
+        b = self.buckets.get(key)
+        if b is None or addr not in b:
+            return
+        uids = b[addr]
+        if isinstance(uids, set):
+            uids.discard(uid)
+            if len(uids) == 1:
+                b[addr] = uids.pop()
+        elif uids == uid:
+            del b[addr]
+            if not b:
+                del self.buckets[key]
+
+    def addresses(self, hostmask):
+        """ the (address, uids) that may match hostmask """
+        cidr = parseCIDR(hostmask)
+        if cidr is not None:
+            n, bits, net = cidr
+            if bits >= 8:
+                buckets = [self.buckets.get((n, net[0]), {})]
+            else:
+                buckets = [b for (l, first), b in self.buckets.iteritems()
+                           if l == n and network(first, bits) == net]
+            for b in buckets:
+                for addr, uids in b.iteritems():
+                    if network(addr, bits) == net:
+                        yield addr, uids
+            return
+        # a glob; a literal start of a dotted quad narrows it to one bucket
+        labels = literalPrefix(hostmask.split('.'))
+        if len(labels) >= 2:
+            first = packAddress('.'.join(labels[:2] + ['0', '0']))
+            if first is None:
+                return
+            buckets = [self.buckets.get((4, first[0]), {})]
+        elif hostmask[:1].isdigit() or ':' in hostmask or \
+                not literal(hostmask[:1]):
+            buckets = self.buckets.values()
+        else:
+            return
+        test = compilePattern(hostmask.lower())
+        for b in buckets:
+            for addr, uids in b.iteritems():
+                if test(unpackAddress(addr)):
+                    yield addr, uids
+
+    def find(self, hostmask):
+        """ the uids at addresses hostmask matches """
+        out = []
+        for addr, uids in self.addresses(hostmask):
+            if isinstance(uids, set):
+                out.extend(uids)
+            else:
+                out.append(uids)
+        return out
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+
+import re
+from collections import OrderedDict
+
+from ts6.address import packAddress, network, parseCIDR
+
+# Mask kinds
+HOST = 0        # nick!user@host
+ACCOUNT = 1     # $a:account, or $a for any logged-in user
+REALNAME = 2    # $r:gecos
+FULL = 3        # $x:nick!user@host#gecos
+UNKNOWN = 4     # an extban we don't know; never matches
+
+_extbans = {'a': ACCOUNT, 'r': REALNAME, 'x': FULL}
+
+def normalize(mask):
+    """ complete a hostmask the way ircds do: 'foo' -> 'foo!*@*' """
+    if '!' not in mask:
+        if '@' in mask:
+            mask = '*!' + mask
+        else:
+            mask += '!*@*'
+    elif '@' not in mask:
+        mask += '@*'
+    return mask
+
+def compilePattern(pattern):
+    """
+    A test for one folded glob pattern: plain string comparison when it
+    has no wildcards, a compiled regular expression when it does.
+    """
+    if '*' not in pattern and '?' not in pattern:
+        return pattern.__eq__
+    r = re.escape(pattern).replace('\\*', '.*').replace('\\?', '.')
+    match = re.compile(r + r'\Z', re.S).match
+    return lambda s: match(s) is not None
+
+def literal(s):
+    return '*' not in s and '?' not in s
+
+
+class Mask(object):
+    """
+    One list mode entry, compiled once when it is set. fold is the
+    CaseMapping.fold of the channel it is set on.
+
+    @ivar mask: The mask as set.
+
+    @ivar key: C{('host', h)} or C{('account', a)} if every user the mask
+    can match has that (folded) host, address or account, and C{('net',
+    cidr)} for a CIDR host, so the mask can be found through an index;
+    otherwise C{None}.
+
+    @ivar cidr: For a host like 10.0.0.0/8, C{(address length, prefix
+    length, network)} as from L{ts6.address.parseCIDR}, and C{test} then
+    only tests nick!user; otherwise C{None}.
+    """
+    __slots__ = ('mask', 'setter', 'ts', 'kind', 'negate', 'test', 'key',
+                 'cidr')
+
+    def __init__(self, mask, fold, setter=None, ts=None):
+        self.mask = mask
+        self.setter = setter
+        self.ts = ts
+        self.negate = False
+        self.key = None
+        self.cidr = None
+        if mask[:1] != '$':
+            self.kind = HOST
+            m = fold(normalize(mask))
+            prefix, host = m.split('@', 1)
+            try:
+                self.cidr = parseCIDR(host)
+            except ValueError:
+                pass    # a bad prefix length; as a glob it matches nobody
+            if self.cidr is not None:
+                self.test = compilePattern(prefix)
+                self.key = ('net', self.cidr)
+                return
+            self.test = compilePattern(m)
+            if literal(host):
+                self.key = ('host', host)
+            return
+        ext = mask[1:]
+        if ext[:1] == '~':
+            self.negate = True
+            ext = ext[1:]
+        self.kind = _extbans.get(ext[:1], UNKNOWN)
+        arg = fold(ext[2:])
+        if self.kind == ACCOUNT and not arg:
+            self.test = None
+        else:
+            self.test = compilePattern(arg)
+        if self.kind == ACCOUNT and arg and literal(arg) and not self.negate:
+            self.key = ('account', arg)
+
+    def matches(self, client, fold):
+        kind = self.kind
+        if kind == HOST:
+            cidr = self.cidr
+            if cidr is not None:
+                addr = client.ip and packAddress(client.ip)
+                r = (addr is not None and len(addr) == cidr[0] and
+                     network(addr, cidr[1]) == cidr[2] and
+                     self.test(fold('%s!%s' % (client.nick, client.user))))
+                return r != self.negate
+            prefix = '%s!%s@' % (client.nick, client.user)
+            r = (self.test(fold(prefix + client.host)) or
+                 (client.hiddenhost is not None and
+                  self.test(fold(prefix + client.hiddenhost))) or
+                 (client.ip is not None and
+                  self.test(fold(prefix + client.ip))))
+        elif kind == ACCOUNT:
+            if client.login is None:
+                r = False
+            elif self.test is None:
+                r = True
+            else:
+                r = self.test(fold(client.login))
+        elif kind == REALNAME:
+            r = self.test(fold(client.gecos or ''))
+        elif kind == FULL:
+            r = self.test(fold('%s!%s@%s#%s' % (client.nick, client.user,
+                                                client.host, client.gecos)))
+        else:
+            return False
+        return r != self.negate
+
+    def __str__(self):
+        return self.mask
+
+
+class MaskList(object):
+    """
+    The entries of one list mode (+b, +q, +e or +I) on one channel.
+
+    Masks with a literal host or account are indexed by it, and CIDR masks
+    by their network, so matching a user only tests those filed under the
+    user's own hosts, address and account plus the masks that could not be
+    indexed, rather than every entry.
+
+    @type casemap: L{ts6.casemap.CaseMapping}
+    @ivar casemap: What masks and the names matched against them are folded
+    by; L{remap} must be called when it changes.
+    """
+    def __init__(self, casemap):
+        self.casemap = casemap
+        self.masks = OrderedDict()  # folded mask -> Mask, in order set
+        self.index = {}             # Mask.key -> set of Masks
+        self.rest = set()           # Masks without a key
+        self.nets = {}  # (address length, prefix length) -> CIDR masks
+
+    def __len__(self):
+        return len(self.masks)
+
+    def __iter__(self):
+        return self.masks.itervalues()
+
+    def __contains__(self, mask):
+        return self.casemap.fold(mask) in self.masks
+
+    def get(self, mask):
+        return self.masks.get(self.casemap.fold(mask))
+
+    def add(self, mask, setter=None, ts=None):
+        """ returns False if mask was already set """
+        fold = self.casemap.fold
+        k = fold(mask)
+        if k in self.masks:
+            return False
+        m = self.masks[k] = Mask(mask, fold, setter, ts)
+        if m.key is None:
+            self.rest.add(m)
+        else:
+            self.index.setdefault(m.key, set()).add(m)
+            if m.cidr is not None:
+                n = m.cidr[:2]
+                self.nets[n] = self.nets.get(n, 0) + 1
+        return True
+
+    def remove(self, mask):
+        """ returns the removed Mask, or None if mask was not set """
+        m = self.masks.pop(self.casemap.fold(mask), None)
+        if m is None:
+            return None
+        if m.key is None:
+            self.rest.discard(m)
+        else:
+            ms = self.index[m.key]
+            ms.discard(m)
+            if not ms:
+                del self.index[m.key]
+            if m.cidr is not None:
+                n = m.cidr[:2]
+                self.nets[n] -= 1
+                if not self.nets[n]:
+                    del self.nets[n]
+        return m
+
+    def match(self, client):
+        """ the first Mask matching client, or None """
+        fold = self.casemap.fold
+        index = self.index
+        if index:
+            keys = [('host', fold(client.host))]
+            if client.hiddenhost is not None:
+                keys.append(('host', fold(client.hiddenhost)))
+            if client.ip is not None:
+                keys.append(('host', fold(client.ip)))
+                addr = self.nets and packAddress(client.ip)
+                if addr:
+                    for n, bits in self.nets:
+                        if n == len(addr):
+                            keys.append(('net', (n, bits,
+                                                 network(addr, bits))))
+            if client.login is not None:
+                keys.append(('account', fold(client.login)))
+            for k in keys:
+                for m in index.get(k, ()):
+                    if m.matches(client, fold):
+                        return m
+        for m in self.rest:
+            if m.matches(client, fold):
+                return m
+        return None
+
+    def remap(self):
+        """ fold and compile every mask again, after casemap changed """
+        masks = self.masks.values()
+        self.masks = OrderedDict()
+        self.index = {}
+        self.rest = set()
+        self.nets = {}
+        for m in masks:
+            self.add(m.mask, m.setter, m.ts)
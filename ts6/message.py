@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+class Message(object):
+    """
+    A single TS6 protocol line, tokenized once.
+
+    @type source: C{str} or C{None}
+    @ivar source: The prefix without its leading ':', if there was one.
+
+    @type command: C{str}
+    @ivar command: The command token, as sent.
+
+    @type params: C{list} of C{str}
+    @ivar params: The middle parameters, not including the trailing one.
+
+    @type trailing: C{str} or C{None}
+    @ivar trailing: The ':'-introduced final parameter, if there was one.
+    """
+    __slots__ = ('source', 'command', 'params', 'trailing')
+
+    def __init__(self, source, command, params, trailing):
+        self.source = source
+        self.command = command
+        self.params = params
+        self.trailing = trailing
+
+    def unwrapEncap(self):
+        """ turn ':src ENCAP target CMD args...' into ':src CMD args...' """
+        params = self.params
+        self.command = params[1]
+        del params[:2]
+
+    def __str__(self):
+        parts = [self.command] + self.params
+        if self.source is not None:
+            parts.insert(0, ':' + self.source)
+        if self.trailing is not None:
+            parts.append(':' + self.trailing)
+        return ' '.join(parts)
+
+    def __repr__(self):
+        return '<Message %s>' % (self,)
+
+
+# parse : string -> Message
+# Raises ValueError for a line with no command.
+def parse(line):
+    if line[:1] == ':':
+        i = line.find(' ')
+        if i == -1:
+            raise ValueError('no command in %r' % (line,))
+        source = line[1:i]
+        start = i + 1
+    else:
+        source = None
+        start = 0
+    t = line.find(' :', start)
+    if t == -1:
+        trailing = None
+        middle = line[start:]
+    else:
+        trailing = line[t + 2:]
+        middle = line[start:t]
+    params = middle.split(' ')
+    if '' in params:
+        # runs of spaces separate parameters like a single one
+        params = [p for p in params if p]
+    if not params:
+        raise ValueError('no command in %r' % (line,))
+    command = params[0]
+    del params[0]
+    return Message(source, command, params, trailing)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+class ModeTable(object):
+    """
+    Assigns mode characters to bits, so a set of simple modes is one int.
+
+    Bits are handed out in the order characters are first seen and never
+    reassigned, so a table can learn new modes (from ISUPPORT, or from a
+    mode change nobody advertised) without invalidating stored bitsets.
+    Renderings are memoized per bitset, so equal mode sets share one
+    string and it is only built the first time that set occurs.
+
+    @type param: C{str}
+    @ivar param: Modes that take an argument and have a single value, like
+    channel key and limit; these are not given bits.
+
+    @type lists: C{str}
+    @ivar lists: List modes (bans and the like); not given bits either.
+
+    @type prefix: C{str}
+    @ivar prefix: Per-member status modes, highest first, in the order of
+    the last PREFIX configured; not given bits here. A member's statuses
+    are a separate bitset, see L{status}, whose bits are likewise never
+    reassigned when PREFIX changes.
+
+    @type prefixchars: C{str}
+    @ivar prefixchars: The NAMES/SJOIN symbol for each of C{prefix}.
+
+    @type op: C{int}
+    @ivar op: The status bit for channel operator, 'o'.
+
+    @type casemap: L{ts6.casemap.CaseMapping}
+    @ivar casemap: What list mode masks are folded by, for a channel table.
+    """
+    def __init__(self, simple='', param='', lists='', prefix='',
+                 prefixchars='', casemap=None):
+        self.bits = {}      # char -> bit
+        self.chars = []     # bit number -> char
+        self.rendered = {}  # bitset -> '+chars'
+        self.param = ''
+        self.lists = ''
+        self.prefix = ''
+        self.prefixchars = ''
+        self.statusbits = {}    # prefix mode -> status bit
+        self.statuses = {}  # status bitset -> symbols
+        self.op = 0
+        self.casemap = casemap
+        self.configure(simple, param, lists, prefix, prefixchars)
+
+    def configure(self, simple='', param='', lists='', prefix='',
+                  prefixchars=''):
+        """ learn the modes a server advertises """
+        self.param += ''.join([m for m in param if m not in self.param])
+        self.lists += ''.join([m for m in lists if m not in self.lists])
+        if prefix:
+            # PREFIX gives the rank; status modes it no longer lists rank
+            # below the rest
+            old = [(m, c) for m, c in zip(self.prefix, self.prefixchars)
+                   if m not in prefix]
+            self.prefix = prefix + ''.join([m for m, c in old])
+            self.prefixchars = prefixchars + ''.join([c for m, c in old])
+        for m in self.prefix:
+            if m not in self.statusbits:
+                self.statusbits[m] = 1 << len(self.statusbits)
+        self.op = self.statusbits.get('o', 0)
+        self.statuses = {}
+        for m in simple:
+            self.bit(m)
+
+    def bit(self, m):
+        try:
+            return self.bits[m]
+        except KeyError:
+            b = self.bits[m] = 1 << len(self.chars)
+            self.chars.append(m)
+            return b
+
+    def isSimple(self, m):
+        return m not in self.param and m not in self.lists and \
+               m not in self.prefix
+
+    def mask(self, modes):
+        """ the bitset for the simple modes in a string like '+nt' """
+        bits = 0
+        for m in modes:
+            if m != '+' and m != '-' and self.isSimple(m):
+                bits |= self.bit(m)
+        return bits
+
+    def status(self, m):
+        """ the member status bit for prefix mode m, like 'o' """
+        return self.statusbits[m]
+
+    def statusFromChars(self, s):
+        """ the member status bits for symbols like '@+' """
+        bits = 0
+        for c in s:
+            i = self.prefixchars.find(c)
+            if i != -1:
+                bits |= self.statusbits[self.prefix[i]]
+        return bits
+
+    def statusChars(self, bits):
+        """ the symbols for member status bits, highest first """
+        try:
+            return self.statuses[bits]
+        except KeyError:
+            statusbits = self.statusbits
+            s = self.statuses[bits] = ''.join(
+                [c for m, c in zip(self.prefix, self.prefixchars)
+                 if bits & statusbits[m]])
+            return s
+
+    def statusModes(self, bits):
+        """ the prefix modes for member status bits, highest first """
+        statusbits = self.statusbits
+        return [m for m in self.prefix if bits & statusbits[m]]
+
+    def render(self, bits):
+        try:
+            return self.rendered[bits]
+        except KeyError:
+            chars = self.chars
+            s = [chars[i] for i in range(len(chars)) if bits >> i & 1]
+            s.sort()
+            r = self.rendered[bits] = intern('+' + ''.join(s))
+            return r
+
+
+# Each ServerState has its own tables, starting from charybdis' defaults;
+# IrcdFactory reconfigures the channel table from the CHANMODES and PREFIX
+# it advertises.
+def userModes():
+    return ModeTable('iowsgzlaDSQRZ')
+
+def channelModes(casemap=None):
+    return ModeTable('ntimpsrcgzCFLMPQS', 'kflj', 'beIq', 'ov', '@+', casemap)
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+from collections import deque
+
+# Priority classes. LINK lines are written ahead of everything else; STATE
+# and BULK lines share one queue and go out in the order they were sent,
+# so nothing a client says can overtake its own PART, QUIT or mode change.
+LINK = 0        # PING/PONG, handshake: must never wait behind anything
+STATE = 1       # introductions, joins, modes
+BULK = 2        # notices and messages
+
+names = ('link', 'state', 'bulk')
+
+# What to do with a BULK line that would take BULK over its limit
+SHED_OLDEST = 'oldest'  # drop queued BULK lines, oldest first, to make room
+SHED_NEWEST = 'newest'  # drop the new line
+
+class SendQueue(object):
+    """
+    Outbound lines held until the owner writes them.
+
+    @type limits: C{list} of C{int} or C{None}
+    @ivar limits: Per-class byte limits. A line that would take its class
+    over its limit is refused, and the owner is expected to drop the link,
+    as an ircd does when a sendq is exceeded; BULK lines are instead shed
+    as C{shed} says, if it is set.
+
+    @ivar shed: C{SHED_OLDEST}, C{SHED_NEWEST} or C{None}.
+
+    @type dropped: C{list} of C{int}
+    @ivar dropped: Lines shed or discarded so far, per class.
+    """
+    def __init__(self, limits, shed=None):
+        self.link = deque()
+        # [class, line] for STATE and BULK; the line is None once shed
+        self.queue = deque()
+        self.bulk = deque()         # the live BULK entries of queue
+        self.shedcount = 0          # shed entries still in queue
+        self.sizes = [0] * len(limits)
+        self.counts = [0] * len(limits)
+        self.dropped = [0] * len(limits)
+        self.limits = list(limits)
+        self.shed = shed
+        self.total = 0
+
+    def push(self, line, prio):
+        """
+        queue line in class prio; returns False if it is over the limit
+        and has not been shed
+        """
+        n = len(line) + 2
+        limit = self.limits[prio]
+        if limit is not None and self.sizes[prio] + n > limit:
+            if prio != BULK or self.shed is None:
+                return False
+            if self.shed == SHED_NEWEST or n > limit:
+                self.dropped[BULK] += 1
+                return True
+            while self.sizes[BULK] + n > limit:
+                self.shedOldest()
+        if prio == LINK:
+            self.link.append(line)
+        else:
+            entry = [prio, line]
+            self.queue.append(entry)
+            if prio == BULK:
+                self.bulk.append(entry)
+        self.sizes[prio] += n
+        self.counts[prio] += 1
+        self.total += n
+        return True
+
+    def shedOldest(self):
+        """ drop the oldest BULK line, leaving its entry to be skipped """
+        entry = self.bulk.popleft()
+        n = len(entry[1]) + 2
+        entry[1] = None
+        self.sizes[BULK] -= n
+        self.counts[BULK] -= 1
+        self.dropped[BULK] += 1
+        self.total -= n
+        self.shedcount += 1
+        # while nothing is being written the shed entries would pile up
+        if self.shedcount * 2 > len(self.queue):
+            self.queue = deque([e for e in self.queue if e[1] is not None])
+            self.shedcount = 0
+
+    def take(self, budget, lowest=None):
+        """
+        Remove and return pending lines, LINK lines first and then the rest
+        in the order they were queued, until at least budget bytes have been
+        taken. With lowest=LINK only LINK lines are taken.
+        """
+        out = []
+        taken = 0
+        q = self.link
+        while q and taken < budget:
+            line = q.popleft()
+            out.append(line)
+            taken += len(line) + 2
+            self.counts[LINK] -= 1
+        self.sizes[LINK] -= taken
+        if lowest != LINK:
+            q = self.queue
+            sizes = self.sizes
+            counts = self.counts
+            while q and taken < budget:
+                prio, line = q.popleft()
+                if line is None:
+                    self.shedcount -= 1
+                    continue
+                if prio == BULK:
+                    self.bulk.popleft()
+                n = len(line) + 2
+                out.append(line)
+                taken += n
+                sizes[prio] -= n
+                counts[prio] -= 1
+        self.total -= taken
+        return out
+
+    def depth(self):
+        """ {class name: (lines, bytes)} for every class """
+        return dict([(names[i], (self.counts[i], self.sizes[i]))
+                     for i in range(len(self.sizes))])
+
+    def droppedCounts(self):
+        """ {class name: lines shed or discarded} for every class """
+        return dict(zip(names, self.dropped))
+
+    def clear(self):
+        self.link.clear()
+        self.queue.clear()
+        self.bulk.clear()
+        self.shedcount = 0
+        self.sizes = [0] * len(self.sizes)
+        self.counts = [0] * len(self.counts)
+        self.total = 0
@@ -1,11 +1,15 @@
 #!/usr/bin/env python
 
-class Server:
+class Server(object):
+    __slots__ = ('sid', 'name', 'desc', 'caps', 'uplink', 'children')
+
     def __init__(self, _sid, _name, _desc):
         self.sid = _sid
         self.name = _name
         self.desc = _desc
         self.caps = []
+        self.uplink = None      # None for the server we link to directly
+        self.children = []
 
     def __str__(self):
         return '%s:%s' % (self.sid, self.name)
@@ -1,21 +1,76 @@
 import time
+from ts6.casemap import CaseMapping, IRCDict
 from ts6.channel import Channel
+from ts6.client import Client
+from ts6.modes import userModes, channelModes
+from ts6.kline import Kline, KlineStore, HostIndex, AddressIndex
+from ts6.address import packAddress, unpackAddress
+from ts6.timer import TimingWheel
+
+# Remote users are kept as plain tuples, keyed by UID in rbyuid, until
+# something asks for them through Client() or ClientByNick(); these are the
+# field positions in such a record. R_MODES holds a bitset over
+# ServerState.umodes; R_IP the user's address in binary, or None.
+(R_SERVER, R_NICK, R_USER, R_HOST, R_HIDDENHOST, R_GECOS, R_MODES, R_TS,
+ R_LOGIN, R_AWAY, R_IP) = range(11)
 
 class ServerState:
+    # Bytes of state a remote user in three channels may cost: its record,
+    # its nick, uid, server, host, address, account and channel index
+    # entries, the original-case keys of a mixed-case nick or account, and
+    # its channel memberships. Checked by bench-memory.py; the address and
+    # its index entry for CIDR K-lines come to about 160 of these, and the
+    # original-case keys to about 130.
+    USER_BUDGET = 2304
+    # seconds state kept by markStale waits for a new link before it is
+    # dropped as cleanNonLocal would have
+    STALE_TIMEOUT = 300
+
     def __init__(self):
         self.conn = None
         self.sid = '99Z'
         self.servername = 'ts6.local'
         self.serverdesc = 'twisted-ts6 test'
-        self.chans = {}
+        self.casemap = CaseMapping('rfc1459')
+        self.umodes = userModes()
+        self.cmodes = channelModes(self.casemap)
+        self.chans = IRCDict(self.casemap)
         self.chansbyuid = {}
         self.sbysid = {}
         self.sbyname = {}
-        self.cbyuid = {}
-        self.cbynick = {}
+        self.cbyuid = {}    # uid -> Client, for clients that have one
+        self.rbyuid = {}    # uid -> record, for remote users that don't
+        self.cbynick = IRCDict(self.casemap)   # nick -> uid
+        self.clientsbysid = {}  # sid -> set of uids on that server
+        self.klines = KlineStore()
+        self.hostindex = HostIndex()    # real host -> uids, for K-lines
+        self.addrindex = AddressIndex() # address -> uids, for K-lines
+        # account -> uid, or set of uids, logged in to it
+        self.byaccount = IRCDict(self.casemap)
+        # expiries: K-lines, timed bans, services' registrations
+        self.timers = TimingWheel()
+        # set by markStale until the next burst has been reconciled
+        self.staleuids = None
+        self.stalesids = None
+        self.seenmembers = None     # channel -> uids confirmed by the burst
+        self.seenmasks = None       # channel -> (mode, mask) from BMASKs
+        self.seentopics = None      # channels with a topic from a TB
+        self.refreshed = None       # stale uids the burst has resent
+        self.staleTimer = None
         self.nextuid = [ 0, 0, 0, 0, 0, 0 ]
         self.uidchars = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
 
+    def setCasemapping(self, name):
+        """ fold nicks and channel names by CASEMAPPING name from now on """
+        if name == self.casemap.name:
+            return
+        # refolds chans, cbynick and every other IRCDict sharing casemap
+        self.casemap.setName(name)
+        for h in self.chans.itervalues():
+            if h.lists is not None:
+                for l in h.lists.itervalues():
+                    l.remap()
+
     def mkuid(self):
         uid = self.nextuid
         for i in range(5, 0, -1):
@@ -27,97 +82,519 @@ class ServerState:
 
     def cleanNonLocal(self):
         """ remove all clients and servers from local state """
-        for uid in self.cbyuid.keys():
-            if uid[:3] == self.sid:
-                continue
-            c = self.cbyuid[uid]
-            for h in c.chans:
-                h._left(c, 'netsplit')
-                if len(h.clients) == 0:
-                    del(self.chans[h.name.lower()])
-            del(self.cbynick[c.nick.lower()])
-            del(self.cbyuid[uid])
-        for sid in self.sbysid.keys():
-            if sid == self.sid:
+        for s in self.sbysid.values():
+            if s.uplink is None:
+                self.Squit(s.sid, 'netsplit')
+
+    def Squit(self, sid, reason):
+        """
+        Remove a server, everything behind it and all of their users. Each
+        of our pseudoclients that shared a channel with any of them is told
+        once, with the whole list, through _usersQuit.
+        """
+        s = self.sbysid[sid]
+        servers = [s]
+        for x in servers:
+            servers.extend(x.children)
+        if s.uplink is not None:
+            s.uplink.children.remove(s)
+        gone = []
+        for x in servers:
+            gone.extend(self.clientsbysid.pop(x.sid, ()))
+            del(self.sbysid[x.sid])
+            del(self.sbyname[x.name])
+        self.dropUsers(gone, reason)
+
+    def dropUsers(self, uids, reason):
+        """
+        Remove many users at once, telling each local pseudoclient that
+        shared a channel with any of them once, with the whole list.
+        """
+        seen = {}   # local client -> uids it shared a channel with
+        for uid in uids:
+            for h in self.chansbyuid[uid]:
+                for lc in h.local.itervalues():
+                    seen.setdefault(lc, set()).add(uid)
+                h.dropMember(uid)
+                if not h.members:
+                    self.chans.pop(h.name, None)
+            self.chansbyuid[uid] = ()
+        clients = {}
+        for lc in seen:
+            for uid in seen[lc]:
+                if uid not in clients:
+                    clients[uid] = self.Client(uid)
+        for uid in uids:
+            self.delClient(uid=uid)
+        for lc, quit in seen.iteritems():
+            lc._usersQuit([clients[uid] for uid in quit], reason)
+
+    def markStale(self):
+        """
+        Keep remote state over a lost link instead of wiping it: the next
+        burst is reconciled against it, so only what actually changed while
+        we were away is reported. See reconcile. If no new link has started
+        within STALE_TIMEOUT, the state is dropped after all.
+        """
+        self.stalesids = set(self.sbysid)
+        self.staleuids = set()
+        for sid in self.stalesids:
+            self.staleuids.update(self.clientsbysid.get(sid, ()))
+        self.seenmembers = {}
+        self.seenmasks = {}
+        self.seentopics = set()
+        self.refreshed = set()
+        if self.staleTimer is not None:
+            self.staleTimer.cancel()
+        self.staleTimer = self.timers.callLater(self.STALE_TIMEOUT,
+                                                self.staleExpired)
+
+    def staleExpired(self):
+        print 'no relink in %ds, dropping network state' % (self.STALE_TIMEOUT,)
+        self.staleTimer = None
+        self.forgetStale()
+        self.cleanNonLocal()
+
+    def forgetStale(self):
+        self.staleuids = self.stalesids = None
+        self.seenmembers = self.seenmasks = self.refreshed = None
+        self.seentopics = None
+        if self.staleTimer is not None:
+            self.staleTimer.cancel()
+            self.staleTimer = None
+
+    def resyncing(self):
+        return self.staleuids is not None
+
+    def confirmMasks(self, channel, m, masks):
+        """ note list entries resent by a BMASK while resyncing """
+        if self.seenmasks is not None:
+            self.seenmasks.setdefault(channel, set()).update(
+                [(m, mask) for mask in masks])
+
+    def confirmTopic(self, channel):
+        """ note a topic resent by a TB while resyncing """
+        if self.seentopics is not None:
+            self.seentopics.add(channel)
+
+    def reconcile(self):
+        """
+        Called at the end of a burst. Anything kept by markStale that the
+        burst did not confirm is removed now: memberships of the users it
+        resent as parts, list entries of the channels it resent as mode
+        changes, topics it did not resend as cleared, the users it did not
+        resend as one batch of quits, then servers.
+        """
+        if self.staleuids is None:
+            return
+        staleuids, stalesids = self.staleuids, self.stalesids
+        seen, seenmasks = self.seenmembers, self.seenmasks
+        seentopics = self.seentopics
+        refreshed = self.refreshed
+        self.forgetStale()
+        # only users kept over the split can have memberships the burst did
+        # not repeat; anyone new got all of theirs from it
+        for uid in refreshed:
+            for h in list(self.chansbyuid.get(uid, ())):
+                if uid not in seen.get(h, ()):
+                    self.partMember(uid, h, 'netsplit')
+        for h in seen:
+            if h.lists is None or self.chans.get(h.name) is not h:
                 continue
-            s = self.sbysid[sid]
+            confirmed = seenmasks.get(h, ())
+            removed = [(m, mask.mask) for m, l in h.lists.items()
+                       for mask in l if (m, mask.mask) not in confirmed]
+            if removed:
+                h._modeChanged(None, h, [], removed)
+        # the burst resends every topic there is, so one it left out was
+        # unset while we were away
+        for h in self.chans.values():
+            if h.topic and h not in seentopics:
+                h.topicburst(h.topicTS, None, '', True)
+        self.dropUsers(list(staleuids), 'netsplit')
+        for sid in stalesids:
+            s = self.sbysid.pop(sid)
             del(self.sbyname[s.name])
-            del(self.sbysid[sid])
+            if s.uplink is not None and s.uplink.sid not in stalesids:
+                s.uplink.children.remove(s)
+            self.clientsbysid.pop(sid, None)
 
     def burst(self):
         """ Handle pushing all known state to opposite end of connection """
-        for uid, c in self.cbyuid.iteritems():
-            if c.conn:
-                self.conn.introduce(c)
-        for channame, channel in self.chans.iteritems():
-            self.conn.burstchan(channel)
+        return self.conn.streamBurst(self.burstSteps())
+
+    def burstSteps(self):
+        """ generate the burst one client or channel at a time """
+        conn = self.conn
+        for uid in self.cbyuid.keys():
+            c = self.cbyuid.get(uid, None)
+            if c is not None and c.conn:
+                conn.introduce(c)
+                yield c
+        for name in self.chans.keys():
+            channel = self.chans.get(name, None)
+            if channel is not None:
+                conn.burstchan(channel)
+                yield channel
 
     def Channel(self, chref):
         if str(type(chref)) == """<type 'str'>""":
-            chref = self.chans[chref.lower()]
+            chref = self.chans[chref]
         return chref
 
     def ClientByNick(self, nick):
-        return self.cbynick[nick.lower()]
+        return self.Client(self.cbynick[nick])
 
     def Client(self, uid):
-        return self.cbyuid[uid]
+        try:
+            return self.cbyuid[uid]
+        except KeyError:
+            return self.materialize(uid)
+
+    def materialize(self, uid):
+        """ turn the record for a remote user into a Client """
+        rec = self.rbyuid.pop(uid)
+        c = Client(rec[R_SERVER], rec[R_NICK],
+                   user = rec[R_USER],
+                   host = rec[R_HOST],
+                   hiddenhost = rec[R_HIDDENHOST],
+                   gecos = rec[R_GECOS],
+                   ts = rec[R_TS],
+                   login = rec[R_LOGIN],
+                   ip = rec[R_IP] and unpackAddress(rec[R_IP]),
+                   uid = uid,
+                   umodes = self.umodes,
+                   )
+        c.modebits = rec[R_MODES]
+        if rec[R_AWAY] is not None:
+            c.awaymsg = rec[R_AWAY]
+        self.cbyuid[uid] = c
+        return c
+
+    def hasClient(self, uid):
+        return uid in self.cbyuid or uid in self.rbyuid
 
     def addClient(self, client):
+        self.collide(client.nick, client.uid)
         self.cbyuid[client.uid] = client
         self.chansbyuid[client.uid] = set()
-        self.cbynick[client.nick.lower()] = client
+        self.clientsbysid.setdefault(client.server.sid, set()).add(client.uid)
+        self.cbynick[client.nick] = client.uid
+        self.hostindex.add(client.hiddenhost or client.host, client.uid)
+        addr = client.ip and packAddress(client.ip)
+        if addr:
+            self.addrindex.add(addr, client.uid)
+        if client.login:
+            self.indexLogin(client.uid, None, client.login)
+
+    def addRemote(self, server, nick, user, host, hiddenhost, gecos, modes,
+                  ts, login, uid, ip=None):
+        """
+        record a remote user without building a Client for it; returns
+        False if uid was already known and has only been refreshed. ip is
+        the user's address as the EUID gives it; '0' means unknown.
+        """
+        if hiddenhost == '*' or hiddenhost is None:
+            hiddenhost = host
+        if login == '*':
+            login = None
+        # idents, hosts and gecos repeat across many users; keep one copy
+        # of each in the interpreter's intern table. An empty gecos
+        # arrives as None, and intern takes only a str.
+        user = intern(user or '')
+        host = intern(host or '')
+        hiddenhost = intern(hiddenhost or '')
+        gecos = intern(gecos or '')
+        modes = self.umodes.mask(modes)
+        addr = ip and packAddress(ip)
+        if uid in self.chansbyuid:
+            if self.staleuids is not None:
+                self.staleuids.discard(uid)
+                self.refreshed.add(uid)
+            self.refresh(server, nick, user, host, hiddenhost, gecos, modes,
+                         ts, login, uid, addr)
+            return False
+        self.collide(nick, uid)
+        self.rbyuid[uid] = (server, nick, user, host, hiddenhost, gecos,
+                            modes, ts, login, None, addr)
+        self.chansbyuid[uid] = set()
+        self.clientsbysid.setdefault(server.sid, set()).add(uid)
+        self.cbynick[nick] = uid
+        self.hostindex.add(hiddenhost, uid)
+        if addr:
+            self.addrindex.add(addr, uid)
+        if login:
+            self.indexLogin(uid, None, login)
+        return True
+
+    def refresh(self, server, nick, user, host, hiddenhost, gecos, modes,
+                ts, login, uid, addr=None):
+        """ bring a user kept over a relink up to date from its new EUID """
+        rec = self.rbyuid.get(uid, None)
+        if rec is not None:
+            oldserver, oldnick = rec[R_SERVER], rec[R_NICK]
+            oldhost = rec[R_HIDDENHOST]
+        else:
+            c = self.cbyuid[uid]
+            oldserver, oldnick = c.server, c.nick
+            oldhost = c.hiddenhost or c.host
+        oldaddr = self.userAddress(uid)
+        self.indexLogin(uid, self.userLogin(uid), login)
+        if oldhost != hiddenhost:
+            self.hostindex.remove(oldhost, uid)
+            self.hostindex.add(hiddenhost, uid)
+        if oldaddr != addr:
+            if oldaddr:
+                self.addrindex.remove(oldaddr, uid)
+            if addr:
+                self.addrindex.add(addr, uid)
+        if oldserver.sid != server.sid:
+            self.clientsbysid[oldserver.sid].discard(uid)
+            self.clientsbysid.setdefault(server.sid, set()).add(uid)
+        if oldnick != nick:
+            self.NickChange(uid, nick, ts)
+        if rec is not None:
+            self.rbyuid[uid] = (server, nick, user, host, hiddenhost, gecos,
+                                modes, ts, login, None, addr)
+        else:
+            c.server = server
+            c.user = user
+            c.host = host
+            c.hiddenhost = hiddenhost
+            c.gecos = gecos
+            c.ip = addr and unpackAddress(addr)
+            c.modebits = modes
+            c.ts = ts
+            c.login = login
+            c.awaymsg = None
+
+    def updateRemote(self, uid, field, value):
+        """ change one field of a remote user's record """
+        rec = self.rbyuid[uid]
+        self.rbyuid[uid] = rec[:field] + (value,) + rec[field + 1:]
+
+    def setLogin(self, uid, account):
+        """ log uid in to account, or out with None """
+        rec = self.rbyuid.get(uid, None)
+        if rec is not None:
+            old = rec[R_LOGIN]
+            self.updateRemote(uid, R_LOGIN, account)
+        else:
+            c = self.cbyuid[uid]
+            old = c.login
+            c.login = account
+        self.indexLogin(uid, old, account)
+
+    def indexLogin(self, uid, old, new):
+        """ move uid from account old to account new in byaccount """
+        byaccount = self.byaccount
+        if old:
+            uids = byaccount.get(old)
+            if isinstance(uids, set):
+                uids.discard(uid)
+                if len(uids) == 1:
+                    byaccount[old] = uids.pop()
+            elif uids == uid:
+                del byaccount[old]
+        if new:
+            uids = byaccount.get(new)
+            if uids is None:
+                byaccount[new] = uid
+            elif isinstance(uids, set):
+                uids.add(uid)
+            elif uids != uid:
+                byaccount[new] = set((uids, uid))
 
     def delClient(self, client = None, uid = None):
         if client:
             uid = client.uid
-        del(self.cbynick[client.nick.lower()])
+        addr = self.userAddress(uid)
+        self.indexLogin(uid, self.userLogin(uid), None)
+        rec = self.rbyuid.pop(uid, None)
+        if rec is not None:
+            nick = rec[R_NICK]
+            sid = rec[R_SERVER].sid
+            host = rec[R_HIDDENHOST]
+        else:
+            c = self.cbyuid.pop(uid)
+            nick = c.nick
+            sid = c.server.sid
+            host = c.hiddenhost or c.host
+        self.hostindex.remove(host, uid)
+        if addr:
+            self.addrindex.remove(addr, uid)
+        uids = self.clientsbysid.get(sid, None)
+        if uids is not None:
+            uids.discard(uid)
+        # after a collision the nick may already belong to someone else
+        if self.cbynick.get(nick) == uid:
+            del(self.cbynick[nick])
         del(self.chansbyuid[uid])
-        del(self.cbyuid[uid])
+
+    def collide(self, nick, uid):
+        """
+        Drop a remote user still holding nick when uid claims it. The hub
+        resolves collisions before telling us, so such a user is stale; one
+        of ours is left for the hub's KILL to remove.
+        """
+        olduid = self.cbynick.get(nick, None)
+        if olduid is None or olduid == uid:
+            return
+        if olduid in self.rbyuid or not self.cbyuid[olduid].local:
+            self.Quit(olduid, 'Nick collision')
+
+    def Quit(self, uid, message):
+        """
+        Tear down a user that quit, was killed or lost a collision: it is
+        removed from exactly the channels it was in, channels left empty are
+        destroyed, and our pseudoclients sharing a channel with it are told
+        once each.
+        """
+        chans = self.chansbyuid[uid]
+        watchers = set()
+        for h in chans:
+            watchers.update(h.local.itervalues())
+        if watchers or uid in self.cbyuid:
+            c = self.Client(uid)
+            watchers.discard(c)
+        for h in chans:
+            h.dropMember(uid)
+            if not h.members:
+                self.chans.pop(h.name, None)
+        self.delClient(uid=uid)
+        for lc in watchers:
+            lc._userQuit(c, message)
 
     def NickChange(self, uid, newnick, ts):
+        """
+        Only our pseudoclients that share a channel with the user are told,
+        each once.
+        """
+        rec = self.rbyuid.get(uid, None)
+        if rec is not None:
+            oldnick = rec[R_NICK]
+            self.updateRemote(uid, R_NICK, newnick)
+            self.updateRemote(uid, R_TS, ts)
+        else:
+            c = self.cbyuid[uid]
+            oldnick = c.nick
+            c.nick = newnick
+            c.ts = ts
+            c.identified = False
+        if not self.casemap.equal(newnick, oldnick):
+            self.collide(newnick, uid)
+        self.cbynick[newnick] = self.cbynick.pop(oldnick)
+        watchers = set()
+        for h in self.chansbyuid[uid]:
+            watchers.update(h.local.itervalues())
+        if not watchers:
+            return
         c = self.Client(uid)
-        oldnick = c.nick
-        self.cbynick[newnick.lower()] = self.cbynick.pop(oldnick.lower())
-        c.nick = newnick
-        c.ts = ts
-        c.identified = False
-        for nick, lc in self.cbynick.iteritems():
-            if (lc.conn and (lc != c)):
-                lc._userRenamed(oldnick, c)
+        watchers.discard(c)
+        for lc in watchers:
+            lc._userRenamed(oldnick, c)
 
     def Join(self, client, channel):
         created = False
         if getattr(channel, 'name', None):
             tc = channel
         else:
-            cn = channel.lower()
-            tc = self.chans.get(cn, None)
+            tc = self.chans.get(channel, None)
         if not tc:
-            tc = Channel(cn, 'nt', int(time.time()))
-            self.chans[cn] = tc
+            tc = Channel(self.cmodes, channel, 'nt', int(time.time()))
+            self.chans[channel] = tc
             created = True
-        if client not in tc.clients:
+        if self.seenmembers is not None:
+            self.seenmembers.setdefault(tc, set()).add(client.uid)
+        if client.uid not in tc.members:
             if self.conn:
                 if created:
                     self.conn.sjoin(client, tc)
                 else:
                     self.conn.join(client, tc)
             self.chansbyuid[client.uid].add(tc)
-            tc.joined(client)
+            if created:
+                tc.joined(client, self.cmodes.op)
+            else:
+                tc.joined(client)
+
+    def BulkJoin(self, joins, channel, source=None, exact=False):
+        """
+        called from Conn.got_sjoin with the remote members of one SJOIN, as
+        (uid, status bits). With exact set, while resyncing, members kept
+        over the split take the statuses given rather than gaining them,
+        and the ones they lose are reported as mode changes from source.
+        """
+        tc = self.Channel(channel)
+        watchers = tc.localClients()
+        lost = []
+        if self.seenmembers is not None:
+            seen = self.seenmembers.setdefault(tc, set())
+            if exact:
+                modes = self.cmodes.statusModes
+                members = tc.members
+                for uid, status in joins:
+                    old = members.get(uid, 0)
+                    if old & ~status and uid not in seen:
+                        lost.extend([(m, uid) for m in modes(old & ~status)])
+            seen.update([uid for uid, status in joins])
+        added = tc.joinedBulk(joins, self.cbyuid.get)
+        if lost:
+            tc._modeChanged(source, tc, [], lost)
+        for uid in added:
+            self.chansbyuid[uid].add(tc)
+        if added and watchers:
+            clients = [self.Client(uid) for uid in added]
+            for c in watchers:
+                c._usersJoined(clients, tc)
 
     def Part(self, client, channel, reason=None):
         """ called from Conn.got_part and ServerState.leave """
         tc = self.Channel(channel)
         self.chansbyuid[client.uid].remove(tc)
-        if client in tc.clients:
+        if client.uid in tc.members:
             if client.conn:
                 self.conn.part(client, tc, reason)
             tc._left(client, reason) # manages notifications of local clients
+        self.reap(tc)
+
+    def partMember(self, uid, channel, reason):
+        """
+        Remove a remote member on the burst's word rather than a PART; a
+        Client is built for it only if our pseudoclients there are told.
+        """
+        self.chansbyuid[uid].discard(channel)
+        c = self.cbyuid.get(uid, None)
+        if c is None and channel.local:
+            c = self.Client(uid)
+        if c is not None:
+            channel._left(c, reason)
+        else:
+            channel.dropMember(uid)
+        self.reap(channel)
+
+    def Kick(self, kicker, channel, kickee, message):
+        """ called from Conn.got_kick """
+        self.chansbyuid[kickee.uid].discard(channel)
+        channel.kick(kicker, kickee, message)
+        self.reap(channel)
+
+    def Remove(self, kicker, channel, kickee, message):
+        """ called from Conn.got_remove """
+        self.chansbyuid[kickee.uid].discard(channel)
+        channel.remove(kicker, kickee, message)
+        self.reap(channel)
+
+    def reap(self, channel):
+        """ destroy channel if its last member has gone """
+        if not channel.members:
+            self.chans.pop(channel.name, None)
 
     def Away(self, uid, msg):
-        c = self.Client(uid)
-        c.away = msg
+        if uid in self.rbyuid:
+            self.updateRemote(uid, R_AWAY, msg)
+        else:
+            self.Client(uid).awaymsg = msg
 
     def Notice(self, client, target, msg):
         self.conn.notice(client, target, msg)
@@ -126,11 +603,153 @@ class ServerState:
         self.conn.privmsg(client, target, msg)
 
     def addKline(self, kliner, duration, usermask, hostmask, reason):
-        pass
+        """
+        Record a K-line, replacing any on the same user@host. duration is
+        in seconds, 0 for a permanent K-line. Returns the Kline; see
+        usersMatching for the users it hits.
+        """
+        duration = int(duration)
+        if duration:
+            expires = int(time.time()) + duration
+        else:
+            expires = None
+        k = Kline(usermask, hostmask, reason, kliner and str(kliner), expires)
+        self.delKline(usermask, hostmask)
+        self.klines.add(k)
+        if expires is not None:
+            k.timer = self.timers.callLater(duration, self.expireKline, k)
+        return k
+
+    def delKline(self, usermask, hostmask):
+        """ returns the removed Kline, or None if there was none """
+        k = self.klines.remove(usermask, hostmask)
+        if k is not None and k.timer is not None:
+            k.timer.cancel()
+        return k
+
+    def expireKline(self, kline):
+        if self.klines.get(kline.user, kline.host) is kline:
+            print 'K-line %s expired' % (kline,)
+            self.klines.remove(kline.user, kline.host)
+
+    def userHost(self, uid):
+        """ the ident and real host of a user, as K-lines see them """
+        rec = self.rbyuid.get(uid, None)
+        if rec is not None:
+            return rec[R_USER], rec[R_HIDDENHOST]
+        c = self.cbyuid[uid]
+        return c.user, c.hiddenhost or c.host
+
+    def userAddress(self, uid):
+        """ the address of a user in binary, or None if it is not known """
+        rec = self.rbyuid.get(uid, None)
+        if rec is not None:
+            return rec[R_IP]
+        ip = self.cbyuid[uid].ip
+        return ip and packAddress(ip)
+
+    def userLogin(self, uid):
+        """ the account a user is logged in to, or None """
+        rec = self.rbyuid.get(uid, None)
+        if rec is not None:
+            return rec[R_LOGIN]
+        return self.cbyuid[uid].login
+
+    def usersLoggedIn(self, account):
+        """ the uids of the users logged in to account """
+        uids = self.byaccount.get(account)
+        if uids is None:
+            return []
+        if isinstance(uids, set):
+            return list(uids)
+        return [uids]
+
+    def klinesFor(self, uid):
+        """ the K-lines in force that match a user """
+        user, host = self.userHost(uid)
+        return self.klines.match(user, host, self.userAddress(uid),
+                                 time.time())
+
+    def usersMatching(self, kline):
+        """ the uids of the users kline hits """
+        uids = []
+        found = self.addrindex.find(kline.host)
+        if kline.cidr is None:
+            found = self.hostindex.find(kline.host) + found
+        seen = set()
+        for uid in found:
+            if uid in seen:
+                continue
+            seen.add(uid)
+            user, host = self.userHost(uid)
+            if kline.matches(user.lower(), host.lower(),
+                             self.userAddress(uid)):
+                uids.append(uid)
+        return uids
+
+    def timedBan(self, channel, mask, duration, m='b'):
+        """
+        Set mask on list mode m of channel from our server, and take it off
+        again after duration seconds unless it has gone by then.
+        """
+        if not channel.addMask(m, mask, self.servername, int(time.time())):
+            return
+        if self.conn:
+            self.conn.scmode(channel, '+%s %s' % (m, mask))
+        entry = channel.getMask(m, mask)
+        self.timers.callLater(duration, self.expireBan, channel, m, entry)
+
+    def expireBan(self, channel, m, entry):
+        # the channel may have been destroyed, or the entry removed or
+        # replaced, in the meantime
+        if self.chans.get(channel.name) is not channel or \
+                channel.getMask(m, entry.mask) is not entry:
+            return
+        channel.removeMask(m, entry.mask)
+        if self.conn:
+            self.conn.scmode(channel, '-%s %s' % (m, entry.mask))
 
-    def Kill(self, killer, killee, message):
-        pass
+    def Kill(self, killer, uid, message):
+        """
+        A remote user is torn down as for a quit. One of our pseudoclients
+        is gone from the rest of the network but not from us, so it is
+        introduced again, with its login and channels.
+        """
+        if uid[:3] != self.sid:
+            self.Quit(uid, 'Killed (%s)' % (message,))
+            return
+        c = self.cbyuid[uid]
+        print '%s killed by %s (%s), reintroducing' % (c, killer, message)
+        conn = self.conn
+        conn.introduce(c)
+        if c.login:
+            conn.login(c, c.login)
+        for h in self.chansbyuid[uid]:
+            conn.burstchan(h, (uid,))
 
-    def addServer(self, server):
+    def addServer(self, server, uplink=None):
+        """
+        Link server in below uplink and return it. A server kept over a
+        relink is updated in place and returned instead, since its users
+        still refer to it.
+        """
+        if self.stalesids is not None and server.sid in self.stalesids:
+            self.stalesids.discard(server.sid)
+            old = self.sbysid[server.sid]
+            if old.uplink is not None:
+                old.uplink.children.remove(old)
+            del(self.sbyname[old.name])
+            old.name = server.name
+            old.desc = server.desc
+            old.caps = server.caps
+            server = old
+        if uplink is None and self.staleTimer is not None:
+            # a new link; its burst reconciles the stale state
+            self.staleTimer.cancel()
+            self.staleTimer = None
+        server.uplink = uplink
+        if uplink is not None:
+            uplink.children.append(server)
         self.sbysid[server.sid] = server
         self.sbyname[server.name] = server
+        return server
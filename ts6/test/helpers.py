@@ -0,0 +1,112 @@
+"""
+A services server linked to a fake hub over a StringTransport, for tests.
+"""
+
+from twisted.internet import task
+from twisted.test.proto_helpers import StringTransport
+
+from ts6.client import TS6Client
+from ts6.ircd import IrcdFactory, IrcdConn
+from ts6.serverstate import ServerState
+from ts6.timer import TimingWheel
+
+
+class Bot(TS6Client):
+    """ a pseudoclient that records what it is told """
+    def __init__(self, *args, **kwargs):
+        TS6Client.__init__(self, *args, **kwargs)
+        self.log = []
+
+    def userJoined(self, c, ch):
+        self.log.append(('join', str(c), str(ch)))
+
+    def userLeft(self, c, ch, m):
+        self.log.append(('part', str(c), str(ch), m))
+
+    def userQuit(self, c, m):
+        self.log.append(('quit', str(c), m))
+
+    def modeChanged(self, s, d, added, removed):
+        self.log.append(('mode', str(d), added, removed))
+
+    def topicUpdated(self, c, ch, t):
+        self.log.append(('topic', str(ch), t))
+
+    def userRenamed(self, old, new):
+        self.log.append(('nick', old, str(new)))
+
+    def signedOn(self):
+        self.join('#test')
+
+
+class Conn(IrcdConn):
+    password = 'pw'
+
+
+class Factory(IrcdFactory):
+    protocol = Conn
+
+    def __init__(self, clock):
+        self.clock = clock
+        state = ServerState()
+        state.sid = '90B'
+        state.timers = TimingWheel(clock)
+        IrcdFactory.__init__(self, state)
+        self.bot = Bot(self, self.me, 'bot', modes='oS')
+        self.clients = [self.bot]
+        for c in self.clients:
+            self.state.addClient(c)
+            c.connectionMade()
+
+    def buildProtocol(self, addr):
+        p = IrcdFactory.buildProtocol(self, addr)
+        p.clock = self.clock
+        return p
+
+
+BURST = [
+    'PASS pw TS 6 :00A',
+    'CAPAB :QS EX IE KLN UNKLN ENCAP TB SERVICES EUID EOPMOD MLOCK REMOVE',
+    'SERVER hub.test 1 :hub',
+    ':00A SID leaf.test 2 01B :leaf',
+    ':00A EUID alice 1 1000 +i alice host.a.com 0 00AAAAAAA * * :Alice A',
+    ':01B EUID bob 2 1001 +i bob host.b.org 0 01BAAAAAA * bobacct :Bob B',
+    ':00A SJOIN 900 #test +nt :@00AAAAAAA +01BAAAAAA',
+    ':00A SJOIN 950 #other +ntk key :00AAAAAAA',
+    'PING :00A',
+]
+
+
+class Link(object):
+    """
+    One services server and its link. feed() hands lines to it as the hub
+    would and runs everything they schedule; sent() returns what it wrote.
+    """
+    def __init__(self, burst=True):
+        self.clock = task.Clock()
+        self.factory = Factory(self.clock)
+        self.state = self.factory.state
+        self.bot = self.factory.bot
+        self.connect()
+        if burst:
+            self.feed(*BURST)
+
+    def connect(self):
+        self.transport = StringTransport()
+        self.conn = self.factory.buildProtocol(None)
+        self.conn.makeConnection(self.transport)
+
+    def lose(self):
+        """ lose the link, keeping its state as the factories here do """
+        self.conn.connectionLost(None)
+        self.state.markStale()
+
+    def feed(self, *lines):
+        self.conn.dataReceived(''.join([l + '\r\n' for l in lines]))
+        self.clock.advance(0)
+
+    def sent(self):
+        """ the lines written since the last call """
+        lines = self.transport.value().split('\r\n')[:-1]
+        self.transport.clear()
+        return lines
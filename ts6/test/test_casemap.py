@@ -0,0 +1,72 @@
+from twisted.trial import unittest
+
+from ts6.casemap import CaseMapping, IRCDict
+from ts6.serverstate import ServerState
+
+
+class CaseMappingTests(unittest.TestCase):
+    def test_rfc1459(self):
+        cm = CaseMapping('rfc1459')
+        self.assertEqual(cm.fold('Foo[]\\~'), 'foo{}|^')
+        self.assertTrue(cm.equal('NICK[a]', 'nick{A}'))
+
+    def test_strictRfc1459(self):
+        cm = CaseMapping('strict-rfc1459')
+        self.assertEqual(cm.fold('A[]\\~'), 'a{}|~')
+
+    def test_ascii(self):
+        cm = CaseMapping('ascii')
+        self.assertEqual(cm.fold('Foo[]\\~'), 'foo[]\\~')
+        self.assertFalse(cm.equal('a[', 'a{'))
+
+    def test_cacheBounded(self):
+        cm = CaseMapping()
+        cm.CACHE_MAX = 4
+        for i in range(10):
+            self.assertEqual(cm.fold('N%d' % i), 'n%d' % i)
+        self.assertTrue(len(cm.cache) <= 4)
+
+
+class IRCDictTests(unittest.TestCase):
+    def test_anySpelling(self):
+        d = IRCDict(CaseMapping(), {'Nick[1]': 1})
+        self.assertEqual(d['NICK{1}'], 1)
+        self.assertIn('nick[1]', d)
+        self.assertEqual(d.keys(), ['nick{1}'])
+        del d['nick{1}']
+        self.assertEqual(d, {})
+        self.assertEqual(d.originals, {})
+
+    def test_remapFromOriginalKey(self):
+        # folded by rfc1459 first, 'a[' becomes 'a{'; refolding that under
+        # ascii would merge it with a real 'a{'
+        cm = CaseMapping('rfc1459')
+        d = IRCDict(cm, {'A[': 1})
+        cm.setName('ascii')
+        self.assertEqual(d.keys(), ['a['])
+        d['a{'] = 2
+        self.assertEqual(d['A['], 1)
+        self.assertEqual(d['a{'], 2)
+
+    def test_setNameRemapsEveryDict(self):
+        cm = CaseMapping('ascii')
+        a = IRCDict(cm, {'x[': 1})
+        b = IRCDict(cm, {'Y]': 2})
+        cm.setName('rfc1459')
+        self.assertEqual(a['X{'], 1)
+        self.assertEqual(b['y}'], 2)
+
+    def test_popAndSetdefault(self):
+        d = IRCDict(CaseMapping())
+        self.assertEqual(d.setdefault('Chan', []), [])
+        d.setdefault('CHAN', []).append(1)
+        self.assertEqual(d.pop('chan'), [1])
+        self.assertEqual(d.pop('chan', None), None)
+        self.assertEqual(d.originals, {})
+
+    def test_serverStateRemapsSharedDicts(self):
+        state = ServerState()
+        regs = IRCDict(state.casemap, {'Chan[': 1})
+        state.setCasemapping('ascii')
+        self.assertEqual(regs['chan['], 1)
+        self.assertNotIn('chan{', regs)
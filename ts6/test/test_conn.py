@@ -0,0 +1,126 @@
+from twisted.trial import unittest
+
+from ts6.conn import Conn
+from ts6.message import parse
+from ts6.test.helpers import Link, BURST
+
+
+class HandlerTableTests(unittest.TestCase):
+    def test_builtFromGotMethods(self):
+        class C(Conn):
+            def got_foo(self, msg):
+                pass
+        self.assertEqual(C.handlerTable()['FOO'], 'got_foo')
+        self.assertEqual(C.handlerTable()['PING'], 'got_ping')
+
+    def test_registerReachesBuiltSubclassTables(self):
+        class Base(Conn):
+            pass
+        class Sub(Base):
+            pass
+        self.assertNotIn('XYZZY', Sub.handlerTable())
+        Base.registerHandler('XYZZY', lambda self, msg: None)
+        self.assertIn('XYZZY', Base.handlerTable())
+        self.assertIn('XYZZY', Sub.handlerTable())
+
+    def test_dispatchCountsUnhandled(self):
+        seen = []
+        class C(Conn):
+            def got_foo(self, msg):
+                seen.append(msg.params)
+        c = C()
+        c.dispatch(parse('foo a b'))
+        c.dispatch(parse('BAR'))
+        self.assertEqual(seen, [['a', 'b']])
+        self.assertEqual(c.unhandled, {'BAR': 1})
+
+    def test_registerAfterConnect(self):
+        seen = []
+        class C(Conn):
+            def newClient(self, client):
+                pass
+        c = C()
+        c.addHandler('BAR', lambda msg: seen.append('own'))
+        c.dispatch(parse('FOO'))
+        self.assertEqual(c.unhandled, {'FOO': 1})
+        C.registerHandler('FOO', lambda self, msg: seen.append('foo'))
+        C.newClient = Conn.newClient.im_func
+        c.dispatch(parse('FOO'))
+        c.dispatch(parse('BAR'))
+        self.assertEqual(seen, ['foo', 'own'])
+        self.assertFalse(c.wantNewClient)
+        self.assertEqual(c.unhandled, {'FOO': 1})
+
+
+class BurstTests(unittest.TestCase):
+    def setUp(self):
+        self.link = Link(burst=False)
+        self.conn = self.link.conn
+        self.ended = []
+        self.conn.burstEnd = lambda: self.ended.append(True)
+        # keep our burst from running until the test resumes it
+        self.conn.pauseProducing()
+        self.link.feed(*BURST[:3])
+        self.link.sent()
+
+    def test_clientLinesWaitForBurst(self):
+        self.link.bot.msg(self.link.state.chans['#test'], 'hello')
+        self.conn.resumeProducing()
+        self.link.clock.advance(0)
+        sent = self.link.sent()
+        euid = [i for i, l in enumerate(sent) if ' EUID bot ' in l]
+        msg = [i for i, l in enumerate(sent) if 'PRIVMSG #test' in l]
+        self.assertEqual(len(euid), 1)
+        self.assertEqual(len(msg), 1)
+        self.assertTrue(euid[0] < msg[0])
+
+    def test_burstEndWaitsForBothSides(self):
+        self.link.feed(*BURST[3:])
+        self.assertEqual(self.ended, [])
+        self.conn.resumeProducing()
+        self.link.clock.advance(0)
+        self.assertEqual(self.ended, [True])
+
+    def test_burstEndAfterOurBurst(self):
+        self.conn.resumeProducing()
+        self.link.clock.advance(0)
+        self.assertEqual(self.ended, [])
+        self.link.feed(*BURST[3:])
+        self.assertEqual(self.ended, [True])
+
+
+class KillTests(unittest.TestCase):
+    def setUp(self):
+        self.link = Link()
+        self.link.sent()
+        self.state = self.link.state
+
+    def test_remoteUserRemoved(self):
+        self.link.feed(':01BAAAAAA KILL 00AAAAAAA :leaf!bob (spam)')
+        self.assertFalse(self.state.hasClient('00AAAAAAA'))
+        self.assertNotIn('00AAAAAAA', self.state.chans['#test'].members)
+        self.assertIn(('quit', 'alice!alice@host.a.com', 'Killed (leaf!bob (spam))'),
+                      self.link.bot.log)
+
+    def test_pseudoclientReintroduced(self):
+        uid = self.link.bot.uid
+        self.link.feed(':00AAAAAAA KILL %s :hub!alice (bye)' % (uid,))
+        sent = self.link.sent()
+        self.assertTrue(sent[0].startswith(':90B EUID bot 1 '))
+        self.assertIn(':90B SJOIN 900 #test +nt :%s' % (uid,), sent)
+        self.assertTrue(self.state.hasClient(uid))
+        self.assertIn(uid, self.state.chans['#test'].members)
+
+
+class HackSjoinTests(unittest.TestCase):
+    def test_keepsOurOp(self):
+        link = Link()
+        link.sent()
+        h = link.state.chans['#test']
+        uid = link.bot.uid
+        link.conn.hack_sjoin(link.bot, h)
+        link.clock.advance(0)
+        self.assertEqual(h.ts, 899)
+        self.assertTrue(h.isOp(uid))
+        self.assertFalse(h.isOp('00AAAAAAA'))
+        self.assertEqual(link.sent(), [':90B SJOIN 899 #test + :@%s' % (uid,)])
@@ -0,0 +1,107 @@
+from twisted.internet import task
+from twisted.test.proto_helpers import StringTransport
+from twisted.trial import unittest
+
+from ts6.framing import LineFramer
+
+
+class Framer(LineFramer):
+    MAX_LENGTH = 20
+
+    def __init__(self):
+        self.lines = []
+        self.exceeded = []
+
+    def lineReceived(self, line):
+        self.lines.append(line)
+
+    def lineLengthExceeded(self, line):
+        self.exceeded.append(line)
+
+
+class FramingTests(unittest.TestCase):
+    def setUp(self):
+        self.p = Framer()
+        self.p.makeConnection(StringTransport())
+
+    def feed(self, *chunks):
+        for c in chunks:
+            self.p.dataReceived(c)
+        return self.p.lines
+
+    def test_crlfAndLf(self):
+        self.assertEqual(self.feed('a\r\nb\nc\r\n'), ['a', 'b', 'c'])
+
+    def test_emptyLinesSkipped(self):
+        self.assertEqual(self.feed('\r\n\na\r\n\r\n'), ['a'])
+
+    def test_splitAcrossChunks(self):
+        self.assertEqual(self.feed('PI', 'NG :x', 'y\r', '\nPO', 'NG\n'),
+                         ['PING :xy', 'PONG'])
+
+    def test_pendingRemainderKept(self):
+        self.feed('abc\r\nde')
+        self.assertEqual(self.p.lines, ['abc'])
+        self.assertEqual(self.p.clearLineBuffer(), 'de')
+        self.assertEqual(self.feed('f\n'), ['abc', 'f'])
+
+    def test_longLine(self):
+        self.feed('x' * 30 + '\n')
+        self.assertEqual(self.p.lines, [])
+        self.assertEqual(self.p.exceeded, ['x' * 30])
+
+    def test_longRemainder(self):
+        self.feed('x' * 15, 'y' * 15)
+        self.assertEqual(self.p.exceeded, ['x' * 15 + 'y' * 15])
+
+    def test_longLineAcrossChunks(self):
+        self.feed('x' * 15, 'y' * 15 + '\nok\n')
+        self.assertEqual(self.p.exceeded, ['x' * 15 + 'y' * 15])
+
+
+
+
+class CooperativeFramer(Framer):
+    cooperative = True
+    LINES_PER_TURN = 2
+    BACKLOG_HIGH = 4
+    BACKLOG_LOW = 1
+
+
+class CooperativeTests(unittest.TestCase):
+    def setUp(self):
+        self.p = CooperativeFramer()
+        self.p.clock = task.Clock()
+        self.t = StringTransport()
+        self.p.makeConnection(self.t)
+
+    def test_batches(self):
+        self.p.dataReceived('1\n2\n3\n4\n5\n')
+        self.assertEqual(self.p.lines, ['1', '2'])
+        self.assertEqual(self.p.inboundBacklog(), 3)
+        self.assertEqual(len(self.p.clock.getDelayedCalls()), 1)
+        self.p.clock.advance(0)
+        self.assertEqual(self.p.lines, ['1', '2', '3', '4', '5'])
+        self.assertEqual(self.p.clock.getDelayedCalls(), [])
+
+    def test_pausesAndResumes(self):
+        self.p.dataReceived(''.join(['%d\n' % i for i in range(8)]))
+        self.assertEqual(self.t.producerState, 'paused')
+        self.p.clock.advance(0)
+        self.assertEqual(self.t.producerState, 'producing')
+        self.assertEqual(len(self.p.lines), 8)
+
+    def test_errorDropsLink(self):
+        def lineReceived(line):
+            if line == '2':
+                raise RuntimeError('boom')
+            self.p.lines.append(line)
+        self.p.lineReceived = lineReceived
+        self.p.dataReceived(''.join(['%d\n' % i for i in range(8)]))
+        self.assertEqual(self.p.lines, ['0', '1'])
+        self.assertEqual(self.t.producerState, 'paused')
+        self.p.clock.advance(0)
+        self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
+        self.assertTrue(self.t.disconnecting)
+        self.assertEqual(self.p.inboundBacklog(), 0)
+        self.assertEqual(self.p.clock.getDelayedCalls(), [])
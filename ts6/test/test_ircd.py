@@ -0,0 +1,33 @@
+from twisted.trial import unittest
+
+from ts6.channel import Channel
+from ts6.ircd import IrcdFactory
+
+
+class FactoryTests(unittest.TestCase):
+    def test_tablesNotShared(self):
+        a = IrcdFactory()
+        b = IrcdFactory()
+        self.assertNotIdentical(a.state, b.state)
+        self.assertNotIdentical(a.supports, b.supports)
+        self.assertNotIdentical(a.state.cmodes, b.state.cmodes)
+        a.supports.parse('PREFIX=(qaohv)~&@%+ CASEMAPPING=ascii')
+        self.assertEqual(a.state.cmodes.prefix, 'qaohv')
+        self.assertEqual(b.state.cmodes.prefix, 'ov')
+        self.assertEqual(a.state.casemap.name, 'ascii')
+        self.assertEqual(b.state.casemap.name, 'rfc1459')
+
+    def test_parseReconfigures(self):
+        f = IrcdFactory()
+        f.supports.parse('CHANMODES=beIq,k,flj,CFLMPQScgimnprstzT')
+        self.assertTrue(f.state.cmodes.isSimple('T'))
+
+    def test_masksFollowCasemapping(self):
+        f = IrcdFactory()
+        st = f.state
+        h = st.chans['#a'] = Channel(st.cmodes, '#a', '+', 1)
+        h.addMask('b', '*!*@Host[1]')
+        self.assertTrue(h.hasMask('b', '*!*@host{1}'))
+        f.supports.parse('CASEMAPPING=ascii')
+        self.assertFalse(h.hasMask('b', '*!*@host{1}'))
+        self.assertTrue(h.hasMask('b', '*!*@host[1]'))
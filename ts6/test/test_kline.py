@@ -0,0 +1,178 @@
+import socket
+
+from twisted.trial import unittest
+
+from ts6.kline import Kline, KlineStore, HostIndex, AddressIndex
+from ts6.kline import packAddress, parseCIDR
+from ts6.test.helpers import Link
+
+
+def v4(ip):
+    return socket.inet_pton(socket.AF_INET, ip)
+
+
+class KlineTests(unittest.TestCase):
+    def test_glob(self):
+        k = Kline('*', '*.Example.com', 'r')
+        self.assertTrue(k.matches('joe', 'a.example.com'))
+        self.assertFalse(k.matches('joe', 'example.com'))
+
+    def test_globOnAddress(self):
+        k = Kline('*', '10.1.*', 'r')
+        self.assertTrue(k.matches('joe', 'cloak.example', v4('10.1.2.3')))
+        self.assertFalse(k.matches('joe', 'cloak.example', v4('10.2.2.3')))
+        self.assertFalse(k.matches('joe', 'cloak.example'))
+
+    def test_cidr(self):
+        k = Kline('*', '10.0.0.0/8', 'r')
+        self.assertEqual(k.cidr, (4, 8, '\x0a'))
+        self.assertTrue(k.matches('joe', 'a.example', v4('10.200.1.1')))
+        self.assertFalse(k.matches('joe', 'a.example', v4('11.0.0.1')))
+        self.assertFalse(k.matches('joe', '10.0.0.1'))
+
+    def test_cidrOddPrefix(self):
+        k = Kline('*', '192.168.4.0/22', 'r')
+        self.assertTrue(k.matches('joe', 'h', v4('192.168.7.255')))
+        self.assertFalse(k.matches('joe', 'h', v4('192.168.8.0')))
+
+    def test_cidrIPv6(self):
+        k = Kline('*', '2001:db8::/32', 'r')
+        self.assertTrue(k.matches('joe', 'h', packAddress('2001:db8:1::5')))
+        self.assertFalse(k.matches('joe', 'h', packAddress('2001:db9::5')))
+        # an IPv4 address sharing the leading bytes is not in it
+        self.assertFalse(k.matches('joe', 'h', packAddress('32.1.13.184')))
+
+    def test_badCIDR(self):
+        self.assertRaises(ValueError, Kline, '*', '10.0.0.0/33', 'r')
+        self.assertRaises(ValueError, Kline, '*', '10.0.0.0/x', 'r')
+
+    def test_cloakIsGlob(self):
+        self.assertEqual(parseCIDR('unaffiliated/joe'), None)
+        k = Kline('*', 'unaffiliated/*', 'r')
+        self.assertTrue(k.matches('joe', 'unaffiliated/joe'))
+
+    def test_expired(self):
+        k = Kline('*', '*', 'r', expires=100)
+        self.assertFalse(k.expired(99))
+        self.assertTrue(k.expired(100))
+        self.assertFalse(Kline('*', '*', 'r').expired(1 << 40))
+
+
+class KlineStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.store = KlineStore()
+        self.klines = [Kline('*', '*.example.com', 'name'),
+                       Kline('*', '10.1.*', 'glob'),
+                       Kline('*', '10.0.0.0/8', 'cidr'),
+                       Kline('joe', '*', 'user'),
+                       Kline('*', '*.0.1', 'tail'),
+                       Kline('*', '*bad*', 'rest', expires=100)]
+        for k in self.klines:
+            self.store.add(k)
+
+    def reasons(self, *args, **kwargs):
+        return sorted([k.reason for k in self.store.match(*args, **kwargs)])
+
+    def test_match(self):
+        self.assertEqual(self.reasons('Joe', 'A.Example.com'),
+                         ['name', 'user'])
+        self.assertEqual(self.reasons('amy', 'h', v4('10.1.0.1')),
+                         ['cidr', 'glob', 'tail'])
+        self.assertEqual(self.reasons('amy', '10.1.0.1'), ['glob', 'tail'])
+        self.assertEqual(self.reasons('amy', 'badhost'), ['rest'])
+        self.assertEqual(self.reasons('amy', 'badhost', now=100), [])
+        self.assertEqual(self.reasons('amy', 'h', v4('11.1.2.1')), [])
+
+    def test_replaceAndRemove(self):
+        self.assertEqual(len(self.store), 6)
+        k = Kline('*', '10.0.0.0/8', 'again')
+        self.store.add(k)
+        self.assertEqual(len(self.store), 6)
+        self.assertIdentical(self.store.get('*', '10.0.0.0/8'), k)
+        for k in self.klines:
+            self.store.remove(k.user, k.host)
+        self.assertEqual(len(self.store), 0)
+        self.assertEqual(self.store.cidrs, {})
+        self.assertEqual(self.store.remove('*', 'nothing'), None)
+
+
+class IndexTests(unittest.TestCase):
+    def test_hostIndex(self):
+        i = HostIndex()
+        i.add('A.example.com', 'u1')
+        i.add('b.example.com', 'u2')
+        i.add('10.1.2.3', 'u3')
+        self.assertEqual(sorted(i.find('*.EXAMPLE.com')), ['u1', 'u2'])
+        self.assertEqual(i.find('10.1.*'), ['u3'])
+        i.remove('a.example.com', 'u1')
+        self.assertEqual(i.find('*.example.com'), ['u2'])
+        self.assertEqual(list(i.names.below(['com', 'example', 'a'])), [])
+
+    def test_addressIndex(self):
+        i = AddressIndex()
+        i.add(v4('10.1.2.3'), 'u1')
+        i.add(v4('10.1.2.3'), 'u2')
+        i.add(v4('10.9.0.1'), 'u3')
+        i.add(v4('11.0.0.1'), 'u4')
+        i.add(packAddress('2001:db8::1'), 'u5')
+        self.assertEqual(sorted(i.find('10.0.0.0/8')), ['u1', 'u2', 'u3'])
+        self.assertEqual(sorted(i.find('8.0.0.0/6')), ['u1', 'u2', 'u3', 'u4'])
+        self.assertEqual(sorted(i.find('10.1.*')), ['u1', 'u2'])
+        self.assertEqual(i.find('2001:db8::/64'), ['u5'])
+        self.assertEqual(i.find('2001:db8::*'), ['u5'])
+        self.assertEqual(i.find('*.example.com'), [])
+        i.remove(v4('10.1.2.3'), 'u1')
+        i.remove(v4('10.1.2.3'), 'u2')
+        i.remove(v4('11.0.0.1'), 'u4')
+        self.assertEqual(i.find('0.0.0.0/0'), ['u3'])
+        self.assertEqual(len(i.buckets), 2)
+
+
+class UsersMatchingTests(unittest.TestCase):
+    def setUp(self):
+        self.link = Link()
+        self.state = self.link.state
+        self.link.feed(
+            ':00A EUID carol 1 1002 +i carol c.example 10.1.2.3 00AAAAAAC '
+                '* * :C',
+            ':00A EUID dave 1 1003 +i dave spoof.example 0 00AAAAAAD '
+                'real.b.org * :D',
+            ':00A EUID erin 1 1004 +i erin e.example 2001:db8::e 00AAAAAAE '
+                '* * :E')
+
+    def kline(self, mask):
+        user, host = mask.split('@')
+        self.link.feed(':00AAAAAAA ENCAP * KLINE 0 %s %s :r' % (user, host))
+        return self.state.klines.get(user, host)
+
+    def test_host(self):
+        k = self.kline('*@*.b.org')
+        self.assertEqual(sorted(self.state.usersMatching(k)),
+                         ['00AAAAAAD', '01BAAAAAA'])
+        self.assertEqual(self.state.klinesFor('00AAAAAAD'), [k])
+
+    def test_cidr(self):
+        k = self.kline('*@10.0.0.0/8')
+        self.assertEqual(self.state.usersMatching(k), ['00AAAAAAC'])
+        self.assertEqual(self.state.klinesFor('00AAAAAAC'), [k])
+        k = self.kline('*@2001:db8::/48')
+        self.assertEqual(self.state.usersMatching(k), ['00AAAAAAE'])
+
+    def test_materializedAndRefreshed(self):
+        k = self.kline('carol@10.1.*')
+        self.assertEqual(self.state.Client('00AAAAAAC').ip, '10.1.2.3')
+        self.assertEqual(self.state.usersMatching(k), ['00AAAAAAC'])
+        self.link.lose()
+        self.link.connect()
+        self.link.feed(':00A EUID carol 1 1002 +i carol c.example 10.2.2.3 '
+                       '00AAAAAAC * * :C')
+        self.assertEqual(self.state.usersMatching(k), [])
+        self.assertEqual(self.state.addrindex.find('10.2.*'), ['00AAAAAAC'])
+
+    def test_quitLeavesIndex(self):
+        self.link.feed(':00AAAAAAC QUIT :bye')
+        self.assertEqual(self.state.addrindex.find('10.0.0.0/8'), [])
+
+    def test_badCIDRIgnored(self):
+        self.link.feed(':00AAAAAAA ENCAP * KLINE 0 * 10.0.0.0/40 :r')
+        self.assertEqual(len(self.state.klines), 0)
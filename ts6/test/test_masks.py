@@ -0,0 +1,172 @@
+from twisted.trial import unittest
+
+from ts6.casemap import CaseMapping
+from ts6.channel import Channel
+from ts6.masks import MaskList, Mask, normalize, UNKNOWN
+from ts6.modes import channelModes
+
+
+class User(object):
+    def __init__(self, nick, user, host, hiddenhost=None, login=None,
+                 gecos='Real Name', ip=None):
+        self.nick = nick
+        self.user = user
+        self.host = host
+        self.hiddenhost = hiddenhost
+        self.login = login
+        self.gecos = gecos
+        self.ip = ip
+
+
+class NormalizeTests(unittest.TestCase):
+    def test_completed(self):
+        self.assertEqual(normalize('nick'), 'nick!*@*')
+        self.assertEqual(normalize('user@host'), '*!user@host')
+        self.assertEqual(normalize('nick!user'), 'nick!user@*')
+        self.assertEqual(normalize('n!u@h'), 'n!u@h')
+
+
+class MaskTests(unittest.TestCase):
+    def setUp(self):
+        self.fold = CaseMapping('rfc1459').fold
+        self.alice = User('Alice[a]', '~alice', 'Host.Example.com',
+                          hiddenhost='cloak/alice', login='AliceAcct')
+
+    def matches(self, mask):
+        return Mask(mask, self.fold).matches(self.alice, self.fold)
+
+    def test_host(self):
+        self.assertTrue(self.matches('*!*@host.example.com'))
+        self.assertTrue(self.matches('*!*@*.EXAMPLE.com'))
+        self.assertTrue(self.matches('alice{A}!*@*'))
+        self.assertTrue(self.matches('*!*@cloak/alice'))
+        self.assertTrue(self.matches('*!?alice@*'))
+        self.assertFalse(self.matches('*!*@other.example.com'))
+        self.assertFalse(self.matches('*!alice@*'))
+
+    def test_address(self):
+        self.alice.ip = '10.1.2.3'
+        self.assertTrue(self.matches('*!*@10.1.2.3'))
+        self.assertTrue(self.matches('*!*@10.1.*'))
+        self.assertTrue(self.matches('*!*@10.0.0.0/8'))
+        self.assertTrue(self.matches('*!~alice@10.1.2.0/24'))
+        self.assertFalse(self.matches('*!bob@10.0.0.0/8'))
+        self.assertFalse(self.matches('*!*@10.1.3.0/24'))
+        self.alice.ip = '2001:DB8::5'
+        self.assertTrue(self.matches('*!*@2001:db8::/32'))
+        self.assertTrue(self.matches('*!*@2001:db8::5'))
+        self.assertFalse(self.matches('*!*@10.0.0.0/8'))
+
+    def test_noAddress(self):
+        self.assertFalse(self.matches('*!*@10.0.0.0/8'))
+        self.assertFalse(self.matches('*!*@10.0.0.0/99'))
+
+    def test_key(self):
+        self.assertEqual(Mask('*!*@Host.Com', self.fold).key,
+                         ('host', 'host.com'))
+        self.assertEqual(Mask('*!*@*.com', self.fold).key, None)
+        self.assertEqual(Mask('$a:Acct', self.fold).key, ('account', 'acct'))
+        self.assertEqual(Mask('$~a:acct', self.fold).key, None)
+        self.assertEqual(Mask('*!*@10.0.0.0/8', self.fold).key,
+                         ('net', (4, 8, '\x0a')))
+
+    def test_extbans(self):
+        self.assertTrue(self.matches('$a'))
+        self.assertTrue(self.matches('$a:aliceacct'))
+        self.assertTrue(self.matches('$a:alice*'))
+        self.assertFalse(self.matches('$a:bob'))
+        self.assertTrue(self.matches('$~a:bob'))
+        self.assertTrue(self.matches('$r:real*'))
+        self.assertTrue(self.matches('$x:alice{a}!~alice@*#real name'))
+        self.assertEqual(Mask('$z:foo', self.fold).kind, UNKNOWN)
+        self.assertFalse(self.matches('$z:foo'))
+
+    def test_notLoggedIn(self):
+        self.alice.login = None
+        self.assertFalse(self.matches('$a'))
+        self.assertTrue(self.matches('$~a'))
+
+
+class MaskListTests(unittest.TestCase):
+    def setUp(self):
+        self.casemap = CaseMapping('rfc1459')
+        self.l = MaskList(self.casemap)
+
+    def test_addRemove(self):
+        self.assertTrue(self.l.add('*!*@Bad.com', 'op', 5))
+        self.assertFalse(self.l.add('*!*@BAD.COM'))
+        self.assertIn('*!*@bad.com', self.l)
+        self.assertEqual(self.l.get('*!*@bad.com').setter, 'op')
+        self.assertEqual(self.l.remove('*!*@bad.COM').mask, '*!*@Bad.com')
+        self.assertEqual(self.l.remove('*!*@bad.com'), None)
+        self.assertEqual(len(self.l), 0)
+        self.assertEqual(self.l.index, {})
+
+    def test_matchIndexedAndRest(self):
+        for m in ('*!*@a.com', '*!*@b.com', '$a:acct', '*!*@*.net'):
+            self.l.add(m)
+        self.assertEqual(str(self.l.match(User('n', 'u', 'B.com'))),
+                         '*!*@b.com')
+        self.assertEqual(str(self.l.match(User('n', 'u', 'x.net'))),
+                         '*!*@*.net')
+        self.assertEqual(str(self.l.match(User('n', 'u', 'c.org',
+                                               login='ACCT'))), '$a:acct')
+        self.assertEqual(self.l.match(User('n', 'u', 'c.org')), None)
+
+    def test_matchByAddress(self):
+        for m in ('*!*@a.com', '*!*@10.1.2.3', '*!*@10.0.0.0/8',
+                  '*!*@10.9.0.0/16', '*!*@2001:db8::/32'):
+            self.l.add(m)
+        self.assertEqual(self.l.nets, {(4, 8): 1, (4, 16): 1, (16, 32): 1})
+        self.assertEqual(self.l.rest, set())
+        cloaked = User('n', 'u', 'cloak/n', ip='10.1.2.3')
+        self.assertEqual(str(self.l.match(cloaked)), '*!*@10.1.2.3')
+        cloaked.ip = '10.9.1.1'
+        self.assertIn(str(self.l.match(cloaked)),
+                      ('*!*@10.0.0.0/8', '*!*@10.9.0.0/16'))
+        cloaked.ip = '2001:db8::1'
+        self.assertEqual(str(self.l.match(cloaked)), '*!*@2001:db8::/32')
+        cloaked.ip = '11.0.0.1'
+        self.assertEqual(self.l.match(cloaked), None)
+        self.l.remove('*!*@10.0.0.0/8')
+        self.l.remove('*!*@10.9.0.0/16')
+        self.assertEqual(self.l.nets, {(16, 32): 1})
+
+    def test_orderKept(self):
+        for m in ('c', 'a', 'b'):
+            self.l.add(m)
+        self.assertEqual([str(m) for m in self.l], ['c', 'a', 'b'])
+
+    def test_remap(self):
+        self.l.add('*!*@h[1]')
+        self.casemap.setName('ascii')
+        self.l.remap()
+        self.assertIn('*!*@h[1]', self.l)
+        self.assertNotIn('*!*@h{1}', self.l)
+        self.assertEqual(self.l.match(User('n', 'u', 'h{1}')), None)
+        self.assertEqual(str(self.l.match(User('n', 'u', 'H[1]'))),
+                         '*!*@h[1]')
+
+
+class ChannelListTests(unittest.TestCase):
+    def setUp(self):
+        self.h = Channel(channelModes(CaseMapping()), '#c', '+nt', 1)
+        self.bob = User('bob', 'bob', 'bad.com')
+
+    def test_banAndException(self):
+        self.h.applyModes([('b', '*!*@bad.com')], [], 'op')
+        self.assertTrue(self.h.isBanned(self.bob))
+        self.assertTrue(self.h.hasMode('b'))
+        self.h.applyModes([('e', 'bob!*@*')], [])
+        self.assertFalse(self.h.isBanned(self.bob))
+        self.h.applyModes([], [('b', '*!*@BAD.com'), ('e', 'bob!*@*')])
+        self.assertFalse(self.h.isBanned(self.bob))
+        self.assertEqual(self.h.lists, None)
+
+    def test_cidrBanOnCloakedUser(self):
+        self.bob.hiddenhost = 'cloak/bob'
+        self.bob.ip = '192.168.5.9'
+        self.h.applyModes([('b', '*!*@192.168.0.0/16')], [], 'op')
+        self.assertTrue(self.h.isBanned(self.bob))
+        self.h.applyModes([('e', '*!*@192.168.5.9')], [])
+        self.assertFalse(self.h.isBanned(self.bob))
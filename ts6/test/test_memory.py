@@ -0,0 +1,25 @@
+import os
+import subprocess
+import sys
+
+from twisted.trial import unittest
+
+import ts6
+
+top = os.path.dirname(os.path.dirname(os.path.abspath(ts6.__file__)))
+
+
+class MemoryBudgetTests(unittest.TestCase):
+    def test_userBudget(self):
+        """
+        bench-memory.py exits non-zero when a remote user costs more than
+        ServerState.USER_BUDGET; it runs in its own process so that only
+        the state it builds is measured.
+        """
+        env = dict(os.environ)
+        env['PYTHONPATH'] = top
+        p = subprocess.Popen([sys.executable,
+                              os.path.join(top, 'bench-memory.py'), '20000'],
+                             stdout=subprocess.PIPE, env=env)
+        out = p.communicate()[0]
+        self.assertEqual(p.returncode, 0, out)
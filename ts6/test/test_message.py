@@ -0,0 +1,49 @@
+from twisted.trial import unittest
+
+from ts6.message import parse
+
+
+class ParseTests(unittest.TestCase):
+    def check(self, line, source, command, params, trailing):
+        m = parse(line)
+        self.assertEqual((m.source, m.command, m.params, m.trailing),
+                         (source, command, params, trailing))
+
+    def test_plain(self):
+        self.check('PING', None, 'PING', [], None)
+
+    def test_sourceParamsTrailing(self):
+        self.check(':00AAAAAAA PRIVMSG #chan :hello there',
+                   '00AAAAAAA', 'PRIVMSG', ['#chan'], 'hello there')
+
+    def test_trailingOnly(self):
+        self.check('PING :00A', None, 'PING', [], '00A')
+
+    def test_emptyTrailing(self):
+        self.check(':00A TOPIC #c :', '00A', 'TOPIC', ['#c'], '')
+
+    def test_colonInsideTrailing(self):
+        self.check(':a B c :d :e f', 'a', 'B', ['c'], 'd :e f')
+
+    def test_colonInsideParam(self):
+        self.check(':a B c:d e', 'a', 'B', ['c:d', 'e'], None)
+
+    def test_repeatedSpaces(self):
+        self.check(':a  B  c   d :x', 'a', 'B', ['c', 'd'], 'x')
+        self.check('B c ', None, 'B', ['c'], None)
+
+    def test_noCommand(self):
+        self.assertRaises(ValueError, parse, '')
+        self.assertRaises(ValueError, parse, ':00A')
+        self.assertRaises(ValueError, parse, ':00A ')
+        self.assertRaises(ValueError, parse, ' ')
+
+    def test_unwrapEncap(self):
+        m = parse(':00A ENCAP * KLINE 0 u h :why')
+        m.unwrapEncap()
+        self.assertEqual((m.command, m.params, m.trailing),
+                         ('KLINE', ['0', 'u', 'h'], 'why'))
+
+    def test_str(self):
+        line = ':00A SJOIN 1 #c +nt :@00AAAAAAA'
+        self.assertEqual(str(parse(line)), line)
@@ -0,0 +1,30 @@
+from twisted.trial import unittest
+
+from ts6.modes import ModeTable
+
+
+class ModeTableTests(unittest.TestCase):
+    def setUp(self):
+        self.t = ModeTable('nt', 'kl', 'b', 'ov', '@+')
+
+    def test_simpleBits(self):
+        self.assertEqual(self.t.mask('+tn'), self.t.bit('n') | self.t.bit('t'))
+        self.assertEqual(self.t.render(self.t.mask('tnz')), '+ntz')
+
+    def test_prefixOrderFollowsPrefix(self):
+        op, voice = self.t.status('o'), self.t.status('v')
+        self.t.configure(prefix='qaohv', prefixchars='~&@%+')
+        self.assertEqual(self.t.prefix, 'qaohv')
+        # bits already handed out stay as they were
+        self.assertEqual(self.t.status('o'), op)
+        self.assertEqual(self.t.status('v'), voice)
+        self.assertEqual(self.t.op, op)
+        bits = self.t.statusFromChars('+~@')
+        self.assertEqual(self.t.statusChars(bits), '~@+')
+        self.assertEqual(self.t.statusModes(bits), ['q', 'o', 'v'])
+
+    def test_droppedPrefixRanksLast(self):
+        self.t.configure(prefix='oh', prefixchars='@%')
+        self.assertEqual(self.t.prefix, 'ohv')
+        self.assertEqual(self.t.statusChars(self.t.statusFromChars('+%')),
+                         '%+')
@@ -0,0 +1,125 @@
+from twisted.trial import unittest
+
+from ts6.sendq import SendQueue, LINK, STATE, BULK, SHED_OLDEST, SHED_NEWEST
+from ts6.test.helpers import Link
+
+
+class SendQueueTests(unittest.TestCase):
+    def setUp(self):
+        self.q = SendQueue((None, 100, 50))
+
+    def test_linkJumpsTheQueue(self):
+        self.q.push('PRIVMSG a', BULK)
+        self.q.push('PART b', STATE)
+        self.q.push('PONG c', LINK)
+        self.assertEqual(self.q.take(1000), ['PONG c', 'PRIVMSG a', 'PART b'])
+        self.assertEqual(self.q.total, 0)
+
+    def test_stateAndBulkKeepSendOrder(self):
+        lines = [('PRIVMSG #c :hi', BULK), ('PART #c', STATE),
+                 ('NOTICE x :bye', BULK), ('QUIT :gone', STATE)]
+        for line, prio in lines:
+            self.q.push(line, prio)
+        self.assertEqual(self.q.take(1000), [l for l, p in lines])
+
+    def test_takeLinkOnly(self):
+        self.q.push('PRIVMSG a', BULK)
+        self.q.push('PING b', LINK)
+        self.assertEqual(self.q.take(1000, LINK), ['PING b'])
+        self.assertEqual(self.q.depth(), {'link': (0, 0), 'state': (0, 0),
+                                          'bulk': (1, 11)})
+
+    def test_budget(self):
+        for i in range(5):
+            self.q.push('%d' % i, STATE)
+        self.assertEqual(self.q.take(6), ['0', '1'])
+        self.assertEqual(self.q.total, 9)
+
+    def test_limitRefusesWithoutDropping(self):
+        self.assertTrue(self.q.push('x' * 40, BULK))
+        self.assertFalse(self.q.push('y' * 40, BULK))
+        self.assertTrue(self.q.push('z' * 40, STATE))
+        self.assertEqual(self.q.take(1000), ['x' * 40, 'z' * 40])
+
+    def test_shedOldest(self):
+        q = SendQueue((None, 100, 50), SHED_OLDEST)
+        q.push('a' * 20, BULK)
+        q.push('PART #c', STATE)
+        q.push('b' * 20, BULK)
+        self.assertTrue(q.push('c' * 20, BULK))
+        self.assertFalse(q.push('s' * 99, STATE))
+        self.assertEqual(q.droppedCounts(), {'link': 0, 'state': 0, 'bulk': 1})
+        self.assertEqual(q.depth()['bulk'], (2, 44))
+        self.assertEqual(q.take(1000), ['PART #c', 'b' * 20, 'c' * 20])
+        self.assertEqual(q.total, 0)
+
+    def test_shedNewest(self):
+        q = SendQueue((None, 100, 50), SHED_NEWEST)
+        q.push('a' * 20, BULK)
+        q.push('b' * 20, BULK)
+        self.assertTrue(q.push('c' * 20, BULK))
+        self.assertEqual(q.dropped[BULK], 1)
+        self.assertEqual(q.take(1000), ['a' * 20, 'b' * 20])
+
+    def test_shedEntriesDoNotPileUp(self):
+        q = SendQueue((None, 100, 50), SHED_OLDEST)
+        for i in range(1000):
+            q.push('%020d' % i, BULK)
+        self.assertTrue(len(q.queue) <= 8)
+        self.assertEqual(q.take(1000), ['%020d' % 998, '%020d' % 999])
+        self.assertEqual(q.dropped[BULK], 998)
+        self.assertEqual(q.shedcount, 0)
+
+
+class ConnSendTests(unittest.TestCase):
+    def setUp(self):
+        self.link = Link()
+        self.link.sent()
+        self.conn = self.link.conn
+
+    def test_messageNotWrittenAfterLaterPart(self):
+        self.conn.sendLine(':90BAAAAAA PRIVMSG #test :bye', BULK)
+        self.conn.sendLine(':90BAAAAAA PART #test', STATE)
+        self.conn.sendLine('PONG :00A', LINK)
+        self.link.clock.advance(0)
+        self.assertEqual(self.link.sent(), ['PONG :00A',
+                                            ':90BAAAAAA PRIVMSG #test :bye',
+                                            ':90BAAAAAA PART #test'])
+
+    def test_pausedWritesOnlyLink(self):
+        self.conn.pauseProducing()
+        self.conn.sendLine('NOTICE x :y', BULK)
+        self.conn.sendLine('PONG :00A', LINK)
+        self.link.clock.advance(0)
+        self.assertEqual(self.link.sent(), ['PONG :00A'])
+        self.conn.resumeProducing()
+        self.assertEqual(self.link.sent(), ['NOTICE x :y'])
+
+    def flood(self, prio):
+        """ send one line more than fits; returns how many fit """
+        self.conn.pauseProducing()
+        line = 'NOTICE x :' + 'y' * 400
+        fit = self.conn.SENDQ_LIMITS[prio] / (len(line) + 2)
+        for i in range(fit + 1):
+            self.conn.sendLine(line, prio)
+        return fit
+
+    def test_stateOverflowDropsLink(self):
+        self.flood(STATE)
+        self.assertTrue(self.link.transport.disconnecting)
+
+    def test_stateOverflowDiscards(self):
+        self.conn.SENDQ_DROP_LINK = False
+        fit = self.flood(STATE)
+        self.assertFalse(self.link.transport.disconnecting)
+        self.assertEqual(self.conn.sendqDropped()['state'], 1)
+        self.assertEqual(self.conn.sendqDepth()['state'][0], fit)
+
+    def test_bulkOverflowSheds(self):
+        fit = self.flood(BULK)
+        self.conn.sendLine('PONG :00A', LINK)
+        self.assertFalse(self.link.transport.disconnecting)
+        self.assertEqual(self.conn.sendqDropped()['bulk'], 1)
+        self.assertEqual(self.conn.sendqDepth()['bulk'][0], fit)
+        self.link.clock.advance(0)
+        self.assertEqual(self.link.sent(), ['PONG :00A'])
@@ -0,0 +1,163 @@
+from twisted.trial import unittest
+
+from ts6.test.helpers import Link, BURST
+
+
+class ResyncTests(unittest.TestCase):
+    def setUp(self):
+        self.link = Link()
+        self.link.feed(':00A BMASK 900 #test b :*!*@a.com *!*@b.com')
+        self.state = self.link.state
+        self.bot = self.link.bot
+        del self.bot.log[:]
+
+    def relink(self, *lines):
+        self.link.lose()
+        self.link.connect()
+        self.link.feed(*lines)
+
+    def burst(self, **replace):
+        """ BURST with the SJOIN for some channels replaced """
+        lines = []
+        for l in BURST:
+            if ' SJOIN ' in l:
+                name = l.split()[3]
+                l = replace.get(name, l)
+                if l is None:
+                    continue
+            if l.startswith('PING'):
+                lines.extend(replace.get('extra', ()))
+            lines.append(l)
+        return lines
+
+    def test_unchangedIsSilent(self):
+        self.relink(*self.burst(extra=[
+            ':00A BMASK 900 #test b :*!*@a.com *!*@b.com']))
+        self.assertEqual(self.bot.log, [])
+        self.assertFalse(self.state.resyncing())
+
+    def test_lostMembershipParted(self):
+        carol = ':00A EUID carol 1 1002 +i carol host.c.net 0 00AAAAAAC * * :C'
+        self.link.feed(carol, ':00A SJOIN 950 #other + :00AAAAAAC')
+        self.relink(*self.burst(extra=[carol]))
+        self.assertEqual(self.state.chansbyuid['00AAAAAAC'], set())
+        self.assertNotIn('00AAAAAAC', self.state.chans['#other'].members)
+        # nobody of ours was there to tell, so no Client was built
+        self.assertNotIn('00AAAAAAC', self.state.cbyuid)
+
+    def test_lostMembershipReported(self):
+        self.relink(*self.burst(**{
+            '#test': ':00A SJOIN 900 #test +nt :@00AAAAAAA'}))
+        self.assertIn(('part', 'bob!bob@host.b.org', '#test', 'netsplit'),
+                      self.bot.log)
+
+    def test_removedModesReported(self):
+        self.relink(*self.burst(**{
+            '#test': ':00A SJOIN 900 #test +n :@00AAAAAAA +01BAAAAAA',
+            '#other': ':00A SJOIN 950 #other +nt :00AAAAAAA'}))
+        self.assertIn(('mode', '#test', [], [('t', None)]), self.bot.log)
+        self.assertEqual(self.state.chans['#other'].modeparams, {})
+
+    def test_removedMasksReported(self):
+        self.relink(*self.burst(extra=[':00A BMASK 900 #test b :*!*@a.com']))
+        self.assertEqual([m.mask for m in self.state.chans['#test'].masks('b')],
+                         ['*!*@a.com'])
+        self.assertIn(('mode', '#test', [], [('b', '*!*@b.com')]),
+                      self.bot.log)
+
+    def test_lostStatusReported(self):
+        self.relink(*self.burst(**{
+            '#test': ':00A SJOIN 900 #test +nt :00AAAAAAA +01BAAAAAA'}))
+        h = self.state.chans['#test']
+        self.assertFalse(h.isOp('00AAAAAAA'))
+        self.assertIn(('mode', '#test', [], [('o', '00AAAAAAA')]),
+                      self.bot.log)
+
+    def test_lostStatusOnLaterSJOINLine(self):
+        self.relink(*self.burst(**{
+            '#test': ':00A SJOIN 900 #test +nt :+01BAAAAAA',
+            'extra': [':00A SJOIN 900 #test +nt :+00AAAAAAA']}))
+        h = self.state.chans['#test']
+        self.assertFalse(h.isOp('00AAAAAAA'))
+        self.assertTrue(h.hasStatus('00AAAAAAA', 'v'))
+
+    def test_unsetTopicCleared(self):
+        self.link.feed(':00A TB #test 800 alice :hello')
+        del self.bot.log[:]
+        self.relink(*self.burst(extra=[
+            ':00A BMASK 900 #test b :*!*@a.com *!*@b.com']))
+        self.assertEqual(self.state.chans['#test'].topic, '')
+        self.assertIn(('topic', '#test', ''), self.bot.log)
+
+    def test_resentTopicKept(self):
+        self.link.feed(':00A TB #test 800 alice :hello')
+        del self.bot.log[:]
+        self.relink(*self.burst(extra=[
+            ':00A BMASK 900 #test b :*!*@a.com *!*@b.com',
+            ':00A TB #test 800 alice :hello']))
+        self.assertEqual(self.state.chans['#test'].topic, 'hello')
+        self.assertEqual(self.bot.log, [])
+
+    def test_deadline(self):
+        self.link.lose()
+        self.link.clock.advance(self.state.STALE_TIMEOUT + 1)
+        self.assertFalse(self.state.resyncing())
+        self.assertEqual(self.state.sbysid, {})
+        self.assertFalse(self.state.hasClient('00AAAAAAA'))
+        self.assertIn(('quit', 'alice!alice@host.a.com', 'netsplit'),
+                      self.bot.log)
+
+    def test_newLinkCancelsDeadline(self):
+        self.link.lose()
+        self.link.connect()
+        self.link.feed(*BURST[:3])
+        self.link.clock.advance(self.state.STALE_TIMEOUT + 1)
+        self.assertTrue(self.state.resyncing())
+        self.link.feed(*BURST[3:])
+        self.assertFalse(self.state.resyncing())
+        self.assertTrue(self.state.hasClient('00AAAAAAA'))
+
+
+class AddRemoteTests(unittest.TestCase):
+    def test_emptyGecos(self):
+        link = Link()
+        link.feed(':00A EUID carol 1 1002 +i carol host.c.net 0 00AAAAAAC * *')
+        self.assertEqual(link.state.Client('00AAAAAAC').gecos, '')
+
+
+class LoginIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.link = Link()
+        self.state = self.link.state
+
+    def test_burstLogins(self):
+        self.assertEqual(self.state.usersLoggedIn('BobAcct'), ['01BAAAAAA'])
+        self.assertEqual(self.state.usersLoggedIn('nobody'), [])
+
+    def test_su(self):
+        self.link.feed(':00A ENCAP * SU 00AAAAAAA :bobacct')
+        self.assertEqual(sorted(self.state.usersLoggedIn('bobacct')),
+                         ['00AAAAAAA', '01BAAAAAA'])
+        self.link.feed(':00A ENCAP * SU 01BAAAAAA')
+        self.assertEqual(self.state.usersLoggedIn('bobacct'), ['00AAAAAAA'])
+        self.assertEqual(self.state.Client('01BAAAAAA').login, None)
+
+    def test_encapLogin(self):
+        self.link.feed(':00AAAAAAA ENCAP * LOGIN :aliceacct')
+        self.assertEqual(self.state.usersLoggedIn('aliceacct'), ['00AAAAAAA'])
+        self.assertEqual(self.state.Client('00AAAAAAA').login, 'aliceacct')
+
+    def test_quitAndSquit(self):
+        self.link.feed(':00A ENCAP * SU 00AAAAAAA :bobacct')
+        self.link.feed(':00AAAAAAA QUIT :bye')
+        self.assertEqual(self.state.usersLoggedIn('bobacct'), ['01BAAAAAA'])
+        self.link.feed(':00A SQUIT 01B :gone')
+        self.assertEqual(dict(self.state.byaccount), {})
+
+    def test_relinkRefresh(self):
+        self.link.lose()
+        self.link.connect()
+        self.link.feed(*[l.replace(' bobacct ', ' otheracct ')
+                         for l in BURST])
+        self.assertEqual(self.state.usersLoggedIn('bobacct'), [])
+        self.assertEqual(self.state.usersLoggedIn('otheracct'), ['01BAAAAAA'])
@@ -0,0 +1,118 @@
+from twisted.internet import task
+from twisted.trial import unittest
+
+from ts6.timer import TimingWheel
+from ts6.test.helpers import Link
+
+
+class TimingWheelTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.wheel = TimingWheel(self.clock)
+        self.ran = []
+
+    def test_runsOnTimeNotEarly(self):
+        self.wheel.callLater(5, self.ran.append, 'a')
+        self.wheel.callLater(2.5, self.ran.append, 'b')
+        self.clock.advance(2)
+        self.assertEqual(self.ran, [])
+        self.clock.advance(1)
+        self.assertEqual(self.ran, ['b'])
+        self.clock.advance(2)
+        self.assertEqual(self.ran, ['b', 'a'])
+        self.assertEqual(len(self.wheel), 0)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_cancel(self):
+        t = self.wheel.callLater(5, self.ran.append, 'a')
+        self.assertTrue(t.active())
+        t.cancel()
+        self.assertFalse(t.active())
+        self.assertEqual(len(self.wheel), 0)
+        self.assertEqual(self.wheel.buckets, {})
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.clock.advance(10)
+        self.assertEqual(self.ran, [])
+
+    def test_cancelAfterRunIsHarmless(self):
+        t = self.wheel.callLater(1, self.ran.append, 'a')
+        self.wheel.callLater(9, self.ran.append, 'b')
+        self.clock.advance(1)
+        self.assertFalse(t.active())
+        t.cancel()
+        self.assertEqual(len(self.wheel), 1)
+        self.clock.advance(8)
+        self.assertEqual(self.ran, ['a', 'b'])
+
+    def test_cancelOtherDueInSameTick(self):
+        timers = []
+        def first(n):
+            self.ran.append(n)
+            for t in timers:
+                t.cancel()
+        timers.append(self.wheel.callLater(3, first, 1))
+        timers.append(self.wheel.callLater(3, first, 2))
+        self.clock.advance(3)
+        self.assertEqual(len(self.ran), 1)
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_rescheduleFromCallback(self):
+        def again():
+            self.ran.append(self.clock.seconds())
+            if len(self.ran) < 3:
+                self.wheel.callLater(2, again)
+        self.wheel.callLater(2, again)
+        self.clock.pump([1] * 10)
+        self.assertEqual(self.ran, [2, 4, 6])
+
+    def test_stall(self):
+        self.wheel.callLater(5, self.ran.append, 'a')
+        self.wheel.callLater(50000, self.ran.append, 'b')
+        self.clock.advance(100000)
+        self.assertEqual(sorted(self.ran), ['a', 'b'])
+
+    def test_failureDoesNotStopOthers(self):
+        def boom():
+            raise RuntimeError('boom')
+        self.wheel.callLater(1, boom)
+        self.wheel.callLater(1, self.ran.append, 'a')
+        self.clock.advance(1)
+        self.assertEqual(self.ran, ['a'])
+
+
+class ExpiryTests(unittest.TestCase):
+    def setUp(self):
+        self.link = Link()
+        self.state = self.link.state
+        self.clock = self.link.clock
+        self.link.sent()
+
+    def test_klineLapses(self):
+        self.clock.advance(1000)
+        self.link.feed(':00AAAAAAA ENCAP * KLINE 60 * *.b.org :r')
+        self.assertEqual(len(self.state.klines), 1)
+        self.clock.advance(59)
+        self.assertEqual(len(self.state.klines), 1)
+        self.clock.advance(1)
+        self.assertEqual(len(self.state.klines), 0)
+        self.assertEqual(len(self.state.timers), 0)
+
+    def test_unklineCancels(self):
+        self.clock.advance(1000)
+        self.link.feed(':00AAAAAAA ENCAP * KLINE 60 * *.b.org :r')
+        k = self.state.klines.get('*', '*.b.org')
+        self.link.feed(':00AAAAAAA ENCAP * UNKLINE * *.b.org')
+        self.assertFalse(k.timer.active())
+        self.assertEqual(len(self.state.timers), 0)
+
+    def test_timedBan(self):
+        self.clock.advance(1000)
+        h = self.state.chans['#test']
+        self.state.timedBan(h, '*!*@spam.example', 30)
+        self.clock.advance(0)
+        self.assertEqual(self.link.sent(),
+                         [':90B TMODE 900 #test +b *!*@spam.example'])
+        self.clock.advance(30)
+        self.assertEqual(self.link.sent(),
+                         [':90B TMODE 900 #test -b *!*@spam.example'])
+        self.assertEqual(len(self.state.timers), 0)
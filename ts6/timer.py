@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+import math
+from twisted.internet import reactor, task
+
+class Timer(object):
+    """
+    An item scheduled on a L{TimingWheel}.
+
+    @type tick: C{int}
+    @ivar tick: The bucket the item is in, or C{None} once it has run or
+    been cancelled.
+    """
+    __slots__ = ('wheel', 'tick', 'func', 'args')
+
+    def __init__(self, wheel, tick, func, args):
+        self.wheel = wheel
+        self.tick = tick
+        self.func = func
+        self.args = args
+
+    def active(self):
+        return self.tick is not None
+
+    def cancel(self):
+        """ unschedule the item; does nothing if it has already run """
+        if self.tick is not None:
+            self.wheel.remove(self)
+
+
+class TimingWheel(object):
+    """
+    Runs expiries for many items with one reactor timer between them.
+
+    Times are rounded up to whole ticks of TICK seconds and items are kept
+    in buckets keyed by absolute tick number, so scheduling and cancelling
+    are a set insert and removal whatever the number of items, and each
+    tick only touches the items due in it. A LoopingCall walks the buckets
+    once per tick while anything is scheduled and is stopped when the
+    wheel empties. Items run up to a tick late, never early.
+    """
+    TICK = 1.0
+
+    def __init__(self, clock=reactor):
+        self.clock = clock
+        self.buckets = {}   # tick number -> set of Timers due then
+        self.count = 0
+        self.next = None    # the first tick not yet run
+        self.loop = None
+
+    def __len__(self):
+        return self.count
+
+    def callAt(self, when, func, *args):
+        """ run func(*args) at UNIX time when; returns a L{Timer} """
+        tick = int(math.ceil(when / self.TICK))
+        if self.loop is None:
+            self.next = int(self.clock.seconds() // self.TICK)
+            self.loop = task.LoopingCall(self.run)
+            self.loop.clock = self.clock
+            self.loop.start(self.TICK, now=False)
+        # anything already due goes in the next bucket to be run
+        tick = max(tick, self.next)
+        t = Timer(self, tick, func, args)
+        self.buckets.setdefault(tick, set()).add(t)
+        self.count += 1
+        return t
+
+    def callLater(self, delay, func, *args):
+        return self.callAt(self.clock.seconds() + delay, func, *args)
+
+    def remove(self, t):
+        bucket = self.buckets[t.tick]
+        bucket.discard(t)
+        if not bucket:
+            del self.buckets[t.tick]
+        t.tick = None
+        self.count -= 1
+        if not self.count:
+            self.stop()
+
+    def stop(self):
+        if self.loop is not None:
+            if self.loop.running:
+                self.loop.stop()
+            self.loop = None
+
+    def run(self):
+        """ run every item due by now """
+        now = int(self.clock.seconds() // self.TICK)
+        if now - self.next > len(self.buckets):
+            # after a long stall, visiting the occupied buckets is cheaper
+            # than visiting every tick
+            ticks = sorted([k for k in self.buckets if k <= now])
+        else:
+            ticks = xrange(self.next, now + 1)
+        self.next = now + 1
+        buckets = self.buckets
+        for tick in ticks:
+            bucket = buckets.get(tick)
+            # taken one at a time, as an item may cancel others due with it
+            while bucket:
+                t = bucket.pop()
+                t.tick = None
+                self.count -= 1
+                try:
+                    t.func(*t.args)
+                except Exception, e:
+                    print 'timer %r failed: %s' % (t.func, e)
+            buckets.pop(tick, None)
+        if not self.count:
+            self.stop()
@@ -2,6 +2,7 @@
 
 from ts6.client import Client
 from ts6.ircd import IrcdFactory, IrcdConn
+from ts6.sendq import STATE
 from ts6.server import Server
 
 from usrv.a import A
@@ -10,8 +11,8 @@ from usrv.c import C
 class USrvConn(IrcdConn):
     password = 'acceptpw'
 
-    def sendLine(self, line):
-        IrcdConn.sendLine(self, line)
+    def sendLine(self, line, priority=STATE):
+        IrcdConn.sendLine(self, line, priority)
         print '-> %s' % line
 
     def lineReceived(self, line):
@@ -22,6 +23,7 @@ class USrvFactory(IrcdFactory):
     protocol = USrvConn
 
     def __init__(self):
+        IrcdFactory.__init__(self)
         self.state.sid = '90B'
         self.state.servername = 'ts6.grixis.local'
         self.state.serverdesc = 'usrv services'
@@ -32,7 +34,7 @@ class USrvFactory(IrcdFactory):
 
     def clientConnectionLost(self, connector, reason):
         print 'connection lost: %s' % (reason)
-        self.state.cleanNonLocal()
+        self.state.markStale()
         connector.connect()
 
 from twisted.internet import reactor
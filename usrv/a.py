@@ -1,3 +1,4 @@
+from ts6.casemap import IRCDict
 from usrv.service import Service
 import re
 import time
@@ -5,10 +6,14 @@ import time
 authserv = None
 
 class A(Service):
+    # accounts nobody has logged in to for this long are dropped
+    EXPIRE = 60 * 86400
+
     def __init__(self, factory, server, nick, *args, **kwargs):
         global authserv
         Service.__init__(self, factory, server, nick, *args, **kwargs)
-        self.accts = {}
+        self.accts = IRCDict(factory.state.casemap)
+        self.expiries = IRCDict(factory.state.casemap)  # account -> Timer
         if not authserv:
             authserv = self
             print 'Authserv: %s' % self
@@ -17,7 +22,32 @@ class A(Service):
         return re.match('^[a-zA-Z0-9_-]+$', name)
 
     def getacct(self, name):
-        return self.accts.get(name.lower(), None)
+        return self.accts.get(name, None)
+
+    def touch(self, name):
+        """ restart an account's expiry """
+        t = self.expiries.pop(name, None)
+        if t:
+            t.cancel()
+        self.accts[name]['seen'] = int(time.time())
+        self.expiries[name] = self.factory.state.timers.callLater(
+            self.EXPIRE, self.expire, name)
+
+    def expire(self, name):
+        self.expiries.pop(name, None)
+        if name in self.accts:
+            print 'Account %s expired' % name
+            self.dropacct(name)
+
+    def dropacct(self, name):
+        """ forget an account and log out everyone using it """
+        self.accts.pop(name, None)
+        t = self.expiries.pop(name, None)
+        if t:
+            t.cancel()
+        state = self.factory.state
+        for uid in state.usersLoggedIn(name):
+            self.conn.logout(state.Client(uid))
 
     def hasflag(self, src, flag):
         a = self.getacct(src.login)
@@ -59,6 +89,7 @@ class A(Service):
                                 'flags': '',
                                 'reg': int(time.time())
                             }
+        self.touch(aname)
         self.conn.login(src, aname)
         self.reply(src, 'Account %s registered.' % aname)
         if len(self.accts) == 1:
@@ -80,6 +111,7 @@ class A(Service):
             self.reply(src, 'Password mismatch.')
             return
         self.conn.login(src, aname)
+        self.touch(aname)
         self.reply(src, 'You are now logged in as %s.' % aname)
 
     # INFO <account>
@@ -117,8 +149,10 @@ class A(Service):
         if not src.login:
             self.reply(src, 'You are not logged in.')
             return
-        del self.accts[src.login.lower()]
-        self.conn.logout(src)
+        if not self.getacct(src.login):
+            self.reply(src, 'No account named %s.' % src.login)
+            return
+        self.dropacct(src.login)
         self.reply(src, 'Account deleted.')
 
     # FLAGS <account> <flags>
@@ -1,13 +1,40 @@
+from ts6.casemap import IRCDict
 from usrv.service import Service
 from usrv.a import authserv
+import time
 
 class C(Service):
+    # channels nobody with access has used for this long are dropped
+    EXPIRE = 30 * 86400
+
     def __init__(self, factory, server, nick, *args, **kwargs):
         Service.__init__(self, factory, server, nick, *args, **kwargs)
-        self.chans = {}
+        self.regs = IRCDict(factory.state.casemap)
+        self.expiries = IRCDict(factory.state.casemap)  # channel -> Timer
     
     def getchan(self, name):
-        return self.chans.get(name.lower(), None)
+        return self.regs.get(name, None)
+
+    def touch(self, name):
+        """ restart a channel registration's expiry """
+        t = self.expiries.pop(name, None)
+        if t:
+            t.cancel()
+        self.regs[name]['used'] = int(time.time())
+        self.expiries[name] = self.factory.state.timers.callLater(
+            self.EXPIRE, self.expire, name)
+
+    def expire(self, name):
+        self.expiries.pop(name, None)
+        if name in self.regs:
+            print 'Channel %s expired' % name
+            del self.regs[name]
+
+    def dropchan(self, name):
+        self.regs.pop(name, None)
+        t = self.expiries.pop(name, None)
+        if t:
+            t.cancel()
 
     def hasacs(self, cn, user, ac):
         c = self.getchan(cn)
@@ -50,7 +77,7 @@ class C(Service):
         if tf != 0:
             return
         self.reply(src, 'Dropping %s (no founders)' % cn)
-        del self.chans[cn.lower()]
+        self.dropchan(cn)
 
     # REGISTER <channel>
     def cmd_register(self, src, target, args):
@@ -64,13 +91,15 @@ class C(Service):
         if self.getchan(ap[0]):
             self.reply(src, 'Channel %s is already registered.' % ap[0])
             return
-        exc = self.conn.state.chans.get(ap[0].lower(), None)
+        exc = self.conn.state.chans.get(ap[0], None)
         if not exc:
             self.reply(src, 'Channel %s does not exist.' % ap[0])
             return
-        self.chans[ap[0].lower()] = { 'acl':
-                                        { src.login: 'afjorv' }
-                                    }
+        casemap = self.conn.state.casemap
+        self.regs[ap[0]] = { 'acl':
+                                IRCDict(casemap, { src.login: 'afjorv' })
+                            }
+        self.touch(ap[0])
         self.reply(src, 'Channel %s registered.' % ap[0])
 
     # DROP <channel>
@@ -82,7 +111,7 @@ class C(Service):
         if not self.hasacs(ap[0], src, 'f'):
             self.reply(src, 'No access.')
             return
-        del self.chans[ap[0].lower()]
+        self.dropchan(ap[0])
         self.reply(src, 'Channel %s dropped.' % ap[0])
 
     # RECOVER <channel>
@@ -94,10 +123,11 @@ class C(Service):
         if not self.hasacs(ap[0], src, 'r'):
             self.reply(src, 'No access.')
             return
-        ch = self.conn.state.chans.get(ap[0].lower(), None)
+        ch = self.conn.state.chans.get(ap[0], None)
         if not ch:
             self.reply(src, 'Channel %s is empty.' % ap[0])
             return
+        self.touch(ap[0])
         self.conn.hack_sjoin(self, ch)
         self.conn.scmode(ch, '+o %s' % src.uid)
         self.conn.part(self, ch, 'RECOVER by %s' % src)
@@ -122,7 +152,7 @@ class C(Service):
             self.reply(src, 'Done (%d entries)' % len(ks))
             return
         if len(ap) == 2:
-            u = ch['acl'].get(ap[1].lower(), '<none>')
+            u = ch['acl'].get(ap[1], '<none>')
             self.reply(src, 'Flags for %s on %s: %s' % (ap[1], ap[0], u))
             return
         if len(ap) == 3:
@@ -130,17 +160,17 @@ class C(Service):
                 self.reply(src, 'Access denied.')
                 return
             (add, remove) = self.parseflags(ap[2])
-            flz = list(ch['acl'].get(ap[1].lower(), ''))
+            flz = list(ch['acl'].get(ap[1], ''))
             for f in add:
                 flz.append(f)
             for f in remove:
                 flz.remove(f)
             flz = ''.join(flz)
             if flz:
-                ch['acl'][ap[1].lower()] = flz
+                ch['acl'][ap[1]] = flz
                 self.reply(src, 'Flags for %s on %s set to %s.' % (ap[1], ap[0], flz))
             else:
-                del ch['acl'][ap[1].lower()]
+                del ch['acl'][ap[1]]
                 self.reply(src, 'Flags for %s on %s deleted.' % (ap[1], ap[0]))
             self.checkfounders(src, ap[0])
             return
@@ -156,14 +186,18 @@ class C(Service):
         if not self.hasacs(chan, src, flag):
             self.reply(src, 'No access.')
             return
-        user = self.conn.state.cbynick.get(nick.lower(), None)
+        try:
+            user = self.conn.state.ClientByNick(nick)
+        except KeyError:
+            user = None
         if not user:
             self.reply(src, 'No client named %s.' % user)
             return
-        ch = self.conn.state.chans.get(chan.lower(), None)
+        ch = self.conn.state.chans.get(chan, None)
         if not ch:
             self.reply(src, '%s is empty.' % ch)
             return
+        self.touch(chan)
         self.conn.scmode(ch, '%s %s' % (mode, user.uid))
         self.reply(src, 'Set mode %s %s on %s.' % (mode, nick, chan))
 
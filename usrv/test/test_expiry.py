@@ -0,0 +1,89 @@
+from twisted.trial import unittest
+
+from ts6.test.helpers import Link
+from usrv.a import A
+from usrv.c import C
+
+
+class ExpiryTests(unittest.TestCase):
+    def setUp(self):
+        self.link = Link()
+        self.state = self.link.state
+        self.clock = self.link.clock
+        f = self.link.factory
+        self.a = A(f, f.me, 'A', modes='oS')
+        self.c = C(f, f.me, 'C', modes='oS')
+        for s in (self.a, self.c):
+            self.state.addClient(s)
+            s.conn = self.link.conn
+        self.bob = self.state.Client('01BAAAAAA')
+        self.link.sent()
+        # commands are handed a Client here, which reply can't notice
+        self.replies = []
+        self.a.reply = lambda src, msg: self.replies.append(msg)
+
+    def register(self, name):
+        self.a.accts[name] = {'pwd': 'pw', 'flags': '', 'reg': 0}
+        self.a.touch(name)
+
+    def test_accountExpiresAndLogsOut(self):
+        self.register('BobAcct')
+        self.clock.advance(A.EXPIRE - 1)
+        self.assertIn('bobacct', self.a.accts)
+        self.clock.advance(1)
+        self.assertEqual(dict(self.a.accts), {})
+        self.assertEqual(dict(self.a.expiries), {})
+        self.assertEqual(self.bob.login, None)
+        self.assertEqual(self.link.sent(), [':90B ENCAP * SU 01BAAAAAA'])
+
+    def test_recordLoggedOut(self):
+        self.link.feed(':00A EUID dan 1 1005 +i dan d.example 0 00AAAAAAD '
+                       '* bobacct :D')
+        self.register('bobacct')
+        self.clock.advance(A.EXPIRE)
+        self.assertEqual(self.state.Client('00AAAAAAD').login, None)
+        self.assertEqual(self.state.usersLoggedIn('bobacct'), [])
+
+    def test_touchRestartsExpiry(self):
+        self.register('bobacct')
+        self.clock.advance(A.EXPIRE - 10)
+        self.a.touch('bobacct')
+        self.clock.advance(20)
+        self.assertIn('bobacct', self.a.accts)
+        self.assertEqual(len(self.state.timers), 1)
+
+    def test_dropCancels(self):
+        self.register('bobacct')
+        t = self.a.expiries['bobacct']
+        self.a.cmd_drop(self.bob, self.a, '')
+        self.assertFalse(t.active())
+        self.assertEqual(dict(self.a.accts), {})
+        self.assertEqual(self.bob.login, None)
+        self.assertEqual(self.replies, ['Account deleted.'])
+
+    def test_dropWithoutTimer(self):
+        self.a.accts['bobacct'] = {'pwd': 'pw', 'flags': '', 'reg': 0}
+        self.a.cmd_drop(self.bob, self.a, '')
+        self.assertEqual(dict(self.a.accts), {})
+
+    def test_dropUnknownAccount(self):
+        self.a.cmd_drop(self.bob, self.a, '')
+        self.assertEqual(self.bob.login, 'bobacct')
+        self.assertEqual(self.replies, ['No account named bobacct.'])
+
+    def test_channelExpires(self):
+        self.c.regs['#test'] = {'acl': {}}
+        self.c.touch('#test')
+        self.clock.advance(C.EXPIRE)
+        self.assertEqual(dict(self.c.regs), {})
+        self.assertEqual(dict(self.c.expiries), {})
+
+    def test_dropchanCancels(self):
+        self.c.regs['#test'] = {'acl': {}}
+        self.c.touch('#test')
+        t = self.c.expiries['#test']
+        self.c.dropchan('#test')
+        self.assertFalse(t.active())
+        self.assertEqual(len(self.state.timers), 0)
+        # and again, with neither registration nor timer left
+        self.c.dropchan('#test')